@@ -0,0 +1,166 @@
+"""Benchmark decoding node stats responses, as the client's JSONSerializer does and into elasticstat's node records
+
+    python benchmarks/bench_decode.py --nodes 1000,5000 --versions 1,7 --save decode.json
+
+Each case (an Elasticsearch version, cluster size, payload and decoder) runs in its own process, reading the
+payload from a file written beforehand, so the peak RSS reported is that case's decoding alone.  The payloads are
+a synthetic cluster's node stats response:
+
+    filtered  trimmed by the filter_path elasticstat sends, as Elasticsearch 1.6+ returns it
+    full      with every metric group's human readable duplicates too (human=true), as returned by a server
+              ignoring filter_path
+
+and the decoders:
+
+    json       the client's JSONSerializer, leaving the whole response as nested dicts
+    projected  the client's JSONSerializer, then NodeStatsDecoder.project() into a flat record per node
+    records    NodeStatsSerializer with elasticstat's NodeStatsDecoder, decoding straight into a flat record per node
+
+Each decode is timed with the previous decode's result still held, as elasticstat holds the last update's
+responses while decoding the next.  Reports the decode time, the peak RSS over the payload alone and the objects
+the decoded response keeps alive.
+"""
+import argparse
+import gc
+import json
+import os
+import resource
+import shlex
+import shutil
+import subprocess
+import sys
+import tempfile
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from elasticstat import elasticstat  # noqa: E402
+import bench_tick  # noqa: E402
+import fake_es  # noqa: E402
+from synthetic import ES_VERSIONS, SyntheticCluster  # noqa: E402
+
+PAYLOADS = ['filtered', 'full']
+DECODERS = ['json', 'projected', 'records']
+COMPARED_METRICS = [('decode_ms', 'p50'), ('decode_ms', 'p95'), ('peak_kb', None), ('objects', None)]
+HUMAN_SUFFIXES = [('_in_bytes', "{0:.1f}kb", 1024.0), ('_in_millis', "{0:.1f}s", 1000.0)]
+
+
+def humanize(stats):
+    """Add the human readable duplicate of each byte size and time in stats, as human=true does"""
+    for key, value in list(stats.items()):
+        if isinstance(value, dict):
+            humanize(value)
+            continue
+        for suffix, human_format, scale in HUMAN_SUFFIXES:
+            if key.endswith(suffix) and isinstance(value, (int, long, float)):
+                stats[key[:-len(suffix)]] = human_format.format(value / scale)
+    return stats
+
+
+def build_elasticstat(es_version, options):
+    """An Elasticstat for the options benchmarked, requesting and decoding node stats as it would from es_version"""
+    args = elasticstat.build_parser().parse_args(shlex.split(options.elasticstat_args) + ['-o', os.devnull])
+    args.hostlist = 'synthetic'
+    return elasticstat.Elasticstat(args, es_client=SyntheticCluster(1, es_version).client())
+
+
+def write_payload(path, es_version, nodes, payload, options):
+    cluster = SyntheticCluster(nodes, es_version, seed=options.seed)
+    cluster.tick()
+    response = cluster.nodes_stats()
+    if payload == 'filtered':
+        response = fake_es.filter_response(response, build_elasticstat(es_version, options).nodes_stats_params['filter_path'])
+    else:
+        humanize(response)
+    with open(path, 'w') as payload_file:
+        json.dump(response, payload_file, separators=(',', ':'))
+
+
+def run_case(es_version, nodes, payload, decoder, options):
+    """Benchmark one case, returning its results"""
+    serializer = elasticstat.NodeStatsSerializer()
+    loads = serializer.loads
+    if decoder == 'records':
+        serializer.local.decoder = build_elasticstat(es_version, options).node_decoder
+    elif decoder == 'projected':
+        node_decoder = build_elasticstat(es_version, options).node_decoder
+        loads = lambda s: node_decoder.project(serializer.loads(s))  # noqa: E731
+    with open(options.payload_file) as payload_file:
+        # the client hands the serializer the body decoded to unicode
+        body = payload_file.read().decode('utf-8')
+
+    gc.collect()
+    base_kb = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    objects_before = len(gc.get_objects())
+    response = loads(body)
+    objects = len(gc.get_objects()) - objects_before
+    decode_ms = []
+    for run in range(options.runs):
+        started = bench_tick.timer()
+        latest = loads(body)
+        decode_ms.append((bench_tick.timer() - started) * 1000)
+        response = latest  # the last response is only let go once the next is decoded
+    del latest, response
+    return {'case': "es{0}-{1}-{2}-{3}".format(es_version, nodes, payload, decoder), 'version': ES_VERSIONS[es_version],
+            'nodes': nodes, 'payload': payload, 'decoder': decoder, 'payload_kb': len(body) / 1024.0,
+            'decode_ms': bench_tick.summarize(decode_ms), 'objects': objects,
+            'peak_kb': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss - base_kb}
+
+
+def run_cases(options):
+    results = []
+    payload_dir = tempfile.mkdtemp(prefix='elasticstat-decode-')
+    try:
+        for es_version in options.versions.split(','):
+            for nodes in options.nodes.split(','):
+                for payload in options.payloads.split(','):
+                    path = os.path.join(payload_dir, 'payload.json')
+                    write_payload(path, es_version, int(nodes), payload, options)
+                    for decoder in DECODERS:
+                        command = [sys.executable, os.path.abspath(__file__),
+                                   '--case', "{0}:{1}:{2}:{3}".format(es_version, nodes, payload, decoder),
+                                   '--payload-file', path, '--runs', str(options.runs), '--args=' + options.elasticstat_args]
+                        output = subprocess.check_output(command)
+                        results.append(json.loads(output.decode('utf-8').strip().splitlines()[-1]))
+                        print_result(results[-1])
+    finally:
+        shutil.rmtree(payload_dir)
+    return results
+
+
+def print_result(result):
+    print "{0:28} {1:>9.1f}  decode ms {2:24} peak rss +{3:>7}kb objects {4:>8}".format(
+        result['case'], result['payload_kb'], bench_tick.format_summary(result['decode_ms']), result['peak_kb'],
+        result['objects'])
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--nodes', default='1000,5000', help='Cluster sizes to run (default: 1000,5000)')
+    parser.add_argument('--versions', default='7',
+                        help='Elasticsearch major versions to run, from {0} (default: 7)'.format(','.join(ES_VERSIONS)))
+    parser.add_argument('--payloads', default=','.join(PAYLOADS),
+                        help='Payloads to decode, from {0} (default: all)'.format(','.join(PAYLOADS)))
+    parser.add_argument('--runs', type=int, default=10, help='Decodes measured per case (default: 10)')
+    parser.add_argument('--seed', type=int, default=0, help='Seed for the synthetic cluster (default: 0)')
+    parser.add_argument('--args', dest='elasticstat_args', default='-c all -C',
+                        help='elasticstat options whose fields are decoded (default: "-c all -C")')
+    parser.add_argument('--save', metavar='FILE', help='Save the results to FILE')
+    parser.add_argument('--compare', metavar='FILE', help='Compare the results with those saved in FILE')
+    parser.add_argument('--case', help=argparse.SUPPRESS)
+    parser.add_argument('--payload-file', help=argparse.SUPPRESS)
+    options = parser.parse_args()
+
+    if options.case is not None:
+        # a single case, run in its own process by run_cases
+        es_version, nodes, payload, decoder = options.case.split(':')
+        print json.dumps(run_case(es_version, int(nodes), payload, decoder, options))
+        return
+
+    results = run_cases(options)
+    if options.save:
+        bench_tick.save_results(options.save, options, results)
+    if options.compare:
+        bench_tick.compare(bench_tick.load_results(options.compare), results, COMPARED_METRICS)
+
+
+if __name__ == "__main__":
+    main()
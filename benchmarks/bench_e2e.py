@@ -0,0 +1,139 @@
+"""Benchmark elasticstat end to end, over HTTP against a fake Elasticsearch server
+
+    python benchmarks/bench_e2e.py --nodes 500 --latency nodes_stats=200 --jitter all=50 --interval 1 --save e2e.json
+
+Starts benchmarks/fake_es.py in its own process (every fake_es.py option is accepted, to set the cluster size,
+latency, jitter, errors, auth and TLS), then runs elasticstat's own update loop against it with the real
+Elasticsearch client.  Reports how long each request took, how long each whole update took from the start of the
+tick to the table being written, and how many responses were stale and updates overran.
+"""
+import os
+import socket
+import subprocess
+import sys
+import time
+
+from elasticsearch import Elasticsearch
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from elasticstat import elasticstat  # noqa: E402
+import bench_tick  # noqa: E402
+import fake_es  # noqa: E402
+
+COMPARED_METRICS = [('cluster_health_ms', 'p50'), ('nodes_stats_ms', 'p50'), ('nodes_stats_ms', 'p95'),
+                    ('active_master_ms', 'p50'), ('tick_ms', 'p50'), ('tick_ms', 'p95'), ('tick_ms', 'max'),
+                    ('stale', None), ('overruns', None)]
+REQUESTS = ['cluster_health', 'nodes_stats', 'active_master']
+
+
+def free_port():
+    listener = socket.socket()
+    listener.bind(('localhost', 0))
+    port = listener.getsockname()[1]
+    listener.close()
+    return port
+
+
+def start_fake_es(fake_es_args):
+    """Start fake_es.py in its own process, returning the process once it is serving"""
+    command = [sys.executable, os.path.join(os.path.dirname(os.path.abspath(__file__)), 'fake_es.py')] + fake_es_args
+    server = subprocess.Popen(command, stdout=subprocess.PIPE)
+    server.stdout.readline()  # "Serving ..." once listening
+    return server
+
+
+def fake_es_arguments(options, listen):
+    """The fake_es.py command line for the fake_es.py options given"""
+    fake_es_args = ['--listen', listen, '--nodes', str(options.nodes), '--version', options.version,
+                    '--churn', str(options.churn), '--seed', str(options.seed), '--pad', str(options.pad),
+                    '--indices', str(options.indices), '--shards', str(options.shards), '--replicas', str(options.replicas)]
+    for name in ['latency', 'jitter', 'errors']:
+        for endpoint, value in getattr(options, name) or []:
+            fake_es_args += ['--' + name, "{0}={1}".format(endpoint, value)]
+    for name in ['script', 'user', 'certfile', 'keyfile']:
+        if getattr(options, name):
+            fake_es_args += ['--' + name, getattr(options, name)]
+    return fake_es_args
+
+
+def run(options, url):
+    # measured from a cold start every time, and without leaving the fake server in the discovery cache
+    elasticstat_args = options.elasticstat_args.split() + ['-h', url, '--timeout', str(options.timeout or options.interval),
+                                                           '--discovery-ttl', '0']
+    if options.user:
+        username, _, password = options.user.partition(':')
+        elasticstat_args += ['-u', username, '-p', password]
+    args = elasticstat.build_parser().parse_args(elasticstat_args)
+    args.hostlist = url
+    args.delay_interval = options.interval  # may be a fraction of a second, which DELAYINTERVAL can't
+    if options.certfile:
+        # the fake server's certificate is self-signed
+        stat = elasticstat.Elasticstat(args, es_client=Elasticsearch(
+            [url], http_auth=tuple(options.user.split(':', 1)) if options.user else None, verify_certs=False,
+            ssl_show_warn=False))
+    else:
+        stat = elasticstat.Elasticstat(args)
+    stat.frames = elasticstat.FrameWriter(open(os.devnull, 'w'))
+    stat.format_headings()
+
+    samples = dict((name + '_ms', []) for name in REQUESTS)
+    samples['tick_ms'] = []
+    stale = 0
+    for tick in range(options.warmup + options.ticks):
+        stat.scheduler.tick()
+        started = bench_tick.timer()
+        stat.now, stat.period, stat.overruns = time.time(), stat.scheduler.period, stat.scheduler.overruns
+        results, cluster_row, node_rows = stat.poll()
+        stat.output_tick(results, cluster_row, node_rows)
+        if tick >= options.warmup:
+            samples['tick_ms'].append((bench_tick.timer() - started) * 1000)
+            for name in REQUESTS:
+                if results[name].stale:
+                    stale += 1
+                else:
+                    samples[name + '_ms'].append(results[name].elapsed * 1000)
+        stat.scheduler.wait()
+    result = dict((name, bench_tick.summarize(values)) for name, values in samples.items())
+    result.update({'case': "es{0}-{1}".format(options.version, options.nodes), 'nodes': options.nodes,
+                   'stale': stale, 'overruns': stat.scheduler.overruns})
+    return result
+
+
+def print_result(result):
+    for name in REQUESTS + ['tick']:
+        print "{0:18} ms {1}".format(name, bench_tick.format_summary(result[name + '_ms']))
+    print "{0:18}    {1}".format('stale responses', result['stale'])
+    print "{0:18}    {1}".format('overruns', result['overruns'])
+
+
+def main():
+    parser = fake_es.build_parser()
+    parser.description = __doc__.splitlines()[0]
+    parser.set_defaults(listen=None)
+    parser.add_argument('--ticks', type=int, default=20, help='Updates measured (default: 20)')
+    parser.add_argument('--warmup', type=int, default=2, help='Updates run before measuring (default: 2)')
+    parser.add_argument('--interval', type=float, default=1, help='elasticstat DELAYINTERVAL, in seconds (default: 1)')
+    parser.add_argument('--timeout', type=float, help='elasticstat --timeout (default: the interval)')
+    parser.add_argument('--args', dest='elasticstat_args', default='-c all -C',
+                        help='Other elasticstat options to benchmark with (default: "-c all -C")')
+    parser.add_argument('--save', metavar='FILE', help='Save the results to FILE')
+    parser.add_argument('--compare', metavar='FILE', help='Compare the results with those saved in FILE')
+    options = parser.parse_args()
+
+    listen = options.listen or "localhost:{0}".format(free_port())
+    server = start_fake_es(fake_es_arguments(options, listen))
+    try:
+        url = "{0}://{1}".format('https' if options.certfile else 'http', listen)
+        result = run(options, url)
+    finally:
+        server.terminate()
+    print_result(result)
+
+    if options.save:
+        bench_tick.save_results(options.save, options, [result])
+    if options.compare:
+        bench_tick.compare(bench_tick.load_results(options.compare), [result], COMPARED_METRICS)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,103 @@
+"""Benchmark how long elasticstat takes from starting to showing its first update
+
+    python benchmarks/bench_startup.py --latency all=20 --latency root=300 --save startup.json
+
+Starts benchmarks/fake_es.py in its own process (every fake_es.py option is accepted, so the requests made
+before the first update can be slowed down as a distant or struggling cluster would), then starts elasticstat
+afresh for each run, timing from starting its process to the first table being written:
+
+    cold    with an empty discovery cache, so the version (and with --fan-out the node list) is requested first
+    warm    with the discovery cache left by an earlier run, so the first update's requests are the only ones
+    import  just importing elasticstat, in a process of its own
+"""
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import bench_e2e  # noqa: E402
+import bench_tick  # noqa: E402
+import fake_es  # noqa: E402
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+CASES = ['cold', 'warm', 'import']
+COMPARED_METRICS = [('first_frame_ms', 'p50'), ('first_frame_ms', 'p95'), ('first_frame_ms', 'max')]
+
+
+def time_first_frame(command):
+    """Start command, returning the milliseconds until it writes its first line"""
+    started = bench_tick.timer()
+    process = subprocess.Popen(command, stdout=subprocess.PIPE, cwd=ROOT)
+    process.stdout.readline()
+    elapsed = (bench_tick.timer() - started) * 1000
+    process.terminate()
+    process.wait()
+    return elapsed
+
+
+def elasticstat_command(options, url, cache_dir):
+    command = [sys.executable, '-m', 'elasticstat.elasticstat', '-h', url, '--discovery-cache', cache_dir]
+    if options.user:
+        username, _, password = options.user.partition(':')
+        command += ['-u', username, '-p', password]
+    return command + options.elasticstat_args.split() + ['--', str(options.interval)]
+
+
+def run_case(case, options, url):
+    samples = []
+    cache_dir = tempfile.mkdtemp(prefix='elasticstat-cache-')
+    try:
+        if case == 'import':
+            command = [sys.executable, '-c', 'import elasticstat.elasticstat; print "imported"']
+        else:
+            command = elasticstat_command(options, url, cache_dir)
+        if case == 'warm':
+            time_first_frame(command)  # leaves the cache for the measured runs
+        for run in range(options.runs):
+            if case == 'cold':
+                shutil.rmtree(cache_dir)
+                os.mkdir(cache_dir)
+            samples.append(time_first_frame(command))
+    finally:
+        shutil.rmtree(cache_dir)
+    return {'case': case, 'nodes': options.nodes, 'first_frame_ms': bench_tick.summarize(samples)}
+
+
+def print_result(result):
+    print "{0:8} first frame ms {1}".format(result['case'], bench_tick.format_summary(result['first_frame_ms']))
+
+
+def main():
+    parser = fake_es.build_parser()
+    parser.description = __doc__.splitlines()[0]
+    parser.set_defaults(listen=None)
+    parser.add_argument('--runs', type=int, default=10, help='Starts measured per case (default: 10)')
+    parser.add_argument('--interval', type=int, default=1, help='elasticstat DELAYINTERVAL (default: 1)')
+    parser.add_argument('--args', dest='elasticstat_args', default='-c all -C',
+                        help='Other elasticstat options to start with (default: "-c all -C")')
+    parser.add_argument('--save', metavar='FILE', help='Save the results to FILE')
+    parser.add_argument('--compare', metavar='FILE', help='Compare the results with those saved in FILE')
+    options = parser.parse_args()
+    if options.certfile:
+        parser.error("the fake server's self-signed certificate would not be trusted; benchmark startup over HTTP")
+
+    listen = options.listen or "localhost:{0}".format(bench_e2e.free_port())
+    server = bench_e2e.start_fake_es(bench_e2e.fake_es_arguments(options, listen))
+    results = []
+    try:
+        for case in CASES:
+            results.append(run_case(case, options, "http://{0}".format(listen)))
+            print_result(results[-1])
+    finally:
+        server.terminate()
+
+    if options.save:
+        bench_tick.save_results(options.save, options, results)
+    if options.compare:
+        bench_tick.compare(bench_tick.load_results(options.compare), results, COMPARED_METRICS)
+
+
+if __name__ == "__main__":
+    main()
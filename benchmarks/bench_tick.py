@@ -0,0 +1,231 @@
+"""Benchmark elasticstat's per-tick processing and rendering on synthetic clusters
+
+    python benchmarks/bench_tick.py --nodes 10,100,1000,5000 --versions 1,2,5,7 --save before.json
+    (change elasticstat)
+    python benchmarks/bench_tick.py --nodes 10,100,1000,5000 --versions 1,2,5,7 --compare before.json
+
+Each case (an Elasticsearch version and cluster size) runs in its own process, so the peak RSS reported is that
+case's alone.  Each tick is timed in two parts: processing (process_tick: node registry, counters and typed values)
+and rendering (output_tick in the selected output format, written to /dev/null).  The net number of objects left
+allocated by a tick is counted with the garbage collector off.  Where tracemalloc is available, the bytes
+allocated and the peak memory traced during a tick are measured too, in a separate pass.
+"""
+import argparse
+import gc
+import json
+import os
+import platform
+import resource
+import shlex
+import subprocess
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from elasticstat import __version__, elasticstat  # noqa: E402
+from synthetic import ES_VERSIONS, SyntheticCluster  # noqa: E402
+
+try:
+    import tracemalloc
+except ImportError:
+    tracemalloc = None
+
+timer = getattr(time, 'perf_counter', time.time)
+
+# (metric, statistic) pairs compared between runs; lower is better for all of them
+COMPARED_METRICS = [('process_ms', 'p50'), ('process_ms', 'p95'), ('render_ms', 'p50'), ('render_ms', 'p95'),
+                    ('objects', 'p50'), ('traced_kb', 'p50'), ('peak_kb', 'max'), ('rss_kb', None)]
+
+
+def summarize(samples):
+    samples = sorted(samples)
+    if not samples:
+        return None
+    return {'p50': samples[len(samples) // 2], 'p95': samples[min(len(samples) - 1, int(len(samples) * 0.95))],
+            'max': samples[-1], 'mean': sum(samples) / float(len(samples))}
+
+
+class TickBench(object):
+    """Runs elasticstat's processing and rendering against a SyntheticCluster, one tick at a time"""
+
+    def __init__(self, cluster, elasticstat_args):
+        self.cluster = cluster
+        args = elasticstat.build_parser().parse_args(elasticstat_args + ['-o', os.devnull])
+        args.hostlist = 'synthetic'
+        self.stat = elasticstat.Elasticstat(args, es_client=cluster.client())
+        self.stat.frames = elasticstat.FrameWriter(open(os.devnull, 'w'))
+        self.stat.format_headings()
+
+    def next_results(self):
+        """Advance the cluster a tick, returning what ESFetcher would have fetched"""
+        self.cluster.tick()
+        self.stat.now = self.cluster.timestamp / 1000.0
+        self.stat.period = self.cluster.interval
+        # node stats as the fetcher hands them over, decoded into records
+        nodes_stats = self.stat.node_decoder.project(self.cluster.nodes_stats())
+        responses = [('cluster_health', self.cluster.health()), ('nodes_stats', nodes_stats),
+                     ('active_master', self.cluster.master().strip())]
+        return dict((name, elasticstat.FetchResult(response, None, 0.0, self.stat.now, False))
+                    for name, response in responses)
+
+    def process(self, results):
+        return self.stat.process_tick(results)
+
+    def render(self, results, rows):
+        self.stat.output_tick(results, *rows)
+
+    def time_ticks(self, ticks):
+        process_ms = []
+        render_ms = []
+        for _ in range(ticks):
+            results = self.next_results()
+            start = timer()
+            rows = self.process(results)
+            processed = timer()
+            self.render(results, rows)
+            rendered = timer()
+            process_ms.append((processed - start) * 1000)
+            render_ms.append((rendered - processed) * 1000)
+        return process_ms, render_ms
+
+    def count_objects(self, ticks):
+        objects = []
+        for _ in range(ticks):
+            results = self.next_results()
+            gc.collect()
+            gc.disable()
+            try:
+                before = gc.get_count()[0]
+                self.render(results, self.process(results))
+                objects.append(gc.get_count()[0] - before)
+            finally:
+                gc.enable()
+        return objects
+
+    def trace_memory(self, ticks):
+        traced_kb = []
+        peak_kb = []
+        for _ in range(ticks):
+            results = self.next_results()
+            tracemalloc.start()
+            try:
+                self.render(results, self.process(results))
+                current, peak = tracemalloc.get_traced_memory()
+            finally:
+                tracemalloc.stop()
+            traced_kb.append(current / 1024.0)
+            peak_kb.append(peak / 1024.0)
+        return traced_kb, peak_kb
+
+
+def run_case(es_version, nodes, options):
+    """Benchmark one case, returning its results"""
+    cluster = SyntheticCluster(nodes, es_version, churn=options.churn, seed=options.seed)
+    bench = TickBench(cluster, shlex.split(options.elasticstat_args))
+    bench.time_ticks(options.warmup)  # the first ticks have no rates yet, and fill the node registry
+    process_ms, render_ms = bench.time_ticks(options.ticks)
+    result = {'case': "es{0}-{1}".format(es_version, nodes), 'version': ES_VERSIONS[es_version], 'nodes': nodes,
+              'payload_kb': len(json.dumps(cluster.nodes_stats())) / 1024.0,
+              'process_ms': summarize(process_ms), 'render_ms': summarize(render_ms),
+              'objects': summarize(bench.count_objects(options.ticks))}
+    if tracemalloc is not None:
+        traced_kb, peak_kb = bench.trace_memory(options.ticks)
+        result['traced_kb'] = summarize(traced_kb)
+        result['peak_kb'] = summarize(peak_kb)
+    result['rss_kb'] = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return result
+
+
+def run_cases(options):
+    results = []
+    for es_version in options.versions.split(','):
+        for nodes in options.nodes.split(','):
+            command = [sys.executable, os.path.abspath(__file__), '--case', "{0}:{1}".format(es_version, nodes),
+                       '--ticks', str(options.ticks), '--warmup', str(options.warmup), '--churn', str(options.churn),
+                       '--seed', str(options.seed), '--args=' + options.elasticstat_args]
+            output = subprocess.check_output(command)
+            results.append(json.loads(output.decode('utf-8').strip().splitlines()[-1]))
+            print_result(results[-1])
+    return results
+
+
+def format_summary(summary, unit_format="{0:.2f}"):
+    if summary is None:
+        return "-"
+    return "/".join(unit_format.format(summary[stat]) for stat in ['p50', 'p95', 'max'])
+
+
+def print_result(result):
+    print "{0:12} {1:>6} {2:>9.1f}  process ms {3:24} render ms {4:24} objects {5:>6} rss {6:>8}kb".format(
+        result['case'], result['nodes'], result['payload_kb'], format_summary(result['process_ms']),
+        format_summary(result['render_ms']), result['objects']['p50'], result['rss_kb'])
+
+
+def get_metric(result, metric, stat):
+    value = result.get(metric)
+    if value is None or stat is None:
+        return value
+    return value[stat]
+
+
+def save_results(path, options, results):
+    with open(path, 'w') as save_file:
+        json.dump({'elasticstat': __version__, 'python': platform.python_version(), 'platform': platform.platform(),
+                   'time': time.time(), 'options': vars(options), 'results': results}, save_file, indent=2)
+
+
+def load_results(path):
+    with open(path) as saved_file:
+        return json.load(saved_file)
+
+
+def compare(baseline, results, metrics=COMPARED_METRICS):
+    """Print how each case's metrics changed since the baseline run"""
+    baseline_cases = dict((result['case'], result) for result in baseline['results'])
+    print ""
+    print "{0:12} {1:14} {2:>12} {3:>12} {4:>8}".format("case", "metric", "baseline", "now", "change")
+    for result in results:
+        if result['case'] not in baseline_cases:
+            continue
+        for metric, stat in metrics:
+            before = get_metric(baseline_cases[result['case']], metric, stat)
+            after = get_metric(result, metric, stat)
+            if before is None or after is None:
+                continue
+            change = "{0:+.1f}%".format((after - before) * 100.0 / before) if before else "-"
+            name = metric if stat is None else "{0} {1}".format(metric, stat)
+            print "{0:12} {1:14} {2:>12.2f} {3:>12.2f} {4:>8}".format(result['case'], name, before, after, change)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--nodes', default='10,100,1000', help='Cluster sizes to run (default: 10,100,1000)')
+    parser.add_argument('--versions', default='7',
+                        help='Elasticsearch major versions to run, from {0} (default: 7)'.format(','.join(ES_VERSIONS)))
+    parser.add_argument('--ticks', type=int, default=20, help='Ticks measured per case (default: 20)')
+    parser.add_argument('--warmup', type=int, default=2, help='Ticks run before measuring (default: 2)')
+    parser.add_argument('--churn', type=float, default=0.01,
+                        help='Fraction of nodes leaving, rejoining or joining each tick (default: 0.01)')
+    parser.add_argument('--seed', type=int, default=0, help='Seed for the synthetic cluster (default: 0)')
+    parser.add_argument('--args', dest='elasticstat_args', default='-c all -C',
+                        help='elasticstat options to benchmark with (default: "-c all -C")')
+    parser.add_argument('--save', metavar='FILE', help='Save the results to FILE')
+    parser.add_argument('--compare', metavar='FILE', help='Compare the results with those saved in FILE')
+    parser.add_argument('--case', help=argparse.SUPPRESS)
+    options = parser.parse_args()
+
+    if options.case is not None:
+        # a single case, run in its own process by run_cases
+        es_version, nodes = options.case.split(':')
+        print json.dumps(run_case(es_version, int(nodes), options))
+        return
+
+    results = run_cases(options)
+    if options.save:
+        save_results(options.save, options, results)
+    if options.compare:
+        compare(load_results(options.compare), results)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,355 @@
+"""A stand-in Elasticsearch HTTP server for end-to-end and latency testing of elasticstat
+
+    python benchmarks/fake_es.py --listen :9200 --nodes 500 --version 5 --latency nodes_stats=200 --jitter all=50
+    elasticstat -h localhost:9200
+
+Serves the requests elasticstat makes (/, /_cluster/health, /_cluster/state/nodes, /_nodes/stats, /_cat/master,
+/_stats and /<indices>/_stats for --hot-indices, and /_nodes/<ids>/hot_threads and /_tasks for --capture) from a
+SyntheticCluster, which advances a tick on each node stats request, or from scripted responses.  Each endpoint
+can be given latency, jitter and an error rate, and the server can require basic auth and serve over TLS.
+
+Endpoints are named root, health, state, nodes_stats, master, index_stats, hot_threads and tasks; `all` applies a
+setting to each of them.
+Node stats for some nodes only (/_nodes/<node ids>/stats, as `elasticstat --fan-out` requests) can also be
+slowed per node, to stand in for a GC-thrashing node: --latency node:<name or id>=MS.
+"""
+import argparse
+import base64
+import BaseHTTPServer
+import fnmatch
+import itertools
+import json
+import random
+import SocketServer
+import ssl
+import sys
+import threading
+import time
+import urlparse
+
+from synthetic import ES_VERSIONS, SyntheticCluster
+
+ENDPOINTS = ['root', 'health', 'state', 'nodes_stats', 'master', 'index_stats', 'hot_threads', 'tasks']
+TEXT_ENDPOINTS = ['master', 'hot_threads']  # answered in plain text rather than JSON
+
+
+def endpoint_setting(value):
+    """argparse type for an ENDPOINT=VALUE setting, returned as (endpoint, value)"""
+    endpoint, _, setting = value.partition('=')
+    if (endpoint not in ENDPOINTS + ['all'] and not endpoint.startswith('node:')) or not setting:
+        raise argparse.ArgumentTypeError("{0} is not ENDPOINT=VALUE, with ENDPOINT node:NODE or one of {1}".format(
+            value, ', '.join(ENDPOINTS + ['all'])))
+    return (endpoint, setting)
+
+
+def filter_response(response, filter_path):
+    """Apply an Elasticsearch filter_path (comma-separated dotted paths, with * wildcards) to a response"""
+    if not filter_path:
+        return response
+    filtered = {}
+    for path in filter_path.split(','):
+        filter_into(response, path.split('.'), filtered)
+    return filtered
+
+
+def filter_into(source, keys, target):
+    if not isinstance(source, dict):
+        return
+    for key, value in source.items():
+        if not fnmatch.fnmatchcase(key, keys[0]):
+            continue
+        if len(keys) == 1:
+            target[key] = value
+        elif isinstance(value, dict):
+            filter_into(value, keys[1:], target.setdefault(key, {}))
+        elif isinstance(value, list):
+            # as in Elasticsearch, a path goes through arrays, filtering each of their objects
+            items = target.setdefault(key, [{} for item in value])
+            for item, filtered in zip(value, items):
+                filter_into(item, keys[1:], filtered)
+
+
+class FakeElasticsearch(object):
+    """Answers elasticstat's requests, with the configured latency, jitter and errors
+
+    latency and jitter are in milliseconds per endpoint; errors maps an endpoint to (error rate, HTTP status).
+    script maps a request path to a response, or a list of responses which are served in turn.
+    """
+
+    def __init__(self, cluster, latency=None, jitter=None, errors=None, script=None, pad=0, seed=0):
+        self.cluster = cluster
+        self.latency = latency or {}
+        self.jitter = jitter or {}
+        self.errors = errors or {}
+        self.script = {}
+        for path, responses in (script or {}).items():
+            self.script[path] = itertools.cycle(responses if isinstance(responses, list) else [responses])
+        self.pad = pad  # bytes of filler added to each node's stats, to inflate the payload
+        self.rand = random.Random(seed)
+        self.lock = threading.Lock()
+        self.requests = dict((endpoint, 0) for endpoint in ENDPOINTS)
+        self.last_tick = 0  # when batched node stats last advanced the cluster
+
+    def get_endpoint(self, path):
+        if path in ['', '/']:
+            return 'root'
+        if path.startswith('/_cluster/health'):
+            return 'health'
+        if path.startswith('/_cluster/state'):
+            return 'state'
+        if path.startswith('/_nodes') and '/stats' in path:
+            return 'nodes_stats'
+        if path.startswith('/_nodes') and path.endswith('/hot_threads'):
+            return 'hot_threads'
+        if path.startswith('/_tasks'):
+            return 'tasks'
+        if path.startswith('/_cat/master'):
+            return 'master'
+        if path.startswith('/_stats') or '/_stats' in path and not path.startswith('/_'):
+            return 'index_stats'
+        return None
+
+    def delay(self, endpoint, path):
+        delay = self.latency.get(endpoint, 0) + self.rand.uniform(-1, 1) * self.jitter.get(endpoint, 0)
+        if endpoint == 'nodes_stats':
+            delay += max([0] + [self.latency.get('node:' + node, 0) for node in self.requested_nodes(path)])
+        if delay > 0:
+            time.sleep(delay / 1000.0)
+
+    def requested_nodes(self, path):
+        """Node ids and names of the nodes a node stats request asks for (all of them for /_nodes/stats)"""
+        node_ids = path.split('/')[2]
+        with self.lock:
+            nodes = self.cluster.nodes.values()
+            if node_ids != 'stats':
+                wanted = set(node_ids.split(','))
+                nodes = [node for node in nodes if node.node_id in wanted]
+            return [node.node_id for node in nodes] + [node.name for node in nodes]
+
+    def respond(self, path, query):
+        """Answer a GET request, returning (HTTP status, content type, body)"""
+        endpoint = self.get_endpoint(path)
+        if endpoint is None:
+            return (404, 'application/json', json.dumps({'error': 'no handler found for uri [{0}]'.format(path),
+                                                         'status': 404}))
+        with self.lock:
+            self.requests[endpoint] += 1
+            error_rate, error_status = self.errors.get(endpoint, (0, 503))
+            failed = self.rand.random() < error_rate
+        self.delay(endpoint, path)
+        if failed:
+            return (error_status, 'application/json', json.dumps({'error': 'fake error', 'status': error_status}))
+        with self.lock:
+            if path in self.script:
+                response = next(self.script[path])
+            else:
+                response = getattr(self, 'respond_' + endpoint)(path, query)
+        if endpoint in TEXT_ENDPOINTS:
+            if not isinstance(response, basestring):
+                response = json.dumps(response)
+            return (200, 'text/plain; charset=UTF-8', response)
+        return (200, 'application/json', json.dumps(filter_response(response, query.get('filter_path'))))
+
+    def respond_root(self, path, query):
+        info = self.cluster.info()
+        info['tagline'] = "You Know, for Search"
+        return info
+
+    def respond_health(self, path, query):
+        return self.cluster.health()
+
+    def respond_state(self, path, query):
+        # /_cluster/state[/<metrics>[/<indices>]]
+        parts = path.split('/')
+        metrics = parts[3].split(',') if len(parts) > 3 and parts[3] != '_all' else None
+        index_names = parts[4].split(',') if len(parts) > 4 else None
+        return self.cluster.state(metrics, index_names)
+
+    def respond_nodes_stats(self, path, query):
+        node_ids = path.split('/')[2]
+        if node_ids == 'stats':
+            self.cluster.tick()
+            response = self.cluster.nodes_stats()
+        else:
+            # /_nodes/<node ids>/stats: only the nodes asked for.  Batches of one update come in together, so the
+            # cluster advances once the interval has passed rather than on every batch.
+            if time.time() - self.last_tick >= self.cluster.interval:
+                self.cluster.tick()
+                self.last_tick = time.time()
+            response = self.cluster.nodes_stats(node_ids.split(','))
+        if self.pad:
+            for node in response['nodes'].values():
+                node['pad'] = 'x' * self.pad
+        return response
+
+    def respond_index_stats(self, path, query):
+        index_names = None
+        if not path.startswith('/_stats'):
+            # /<indices>/_stats: only the indices asked for
+            index_names = path.split('/')[1].split(',')
+        return self.cluster.index_stats(index_names, query.get('level', 'indices'))
+
+    def respond_hot_threads(self, path, query):
+        node_ids = path.split('/')[2]
+        nodes = [node for node in self.cluster.nodes.values() if node_ids == 'hot_threads' or
+                 node.node_id in node_ids.split(',')]
+        return "".join("::: {{{0}}}{{{1}}}\n   Hot threads at {2}, interval=500ms, busiestThreads=3, ignoreIdleThreads=true:\n\n"
+                       "   42.0% (210ms out of 500ms) cpu usage by thread 'elasticsearch[{0}][search][T#1]'\n\n".format(
+                           node.name, node.node_id, time.strftime('%Y-%m-%dT%H:%M:%S'))
+                       for node in nodes)
+
+    def respond_tasks(self, path, query):
+        node_ids = query.get('nodes')
+        nodes = {}
+        for node in self.cluster.nodes.values():
+            if node_ids is None or node.node_id in node_ids.split(','):
+                task_id = "{0}:{1}".format(node.node_id, self.rand.randint(1, 10 ** 6))
+                nodes[node.node_id] = {'name': node.name, 'tasks': {task_id: {
+                    'node': node.node_id, 'id': int(task_id.split(':')[1]), 'type': 'transport',
+                    'action': 'indices:data/read/search', 'description': 'indices[logs-*], search_type[QUERY_THEN_FETCH]',
+                    'start_time_in_millis': int(time.time() * 1000), 'running_time_in_nanos': 1500000000,
+                    'cancellable': True}}}
+        return {'nodes': nodes}
+
+    def respond_master(self, path, query):
+        master_id = self.cluster.master().strip()
+        if query.get('h') == 'id':
+            return master_id + "\n"
+        return "{0} 10.0.0.1 10.0.0.1 {1}\n".format(master_id, self.cluster.info()['name'])
+
+
+class FakeESHandler(BaseHTTPServer.BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'  # keep-alive, as the Elasticsearch client expects
+    wbufsize = -1  # send headers and body together, rather than waiting on a delayed ACK between them
+
+    def authorized(self):
+        credentials = self.server.credentials
+        if credentials is None:
+            return True
+        return self.headers.get('Authorization') == "Basic " + base64.b64encode(credentials)
+
+    def send_body(self, status, content_type, body, headers=()):
+        self.send_response(status)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(body)))
+        for header, value in headers:
+            self.send_header(header, value)
+        self.end_headers()
+        if self.command != 'HEAD':
+            self.wfile.write(body)
+
+    def do_GET(self):
+        if not self.authorized():
+            body = json.dumps({'error': 'missing authentication credentials', 'status': 401})
+            self.send_body(401, 'application/json', body,
+                           [('WWW-Authenticate', 'Basic realm="security" charset="UTF-8"')])
+            return
+        url = urlparse.urlparse(self.path)
+        query = dict(urlparse.parse_qsl(url.query))
+        self.send_body(*self.server.fake.respond(url.path, query))
+
+    do_HEAD = do_GET
+
+    def log_message(self, format, *args):
+        if self.server.verbose:
+            BaseHTTPServer.BaseHTTPRequestHandler.log_message(self, format, *args)
+
+
+class FakeESServer(SocketServer.ThreadingMixIn, BaseHTTPServer.HTTPServer):
+    """Serves a FakeElasticsearch over HTTP, or HTTPS if given a certificate"""
+
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self, address, fake, credentials=None, certfile=None, keyfile=None, verbose=False):
+        BaseHTTPServer.HTTPServer.__init__(self, address, FakeESHandler)
+        self.fake = fake
+        self.credentials = credentials  # USER:PASSWORD required with basic auth
+        self.verbose = verbose
+        if certfile is not None:
+            self.socket = ssl.wrap_socket(self.socket, certfile=certfile, keyfile=keyfile, server_side=True)
+
+    def start(self):
+        """Serve from a daemon thread, returning the port listened on"""
+        thread = threading.Thread(target=self.serve_forever)
+        thread.daemon = True
+        thread.start()
+        return self.server_address[1]
+
+
+def parse_settings(settings, parse=float):
+    """Turn ENDPOINT=VALUE settings into a dict of endpoint -> value, with `all` setting every endpoint"""
+    parsed = {}
+    for endpoint, value in settings or []:
+        for name in (ENDPOINTS if endpoint == 'all' else [endpoint]):
+            parsed[name] = parse(value)
+    return parsed
+
+
+def parse_error_setting(value):
+    rate, _, status = value.partition(':')
+    return (float(rate), int(status or 503))
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--listen', default='localhost:9200', metavar='[HOST]:PORT',
+                        help='Address to listen on (default: localhost:9200)')
+    parser.add_argument('--nodes', type=int, default=10, help='Nodes in the synthetic cluster (default: 10)')
+    parser.add_argument('--version', default='7', choices=list(ES_VERSIONS),
+                        help='Elasticsearch major version to respond as (default: 7)')
+    parser.add_argument('--churn', type=float, default=0.0,
+                        help='Fraction of nodes leaving, rejoining or joining each node stats request (default: 0)')
+    parser.add_argument('--indices', type=int, default=0, help='Indices in the synthetic cluster (default: 0)')
+    parser.add_argument('--shards', type=int, default=5, help='Primary shards per index (default: 5)')
+    parser.add_argument('--replicas', type=int, default=1, help='Replicas of each shard (default: 1)')
+    parser.add_argument('--seed', type=int, default=0, help='Seed for the synthetic cluster (default: 0)')
+    parser.add_argument('--script', metavar='FILE',
+                        help='JSON file mapping request paths to a response, or a list of responses served in turn')
+    parser.add_argument('--latency', type=endpoint_setting, action='append', metavar='ENDPOINT=MS',
+                        help='Delay responses from ENDPOINT by MS milliseconds, or with ENDPOINT as node:NODE, '
+                             'node stats responses including that node (by name or id)')
+    parser.add_argument('--jitter', type=endpoint_setting, action='append', metavar='ENDPOINT=MS',
+                        help='Vary the delay of responses from ENDPOINT by up to MS milliseconds either way')
+    parser.add_argument('--errors', type=endpoint_setting, action='append', metavar='ENDPOINT=RATE[:STATUS]',
+                        help='Fail this fraction of requests to ENDPOINT with HTTP STATUS (default: 503)')
+    parser.add_argument('--pad', type=int, default=0, metavar='BYTES',
+                        help='Add BYTES of filler to each node in node stats, to inflate the payload')
+    parser.add_argument('--user', metavar='USER:PASSWORD', help='Require basic auth with these credentials')
+    parser.add_argument('--certfile', help='Serve HTTPS with this certificate (PEM)')
+    parser.add_argument('--keyfile', help='Private key for --certfile, if not included in it')
+    parser.add_argument('-v', '--verbose', action='store_true', help='Log each request')
+    return parser
+
+
+def build_server(options):
+    """Build a FakeESServer from parsed command line options"""
+    cluster = SyntheticCluster(options.nodes, options.version, churn=options.churn, seed=options.seed,
+                               indices=options.indices, shards=options.shards, replicas=options.replicas)
+    script = None
+    if options.script:
+        with open(options.script) as script_file:
+            script = json.load(script_file)
+    fake = FakeElasticsearch(cluster, latency=parse_settings(options.latency), jitter=parse_settings(options.jitter),
+                             errors=parse_settings(options.errors, parse_error_setting), script=script,
+                             pad=options.pad, seed=options.seed)
+    host, _, port = options.listen.rpartition(':')
+    return FakeESServer((host, int(port)), fake, credentials=options.user, certfile=options.certfile,
+                        keyfile=options.keyfile, verbose=options.verbose)
+
+
+def main():
+    options = build_parser().parse_args()
+    server = build_server(options)
+    scheme = 'https' if options.certfile else 'http'
+    print "Serving a {0} node Elasticsearch {1} cluster at {2}://{3}:{4}/".format(
+        options.nodes, ES_VERSIONS[options.version], scheme, server.server_address[0], server.server_address[1])
+    sys.stdout.flush()
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
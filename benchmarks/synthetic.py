@@ -0,0 +1,297 @@
+"""Synthetic cluster health and node stats payloads for benchmarking elasticstat
+
+SyntheticCluster keeps the state of a made up cluster (nodes, roles and cumulative counters) and renders it in the
+response shapes of each Elasticsearch major version elasticstat handles:
+
+* 1.x: roles as `attributes`, a list of three load averages in `os.load_average`
+* 2.x: roles as `attributes`, a single float load average in `os.load_average`
+* 5.x+: a `roles` list, load averages under `os.cpu.load_average`
+
+Each tick advances the node timestamps and counters, and with churn, nodes leave the cluster, rejoin it under a
+new node id (as a restarted node does) or join it for the first time.  The cluster can also hold indices, whose
+shard copies are spread over the data nodes (and moved off nodes which leave), with a few much busier than the rest.
+"""
+import collections
+import random
+
+ES_VERSIONS = collections.OrderedDict([('1', '1.7.6'), ('2', '2.4.6'), ('5', '5.6.16'), ('7', '7.10.2')])
+THREAD_POOLS = {'1': ['index', 'bulk', 'search', 'get', 'merge', 'refresh', 'flush'],
+                '2': ['index', 'bulk', 'search', 'get', 'refresh', 'flush'],
+                '5': ['index', 'bulk', 'search', 'get', 'refresh', 'flush'],
+                '7': ['write', 'search', 'get', 'refresh', 'flush']}
+# cumulative counters: name -> (node stats path, increase per second for an average node)
+COUNTERS = collections.OrderedDict([
+    ('old_gc_count', ('jvm.gc.collectors.old.collection_count', 0.01)),
+    ('old_gc_time', ('jvm.gc.collectors.old.collection_time_in_millis', 2.0)),
+    ('young_gc_count', ('jvm.gc.collectors.young.collection_count', 0.5)),
+    ('young_gc_time', ('jvm.gc.collectors.young.collection_time_in_millis', 15.0)),
+    ('index_total', ('indices.indexing.index_total', 2000.0)),
+    ('search_total', ('indices.search.query_total', 300.0)),
+    ('get_total', ('indices.get.total', 40.0)),
+    ('merge_total', ('indices.merges.total', 0.5)),
+    ('merge_time', ('indices.merges.total_time_in_millis', 400.0)),
+    ('refresh_total', ('indices.refresh.total', 2.0)),
+    ('flush_total', ('indices.flush.total', 0.05)),
+    ('fd_evictions', ('indices.fielddata.evictions', 0.01)),
+    ('fd_tripped', ('breakers.fielddata.tripped', 0.001)),
+    ('http_opened', ('http.total_opened', 0.2)),
+    ('transport_rx', ('transport.rx_size_in_bytes', 2.0e6)),
+    ('transport_tx', ('transport.tx_size_in_bytes', 2.0e6)),
+    ('docs_count', ('indices.docs.count', 1500.0)),
+    ('docs_deleted', ('indices.docs.deleted', 50.0)),
+])
+DISK_TOTAL = 2 * 1024 ** 4
+
+
+class SyntheticNode(object):
+    """The state of one node of a SyntheticCluster"""
+
+    def __init__(self, node_id, name, role, rand):
+        self.node_id = node_id
+        self.name = name
+        self.role = role  # 'master', 'data', 'ingest' or 'client'
+        self.load = rand.uniform(0.5, 8.0)
+        self.mem_used_percent = rand.randint(40, 99)
+        self.heap_used_percent = rand.randint(20, 85)
+        self.disk_used_percent = rand.uniform(20, 90)
+        self.counters = dict((counter, rand.randint(0, 10 ** 6)) for counter in COUNTERS)
+        self.speed = rand.uniform(0.5, 1.5)  # how busy this node is compared to the average
+        self.pool_counters = {}  # threadpool -> completed and rejected counters
+
+
+class SyntheticIndex(object):
+    """An index of a SyntheticCluster: for each shard, a list of its copies as [node id, primary, counters]"""
+
+    def __init__(self, name, shards, replicas, data_node_ids, rand):
+        self.name = name
+        self.busy = rand.paretovariate(1.5)  # heavy tailed, so a few indices take most of the load
+        self.merges = 0
+        self.shards = []
+        for shard in range(shards):
+            nodes = rand.sample(data_node_ids, min(len(data_node_ids), replicas + 1))
+            self.shards.append([[node_id, copy == 0, {'index_total': 0, 'query_total': 0}]
+                                for copy, node_id in enumerate(nodes)])
+
+
+class SyntheticCluster(object):
+    """A made up cluster, rendering cluster health and node stats as a given Elasticsearch major version would
+
+    nodes is the number of nodes the cluster starts with; with churn, each tick about churn * nodes nodes leave,
+    rejoin under a new node id or join for the first time.  The same seed always gives the same payloads.
+    """
+
+    def __init__(self, nodes, es_version='7', churn=0.0, interval=1.0, seed=0, indices=0, shards=5, replicas=1):
+        if es_version not in ES_VERSIONS:
+            raise ValueError("{0} is not a supported version, choose from {1}".format(es_version, ', '.join(ES_VERSIONS)))
+        self.es_version = es_version
+        self.churn = churn
+        self.interval = interval
+        self.rand = random.Random(seed)
+        self.timestamp = 1600000000000  # node stats timestamps, in milliseconds
+        self.nodes = collections.OrderedDict()  # node id -> SyntheticNode, for nodes in the cluster
+        self.departed = []  # nodes which have left the cluster, and may rejoin under a new node id
+        self.joined = 0
+        self.state_version = 1  # cluster state version, moved on by nodes joining and shards relocating
+        for _ in range(nodes):
+            self.join()
+        self.master_id = next(iter(self.nodes))  # the first node joined is the elected master
+        self.indices = collections.OrderedDict()  # index name -> SyntheticIndex
+        data_node_ids = [node_id for node_id, node in self.nodes.items() if node.role == 'data']
+        for index in range(indices):
+            name = "logs-{0:05d}".format(index)
+            self.indices[name] = SyntheticIndex(name, shards, replicas, data_node_ids, self.rand)
+
+    def new_node_id(self):
+        return "{0:022x}".format(self.rand.getrandbits(88))
+
+    def join(self, name=None, role=None):
+        """Add a node to the cluster, a new one unless the name and role of a departed node are given"""
+        if name is None:
+            if self.joined < 3:
+                role = 'master'
+            else:
+                role = self.rand.choice(['data'] * 18 + ['ingest', 'client'])
+            name = "{0}-{1:04d}".format(role, self.joined)
+            self.joined += 1
+        node = SyntheticNode(self.new_node_id(), name, role, self.rand)
+        self.nodes[node.node_id] = node
+        self.state_version += 1
+        return node
+
+    def tick(self):
+        """Advance the cluster by one interval: counters increase, and with churn, nodes come and go"""
+        self.timestamp += int(self.interval * 1000)
+        for node in self.nodes.values():
+            for counter, (path, per_second) in COUNTERS.items():
+                node.counters[counter] += int(self.rand.expovariate(1.0) * per_second * node.speed * self.interval)
+            for pool_counters in node.pool_counters.values():
+                pool_counters['completed'] += int(self.rand.expovariate(1.0) * 100 * node.speed * self.interval)
+                pool_counters['rejected'] += 1 if self.rand.random() < 0.02 else 0
+            node.heap_used_percent = max(5, min(99, node.heap_used_percent + self.rand.randint(-3, 3)))
+            node.load = max(0.0, node.load + self.rand.uniform(-0.3, 0.3))
+        for index in self.indices.values():
+            index.merges = self.rand.choice([0] * 9 + [self.rand.randint(1, 4)])
+            for copies in index.shards:
+                index_total = int(self.rand.expovariate(1.0) * 200 * index.busy * self.interval)
+                for node_id, primary, counters in copies:
+                    counters['index_total'] += index_total  # every copy indexes each document
+                    counters['query_total'] += int(self.rand.expovariate(1.0) * 20 * index.busy * self.interval)
+        events = int(self.churn * len(self.nodes) + self.rand.random())
+        for _ in range(events):
+            choice = self.rand.random()
+            if self.departed and choice < 0.45:
+                # a restarted node comes back with the same name but a new node id
+                departed = self.departed.pop(0)
+                self.join(departed.name, departed.role)
+            elif choice < 0.9 and len(self.nodes) > 1:
+                node_id = self.rand.choice([node_id for node_id in self.nodes if node_id != self.master_id])
+                self.departed.append(self.nodes.pop(node_id))
+                self.relocate(node_id)
+            else:
+                self.join()
+
+    def relocate(self, departed_id):
+        """Move the shard copies of a node which has left to other data nodes, starting their counters afresh"""
+        data_node_ids = [node_id for node_id, node in self.nodes.items() if node.role == 'data']
+        self.state_version += 1
+        for index in self.indices.values():
+            for copies in index.shards:
+                for copy in copies:
+                    if copy[0] == departed_id and data_node_ids:
+                        copy[0] = self.rand.choice(data_node_ids)
+                        copy[2] = {'index_total': 0, 'query_total': 0}
+
+    def info(self):
+        return {'name': self.nodes[self.master_id].name, 'cluster_name': 'synthetic',
+                'version': {'number': ES_VERSIONS[self.es_version]}}
+
+    def health(self):
+        unassigned = 10 * len([node for node in self.departed if node.role == 'data'])
+        data_nodes = len([node for node in self.nodes.values() if node.role == 'data'])
+        return {'cluster_name': 'synthetic', 'status': 'yellow' if unassigned else 'green', 'timed_out': False,
+                'number_of_nodes': len(self.nodes), 'number_of_data_nodes': data_nodes,
+                'active_primary_shards': 5 * data_nodes, 'active_shards': 10 * data_nodes, 'relocating_shards': 0,
+                'initializing_shards': 0, 'unassigned_shards': unassigned, 'number_of_pending_tasks': 0}
+
+    def master(self):
+        return self.master_id + "\n"
+
+    def nodes_stats(self, node_ids=None):
+        """Node stats of every node, or only those in node_ids"""
+        return {'cluster_name': 'synthetic',
+                'nodes': dict((node_id, self.node_stats(node)) for node_id, node in self.nodes.items()
+                              if node_ids is None or node_id in node_ids)}
+
+    def state(self, metrics=None, index_names=None):
+        """Cluster state with the nodes, version and routing_table metrics (all of them if metrics is None), the
+        routing table of every index or only those in index_names"""
+        response = {'cluster_name': 'synthetic'}
+        if metrics is None or 'version' in metrics:
+            response['version'] = self.state_version
+        if metrics is None or 'nodes' in metrics:
+            response['nodes'] = dict((node_id, {'name': node.name, 'transport_address': "10.0.0.1:9300"})
+                                     for node_id, node in self.nodes.items())
+        if metrics is None or 'routing_table' in metrics:
+            response['routing_table'] = {'indices': dict(
+                (name, {'shards': dict((str(shard), [{'state': 'STARTED', 'primary': primary, 'node': node_id,
+                                                      'shard': shard, 'index': name}
+                                                     for node_id, primary, counters in copies])
+                                       for shard, copies in enumerate(index.shards))})
+                for name, index in self.indices.items() if index_names is None or name in index_names)}
+        return response
+
+    def node_roles(self, node):
+        """The node's roles in this version's shape, as a (key, value) pair"""
+        if self.es_version in ['1', '2']:
+            is_master = 'true' if node.role == 'master' else 'false'
+            is_data = 'true' if node.role == 'data' else 'false'
+            return ('attributes', {'master': is_master, 'data': is_data})
+        roles = {'master': ['master'], 'data': ['data', 'ingest'], 'ingest': ['ingest'], 'client': []}[node.role]
+        return ('roles', roles)
+
+    def node_os(self, node):
+        mem = {'used_percent': node.mem_used_percent, 'free_percent': 100 - node.mem_used_percent}
+        if self.es_version == '1':
+            return {'load_average': [node.load, node.load * 0.9, node.load * 0.8], 'mem': mem}
+        if self.es_version == '2':
+            return {'load_average': node.load, 'mem': mem}
+        return {'cpu': {'percent': min(100, int(node.load * 10)),
+                        'load_average': {'1m': node.load, '5m': node.load * 0.9, '15m': node.load * 0.8}},
+                'mem': mem}
+
+    def node_stats(self, node):
+        stats = {'timestamp': self.timestamp, 'name': node.name, 'host': node.name,
+                 'transport_address': "10.0.0.1:9300", 'os': self.node_os(node)}
+        roles_key, roles = self.node_roles(node)
+        stats[roles_key] = roles
+        heap_max = 31 * 1024 ** 3
+        stats['jvm'] = {'mem': {'heap_used_percent': node.heap_used_percent,
+                                'heap_used_in_bytes': heap_max * node.heap_used_percent // 100,
+                                'heap_max_in_bytes': heap_max,
+                                'pools': {'old': {'used_in_bytes': heap_max * node.heap_used_percent // 150}}},
+                        'gc': {'collectors': {}}}
+        stats['thread_pool'] = {}
+        for pool in THREAD_POOLS[self.es_version]:
+            pool_counters = node.pool_counters.setdefault(pool, {'completed': 0, 'rejected': 0})
+            stats['thread_pool'][pool] = {'threads': 8, 'active': self.rand.randint(0, 8),
+                                          'queue': self.rand.choice([0] * 8 + [self.rand.randint(1, 200)]),
+                                          'rejected': pool_counters['rejected'], 'largest': 8,
+                                          'completed': pool_counters['completed']}
+        stats['fs'] = {'total': {'total_in_bytes': DISK_TOTAL,
+                                 'available_in_bytes': int(DISK_TOTAL * (100 - node.disk_used_percent) / 100)}}
+        stats['indices'] = {'store': {'size_in_bytes': int(DISK_TOTAL * node.disk_used_percent / 120)}}
+        stats['http'] = {'current_open': self.rand.randint(1, 50)}
+        stats['transport'] = {'server_open': 13 * len(self.nodes)}
+        for counter, (path, per_second) in COUNTERS.items():
+            keys = path.split('.')
+            section = stats
+            for key in keys[:-1]:
+                section = section.setdefault(key, {})
+            section[keys[-1]] = node.counters[counter]
+        return stats
+
+    def index_stats(self, index_names=None, level='indices'):
+        """Index stats of every index, or only those in index_names, summed per index or per shard copy"""
+        response = {'indices': {}}
+        for name, index in self.indices.items():
+            if index_names is not None and name not in index_names:
+                continue
+            if level == 'shards':
+                response['indices'][name] = {'shards': dict(
+                    (str(shard), [{'routing': {'state': 'STARTED', 'primary': primary, 'node': node_id},
+                                   'indexing': {'index_total': counters['index_total']},
+                                   'search': {'query_total': counters['query_total']}}
+                                  for node_id, primary, counters in copies])
+                    for shard, copies in enumerate(index.shards))}
+            else:
+                counters = [copy[2] for copies in index.shards for copy in copies]
+                response['indices'][name] = {'total': {
+                    'indexing': {'index_total': sum(counter['index_total'] for counter in counters)},
+                    'search': {'query_total': sum(counter['query_total'] for counter in counters)},
+                    'merges': {'current': index.merges}}}
+        return response
+
+    def client(self):
+        """An object answering the Elasticsearch client calls elasticstat makes, from this cluster"""
+        return SyntheticClient(self)
+
+
+class SyntheticClient(object):
+    """Stands in for an Elasticsearch client, answering from a SyntheticCluster (which is advanced separately)"""
+
+    class Namespace(object):
+        pass
+
+    def __init__(self, cluster):
+        self.cluster = SyntheticClient.Namespace()
+        self.cluster.health = lambda **kwargs: cluster.health()
+        self.cluster.state = lambda metric=None, index=None, **kwargs: cluster.state(
+            metric and metric.split(','), index and index.split(','))
+        self.nodes = SyntheticClient.Namespace()
+        self.nodes.stats = lambda node_id=None, **kwargs: cluster.nodes_stats(node_id and node_id.split(','))
+        self.indices = SyntheticClient.Namespace()
+        self.indices.stats = lambda index=None, level='indices', **kwargs: cluster.index_stats(
+            index and index.split(','), level)
+        self.cat = SyntheticClient.Namespace()
+        self.cat.master = lambda **kwargs: cluster.master()
+        self.info = lambda **kwargs: cluster.info()
@@ -16,23 +16,45 @@
 # under the License.
 
 import argparse
+import array
+import BaseHTTPServer
+import collections
+import csv
 import datetime
+import fnmatch
 import getpass
+import gzip
+import hashlib
+import heapq
+import itertools
+import Queue
 import signal
+import SocketServer
+import StringIO
 import sys
+import threading
 import time
 import json
+import operator
+import os
 import re
+import resource
+import zlib
 
 from packaging import version
-from elasticsearch import Elasticsearch
-from urllib3.util import parse_url
+
+# The elasticsearch client (and urllib3 under it) and numpy take longer to import than the rest of elasticstat
+# put together, so they are imported when first needed: the client once there is a cluster to connect to, numpy
+# only for --rollup.
+numpy = None
 
 CLUSTER_TEMPLATE = {}
 CLUSTER_TEMPLATE['general'] = """{cluster_name:33} {status:6}"""
 CLUSTER_TEMPLATE['shards'] = """{active_shards:>6} {active_primary_shards:>4} {relocating_shards:>4} {initializing_shards:>4} {unassigned_shards:>8}"""
 CLUSTER_TEMPLATE['tasks'] = """{number_of_pending_tasks:>13}"""
 CLUSTER_TEMPLATE['time'] = """{timestamp:8}"""
+CLUSTER_TEMPLATE['tick'] = """{period:>6} {overruns:>4}"""
+CLUSTER_TEMPLATE['adaptive'] = """{interval:>8}"""
 CLUSTER_HEADINGS = {}
 CLUSTER_HEADINGS["cluster_name"] = "cluster"
 CLUSTER_HEADINGS["status"] = "status"
@@ -43,15 +65,19 @@ CLUSTER_HEADINGS["initializing_shards"] = "init"
 CLUSTER_HEADINGS["unassigned_shards"] = "unassign"
 CLUSTER_HEADINGS["number_of_pending_tasks"] = "pending tasks"
 CLUSTER_HEADINGS["timestamp"] = "time"
-CLUSTER_CATEGORIES = ['general', 'shards', 'tasks', 'time']
+CLUSTER_HEADINGS["period"] = "period"
+CLUSTER_HEADINGS["overruns"] = "ovr"
+CLUSTER_HEADINGS["interval"] = "interval"
+CLUSTER_CATEGORIES = ['general', 'shards', 'tasks', 'time', 'tick']
 
 NODES_TEMPLATE = {}
 NODES_TEMPLATE['general'] = """{name:24} {role:<6}"""
 NODES_TEMPLATE['os'] = """{load_avg:>18} {used_mem:>4}"""
 NODES_TEMPLATE['jvm'] = """{used_heap:>4}  {old_gc_sz:8} {old_gc:8} {young_gc:8}"""
 NODES_TEMPLATE['threads'] = """{threads:<8}"""
+NODES_TEMPLATE['throughput'] = """{index_rate:>8} {search_rate:>8} {get_rate:>7} {merge_rate:>6} {refresh_rate:>6} {flush_rate:>6}"""
 NODES_TEMPLATE['fielddata'] = """{fielddata:^7}"""
-NODES_TEMPLATE['connections'] = """{http_conn:>6} {transport_conn:>6}"""
+NODES_TEMPLATE['connections'] = """{http_conn:>6} {transport_conn:>6} {transport_rx:>11} {transport_tx:>11}"""
 NODES_TEMPLATE['data_nodes'] = """{merge_time:>8} {store_throttle:>8} {fs:>16}  {docs}"""
 NODES_FAILED_TEMPLATE = """{name:24} {role:<6}       (No data received, node may have left cluster)"""
 NODE_HEADINGS = {}
@@ -63,21 +89,310 @@ NODE_HEADINGS["used_heap"] = "heap"
 NODE_HEADINGS["old_gc_sz"] = "old sz"
 NODE_HEADINGS["old_gc"] = "old gc"
 NODE_HEADINGS["young_gc"] = "young gc"
+NODE_HEADINGS["index_rate"] = "idx/s"
+NODE_HEADINGS["search_rate"] = "qry/s"
+NODE_HEADINGS["get_rate"] = "get/s"
+NODE_HEADINGS["merge_rate"] = "mrg/s"
+NODE_HEADINGS["refresh_rate"] = "rfsh/s"
+NODE_HEADINGS["flush_rate"] = "flsh/s"
 NODE_HEADINGS["fielddata"] = "fde|fdt"
 NODE_HEADINGS["http_conn"] = "hconn"
 NODE_HEADINGS["transport_conn"] = "tconn"
+NODE_HEADINGS["transport_rx"] = "t rx/s"
+NODE_HEADINGS["transport_tx"] = "t tx/s"
 NODE_HEADINGS["merge_time"] = "merges"
 NODE_HEADINGS["store_throttle"] = "idx st"
 NODE_HEADINGS["docs"] = "docs"
 NODE_HEADINGS["fs"] = "disk usage"
 DEFAULT_THREAD_POOLS = ["index", "search", "bulk", "get", "write"]
-CATEGORIES = ['general', 'os', 'jvm', 'threads', 'fielddata', 'connections', 'data_nodes']
+CATEGORIES = ['general', 'os', 'jvm', 'threads', 'throughput', 'fielddata', 'connections', 'data_nodes']
+
+# Node stats metric groups, index metrics and response fields needed by each category, used to keep the
+# node stats request (and response) down to what will actually be displayed
+NODES_STATS_METRICS = {}
+NODES_STATS_METRICS['general'] = []
+NODES_STATS_METRICS['os'] = ['os']
+NODES_STATS_METRICS['jvm'] = ['jvm']
+NODES_STATS_METRICS['threads'] = ['thread_pool']
+NODES_STATS_METRICS['throughput'] = ['indices']
+NODES_STATS_METRICS['fielddata'] = ['indices', 'breaker']
+NODES_STATS_METRICS['connections'] = ['http', 'transport']
+NODES_STATS_METRICS['data_nodes'] = ['indices', 'fs']
+NODES_STATS_INDEX_METRICS = {}
+NODES_STATS_INDEX_METRICS['throughput'] = ['indexing', 'search', 'get', 'merge', 'refresh', 'flush']
+NODES_STATS_INDEX_METRICS['fielddata'] = ['fielddata']
+NODES_STATS_INDEX_METRICS['data_nodes'] = ['merge', 'store', 'docs']
+NODES_STATS_FIELDS = {}
+NODES_STATS_FIELDS['general'] = ['name', 'timestamp', 'roles', 'attributes', 'nodeRole']
+NODES_STATS_FIELDS['os'] = ['os.cpu.load_average', 'os.load_average', 'os.mem.used_percent']
+NODES_STATS_FIELDS['jvm'] = ['jvm.mem.heap_used_percent', 'jvm.mem.pools.old.used_in_bytes',
+                             'jvm.gc.collectors.*.collection_count', 'jvm.gc.collectors.*.collection_time_in_millis']
+NODES_STATS_FIELDS['threads'] = ['thread_pool.{pool}.active', 'thread_pool.{pool}.queue', 'thread_pool.{pool}.rejected']
+NODES_STATS_FIELDS['throughput'] = []
+NODES_STATS_FIELDS['fielddata'] = ['indices.fielddata.evictions', 'breakers.fielddata.tripped']
+NODES_STATS_FIELDS['connections'] = ['http.total_opened', 'http.current_open', 'transport.server_open']
+NODES_STATS_FIELDS['data_nodes'] = ['indices.merges.total_time_in_millis', 'indices.store.size_in_bytes', 'indices.docs.count',
+                                    'indices.docs.deleted', 'fs.total.total_in_bytes', 'fs.total.available_in_bytes']
+# Cumulative counters tracked per node for deltas and per-second rates, by category: counter -> node stats field
+NODE_COUNTERS = {}
+NODE_COUNTERS['general'] = {}
+NODE_COUNTERS['os'] = {}
+NODE_COUNTERS['jvm'] = {'old_gc_count': 'jvm.gc.collectors.old.collection_count',
+                        'old_gc_time': 'jvm.gc.collectors.old.collection_time_in_millis',
+                        'young_gc_count': 'jvm.gc.collectors.young.collection_count',
+                        'young_gc_time': 'jvm.gc.collectors.young.collection_time_in_millis'}
+NODE_COUNTERS['threads'] = {'{pool}_completed': 'thread_pool.{pool}.completed',
+                            '{pool}_rejected': 'thread_pool.{pool}.rejected'}
+NODE_COUNTERS['throughput'] = {'index_total': 'indices.indexing.index_total',
+                               'search_total': 'indices.search.query_total',
+                               'get_total': 'indices.get.total',
+                               'merge_total': 'indices.merges.total',
+                               'refresh_total': 'indices.refresh.total',
+                               'flush_total': 'indices.flush.total'}
+NODE_COUNTERS['fielddata'] = {'fd_evictions': 'indices.fielddata.evictions',
+                              'fd_tripped': 'breakers.fielddata.tripped'}
+NODE_COUNTERS['connections'] = {'http_opened': 'http.total_opened',
+                                'transport_rx': 'transport.rx_size_in_bytes',
+                                'transport_tx': 'transport.tx_size_in_bytes'}
+NODE_COUNTERS['data_nodes'] = {}
+
+# Typed values extracted for each category, as output by the jsonl and csv formats
+NODE_FIELDS = {}
+NODE_FIELDS['general'] = ['name', 'role', 'master', 'new']
+NODE_FIELDS['os'] = ['load_1m', 'load_5m', 'load_15m', 'mem_used_percent']
+NODE_FIELDS['jvm'] = ['heap_used_percent', 'old_pool_used_bytes', 'old_gc_count', 'old_gc_time_ms', 'old_gc_rate',
+                      'young_gc_count', 'young_gc_time_ms', 'young_gc_rate']
+NODE_FIELDS['threads'] = ['{pool}_active', '{pool}_queue', '{pool}_rejected', '{pool}_rejected_delta',
+                          '{pool}_completed_rate']
+NODE_FIELDS['throughput'] = ['index_rate', 'search_rate', 'get_rate', 'merge_rate', 'refresh_rate', 'flush_rate']
+NODE_FIELDS['fielddata'] = ['fielddata_evictions', 'fielddata_tripped']
+NODE_FIELDS['connections'] = ['http_current_open', 'http_opened', 'transport_server_open', 'transport_rx_rate',
+                              'transport_tx_rate']
+NODE_FIELDS['data_nodes'] = ['merge_time_ms', 'store_size_bytes', 'disk_used_bytes', 'disk_total_bytes',
+                             'disk_used_percent', 'docs_count', 'docs_deleted']
+CLUSTER_FIELDS = ['cluster_name', 'status', 'active_shards', 'active_primary_shards', 'relocating_shards',
+                  'initializing_shards', 'unassigned_shards', 'number_of_pending_tasks']
+# Fields common to cluster and node rows
+ROW_FIELDS = ['type', 'time', 'stale', 'age', 'error', 'cluster', 'node_id', 'missing', 'triggers']
+OUTPUT_FORMATS = ['table', 'jsonl', 'csv']
+# --sort keys, as the node values summed to rank nodes worst (largest) first; {pool} is every threadpool shown,
+# or only the one given as KEY:THREADPOOL
+SORT_KEYS = collections.OrderedDict()
+SORT_KEYS['heap'] = ['heap_used_percent']
+SORT_KEYS['queue'] = ['{pool}_queue']
+SORT_KEYS['rejected'] = ['{pool}_rejected_delta']
+SORT_KEYS['disk'] = ['disk_used_percent']
+SORT_KEYS['gc'] = ['old_gc_time_ms', 'young_gc_time_ms']
+# --window metrics, as the category providing them and the node values summed into each sample
+WINDOW_METRICS = collections.OrderedDict()
+WINDOW_METRICS['heap'] = ('jvm', ['heap_used_percent'])
+WINDOW_METRICS['load'] = ('os', ['load_1m'])
+WINDOW_METRICS['queue'] = ('threads', ['{pool}_queue'])
+WINDOW_METRICS['gc'] = ('jvm', ['old_gc_rate', 'young_gc_rate'])
+WINDOW_METRICS['disk'] = ('data_nodes', ['disk_used_percent'])
+WINDOW_STATS = ['min', 'avg', 'max', 'p95']
+# --rollup metrics, as the category providing them, the node values summed for each node, whether the role's
+# mean (and standard deviation) or total is shown, and its format (None for a human readable size)
+ROLLUP_METRICS = collections.OrderedDict()
+ROLLUP_METRICS['heap'] = ('jvm', ['heap_used_percent'], 'mean', "{0:.0f}%")
+ROLLUP_METRICS['load'] = ('os', ['load_1m'], 'mean', "{0:.2f}")
+ROLLUP_METRICS['active'] = ('threads', ['{pool}_active'], 'sum', "{0:.0f}")
+ROLLUP_METRICS['queue'] = ('threads', ['{pool}_queue'], 'sum', "{0:.0f}")
+ROLLUP_METRICS['rejected'] = ('threads', ['{pool}_rejected_delta'], 'sum', "{0:.0f}")
+ROLLUP_METRICS['docs'] = ('data_nodes', ['docs_count'], 'sum', "{0:.0f}")
+ROLLUP_METRICS['store'] = ('data_nodes', ['store_size_bytes'], 'sum', None)
+ROLLUP_METRICS['disk'] = ('data_nodes', ['disk_used_percent'], 'mean', "{0:.0f}%")
+ROLLUP_HEADINGS = {'mean': "avg(sd) skew", 'sum': "sum skew"}
+ROLLUP_TEMPLATE = """{role:<6} {nodes:>5}"""
+# --hot-indices: index stats are fetched for every index each update, and the shard counters of just the hot
+# indices.  Where their shard copies are comes from the routing table, fetched again only when the hot indices
+# change or the cluster state version (checked each update) moves on.
+INDEX_STATS_PARAMS = {'metric': 'indexing,search,merge',
+                      'filter_path': 'indices.*.total.indexing.index_total,indices.*.total.search.query_total,'
+                                     'indices.*.total.merges.current'}
+SHARD_STATS_PARAMS = {'metric': 'indexing,search', 'level': 'shards',
+                      'filter_path': 'indices.*.shards.*.routing.node,indices.*.shards.*.indexing.index_total,'
+                                     'indices.*.shards.*.search.query_total'}
+STATE_VERSION_PARAMS = {'metric': 'version', 'filter_path': 'version'}
+PLACEMENT_PARAMS = {'metric': 'version,routing_table',
+                    'filter_path': 'version,routing_table.indices.*.shards.*.node,routing_table.indices.*.shards.*.primary'}
+INDICES_TEMPLATE = """{index:32} {index_rate:>9} {search_rate:>9} {merges:>6}   {shards}"""
+INDEX_HEADINGS = {'index': "hot indices", 'index_rate': "idx/s", 'search_rate': "qry/s", 'merges': "merges",
+                  'shards': "hottest shards (shard, p/r, node: idx/s|qry/s)"}
+HOT_SHARDS = 3  # shard copies shown for each hot index
+CAPTURE_OPERATORS = collections.OrderedDict([('>=', operator.ge), ('>', operator.gt)])
+
+# time.monotonic is Python 3.3+; fall back to wall clock time elsewhere
+monotonic = getattr(time, 'monotonic', time.time)
+
+FetchResult = collections.namedtuple('FetchResult', ['response', 'error', 'elapsed', 'fetched_at', 'stale'])
+TimeOfDay = collections.namedtuple('TimeOfDay', ['time', 'span'])
+Rate = collections.namedtuple('Rate', ['delta', 'per_second'])
+Rollup = collections.namedtuple('Rollup', ['count', 'total', 'mean', 'spread', 'median', 'max', 'skew'])
+
+
+def positive_int(value):
+    """argparse type for a whole number of seconds, more than 0"""
+    try:
+        seconds = int(value)
+    except ValueError:
+        seconds = 0
+    if seconds <= 0:
+        raise argparse.ArgumentTypeError("{0} is not a valid number of seconds (1 or more)".format(value))
+    return seconds
+
+
+def positive_float(value):
+    """argparse type for a number of seconds, more than 0"""
+    try:
+        seconds = float(value)
+    except ValueError:
+        seconds = 0
+    if not seconds > 0:
+        raise argparse.ArgumentTypeError("{0} is not a valid number of seconds (more than 0)".format(value))
+    return seconds
+
+
+def replay_speed(value):
+    """argparse type for a replay speed such as 10x"""
+    try:
+        speed = float(value.lower().rstrip('x'))
+    except ValueError:
+        speed = 0
+    if speed <= 0:
+        raise argparse.ArgumentTypeError("{0} is not a valid replay speed".format(value))
+    return speed
+
+
+def listen_address(value):
+    """argparse type for an address to listen on, given as [HOST]:PORT"""
+    host, _, port = value.rpartition(':')
+    if not port.isdigit():
+        raise argparse.ArgumentTypeError("{0} is not a valid [HOST]:PORT to listen on".format(value))
+    return (host, int(port))
+
+
+def window_size(value):
+    """argparse type for a --window size, a number of updates"""
+    try:
+        size = int(value)
+    except ValueError:
+        size = 0
+    if size < 1:
+        raise argparse.ArgumentTypeError("{0} is not a valid window (1 or more updates)".format(value))
+    return size
+
+
+def window_stats(value):
+    """argparse type for --window-stats, a comma-separated list of statistics"""
+    stats = value.split(',')
+    for stat in stats:
+        if stat not in WINDOW_STATS:
+            raise argparse.ArgumentTypeError("{0} is not valid, please choose window statistics from {1}".format(
+                stat, ', '.join(WINDOW_STATS)))
+    return stats
+
+
+def get_rss_kb():
+    """Resident set size of this process in KB (the peak size where the current size is not available)"""
+    try:
+        with open('/proc/self/statm') as statm:
+            return int(statm.read().split()[1]) * resource.getpagesize() // 1024
+    except (IOError, OSError, ValueError, IndexError):
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+
+def percentile(values, percent):
+    """The value at percent (0-100) of the way through the sorted values"""
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * percent / 100.0))]
+
+
+def import_numpy():
+    """Import numpy for summarize_column, if it is installed"""
+    global numpy
+    try:
+        import numpy
+    except ImportError:
+        numpy = None  # --rollup works out its statistics in Python instead
+
+
+def summarize_column(column):
+    """Summarize an array('d') (or numpy array) of node values as a Rollup (None if empty), vectorized with numpy if
+    installed"""
+    count = len(column)
+    if not count:
+        return None
+    if numpy is not None:
+        values = numpy.frombuffer(column, dtype=numpy.float64)
+        total = float(values.sum())
+        spread = float(values.std())
+        median = float(numpy.median(values))
+        largest = float(values.max())
+    else:
+        values = sorted(column)
+        total = sum(values)
+        spread = (sum((value - total / count) ** 2 for value in values) / count) ** 0.5
+        middle = count // 2
+        median = values[middle] if count % 2 else (values[middle - 1] + values[middle]) / 2.0
+        largest = values[-1]
+    # skew: how far the busiest node is above the typical one, which picks out hot nodes
+    return Rollup(count, total, total / count, spread, median, largest, largest / median if median else None)
+
+
+def node_filter(value):
+    """argparse type for a node filter such as role=DATA,name=~hot-*, as (field, pattern, is glob) terms"""
+    terms = []
+    for term in value.split(','):
+        field, matches, pattern = term.partition('=')
+        if not field or not matches:
+            raise argparse.ArgumentTypeError("{0} is not a valid filter (FIELD=VALUE or FIELD=~GLOB)".format(term))
+        if pattern.startswith('~'):
+            terms.append((field, pattern[1:], True))
+        else:
+            terms.append((field, pattern, False))
+    return terms
+
+
+def capture_rule(value):
+    """argparse type for a --capture rule such as search_queue>50, as (rule, field, operator, threshold)"""
+    for symbol, compare in CAPTURE_OPERATORS.items():
+        field, found, threshold = value.partition(symbol)
+        if found:
+            try:
+                return (value, field, compare, float(threshold))
+            except ValueError:
+                break
+    raise argparse.ArgumentTypeError("{0} is not a valid capture rule (FIELD>VALUE or FIELD>=VALUE)".format(value))
+
+
+def capture_directory(value):
+    """argparse type for --capture-dir, creating the directory if need be and checking it can be written to"""
+    if not os.path.isdir(value):
+        try:
+            os.makedirs(value)
+        except OSError as e:
+            raise argparse.ArgumentTypeError("can't create {0}: {1}".format(value, e.strerror))
+    if not os.access(value, os.W_OK | os.X_OK):
+        raise argparse.ArgumentTypeError("can't write to {0}".format(value))
+    return value
+
+
+def time_of_day(value):
+    """argparse type for a time of day given as HH:MM or HH:MM:SS, along with the seconds it spans"""
+    for time_format, span in [("%H:%M", 60), ("%H:%M:%S", 1)]:
+        try:
+            return TimeOfDay(datetime.datetime.strptime(value, time_format).time(), span)
+        except ValueError:
+            pass
+    raise argparse.ArgumentTypeError("{0} is not a valid time of day (HH:MM)".format(value))
 
 
 class ESArgParser(argparse.ArgumentParser):
-    """ArgumentParser which prints help by default on any arg parsing error"""
+    """ArgumentParser which prints help by default on any arg parsing error, followed by the error"""
     def error(self, message):
         self.print_help()
+        sys.stderr.write("{0}: error: {1}\n".format(self.prog, message))
         sys.exit(2)
 
 
@@ -91,36 +406,1748 @@ class ESColors:
     WHITE = '\033[1;37m'
 
 
+class ESFetcher(object):
+    """Issues the per-tick Elasticsearch requests in parallel against a shared deadline
+
+    A request still running when the deadline passes is left to finish in the background, and is not issued
+    again until it does.  Until a fresh response arrives, the last good response for that request is returned
+    flagged as stale.
+    """
+
+    def __init__(self, timeout):
+        self.timeout = timeout
+        self.lock = threading.Lock()
+        self.inflight = {}  # request name -> worker thread
+        self.completed = {}  # request name -> newest FetchResult not yet handed out
+        self.last_good = {}  # request name -> last successful FetchResult
+
+    def _run(self, name, request):
+        started = monotonic()
+        try:
+            response, error = request(), None
+        except Exception as e:
+            response, error = None, e
+        result = FetchResult(response, error, monotonic() - started, time.time(), False)
+        with self.lock:
+            self.inflight.pop(name, None)
+            self.completed[name] = result
+            if error is None:
+                self.last_good[name] = result
+
+    def fetch(self, requests, deadline=None, background=()):
+        """Run each (name, callable) in requests concurrently and return a dict of name -> FetchResult
+
+        Waits at most the fetcher timeout, or until the (monotonic) deadline if that comes first.  Requests named
+        in background are not waited for at all: they are returned once they have finished, on a later fetch.
+        """
+        if deadline is None or deadline > monotonic() + self.timeout:
+            deadline = monotonic() + self.timeout
+        with self.lock:
+            for name, request in requests:
+                if name not in self.inflight:
+                    worker = threading.Thread(target=self._run, args=(name, request))
+                    worker.daemon = True
+                    self.inflight[name] = worker
+                    worker.start()
+            workers = [thread for name, thread in self.inflight.items() if name not in background]
+        for worker in workers:
+            worker.join(max(0, deadline - monotonic()))
+
+        results = {}
+        with self.lock:
+            for name, request in requests:
+                fresh = self.completed.pop(name, None)
+                if fresh is not None and fresh.error is None:
+                    results[name] = fresh
+                    continue
+                error = fresh.error if fresh is not None else "timed out after {0}s".format(self.timeout)
+                if name in self.last_good:
+                    results[name] = self.last_good[name]._replace(error=error, stale=True)
+                else:
+                    results[name] = FetchResult(None, error, None, None, True)
+        return results
+
+
+class FieldTree(object):
+    """The node stats fields wanted from one object of a node's stats, keyed along their dotted paths
+
+    flatten() copies just those fields out of the object into a flat record keyed by the dotted path, keeping a
+    field's value whole where the path ends.  A '*' key stands for every key, the keys it meets being expanded
+    into their own trees as they are first seen.
+    """
+
+    __slots__ = ['prefix', 'children', 'items', 'wildcard', 'expanded']
+
+    def __init__(self, prefix=''):
+        self.prefix = prefix
+        self.children = {}  # key -> (path, FieldTree, or None to keep the value whole)
+        self.items = []  # (key, path, FieldTree or None) of the children, walked by flatten
+        self.wildcard = None  # (path, FieldTree or None) standing for '*'
+        self.expanded = {}  # key -> (path, FieldTree or None) for keys met by the wildcard
+
+    @classmethod
+    def build(cls, fields):
+        """The tree of the dotted fields given"""
+        tree = cls()
+        for field in fields:
+            tree.add(field.split('.'))
+        tree.finish()
+        return tree
+
+    def add(self, keys):
+        key = keys[0]
+        path, child = self.children.get(key, (self.prefix + key, False))
+        if child is None:
+            return  # already kept whole
+        if len(keys) == 1:
+            self.children[key] = (path, None)
+            return
+        if not child:
+            child = FieldTree(path + '.')
+            self.children[key] = (path, child)
+        child.add(keys[1:])
+
+    def merge(self, other):
+        """Add the fields of other, a tree at another path, to this one"""
+        for key, (path, child) in other.children.items():
+            if child is None:
+                self.children[key] = (self.prefix + key, None)
+            elif key not in self.children:
+                self.children[key] = (self.prefix + key, child.copy(self.prefix + key + '.'))
+            elif self.children[key][1] is not None:
+                self.children[key][1].merge(child)
+
+    def copy(self, prefix):
+        tree = FieldTree(prefix)
+        tree.merge(self)
+        tree.finish()
+        return tree
+
+    def finish(self):
+        """Fold the wildcard's fields into each key named alongside it, and list the children for flatten"""
+        self.wildcard = self.children.get('*')
+        for key, (path, child) in self.children.items():
+            if self.wildcard is not None and key != '*':
+                if self.wildcard[1] is None:
+                    self.children[key] = (path, None)
+                elif child is not None:
+                    child.merge(self.wildcard[1])
+        for key, (path, child) in self.children.items():
+            if child is not None:
+                child.finish()
+        self.items = [(key, path, child) for key, (path, child) in self.children.items() if key != '*']
+
+    def expand(self, key):
+        """The (path, tree) the wildcard stands for at key"""
+        path = self.prefix + key
+        template = self.wildcard[1]
+        # several fetcher threads may flatten at once; setdefault keeps the first expansion
+        return self.expanded.setdefault(key, (path, None if template is None else template.copy(path + '.')))
+
+    def flatten(self, value, record):
+        """Copy the wanted fields of value, the object at this tree's prefix, into record"""
+        for key, path, child in self.items:
+            if key in value:
+                if child is None:
+                    record[path] = value[key]
+                elif isinstance(value[key], dict):
+                    child.flatten(value[key], record)
+        if self.wildcard is not None:
+            for key in value:
+                if key not in self.children:
+                    path, child = self.expanded.get(key) or self.expand(key)
+                    if child is None:
+                        record[path] = value[key]
+                    elif isinstance(value[key], dict):
+                        child.flatten(value[key], record)
+
+
+class NodeStatsDecoder(object):
+    """Decodes a node stats response into one flat record per node, holding only the fields elasticstat uses
+
+    A record is a dict of the wanted fields keyed by their dotted path ('jvm.mem.heap_used_percent'), so the
+    nested objects of each node's stats are dropped as soon as the node is decoded rather than being kept for the
+    whole update.  The response is walked down to each node, whose stats are decoded by the json module's own
+    scanner and flattened straight away; everything outside 'nodes' is decoded as usual.
+    """
+
+    def __init__(self, fields):
+        self.fields = FieldTree.build(fields)
+        self.scan_once = json.scanner.make_scanner(json.JSONDecoder())
+
+    def record(self, node):
+        record = {}
+        if isinstance(node, dict):
+            self.fields.flatten(node, record)
+        return record
+
+    def project(self, response):
+        """The records of a node stats response already decoded some other way (e.g. by a client given to us)"""
+        if not isinstance(response, dict) or not isinstance(response.get('nodes'), dict):
+            return response
+        projected = dict(response)
+        projected['nodes'] = dict((node_id, self.record(node)) for node_id, node in response['nodes'].items())
+        return projected
+
+    def decode(self, s):
+        """Decode the node stats response s; raises ValueError, IndexError or StopIteration if it is not a JSON object"""
+        response, end = self.decode_object(s, self.skip(s, 0), self.decode_member)
+        if self.skip(s, end) != len(s):
+            raise ValueError("Extra data at {0}".format(end))
+        return response
+
+    def decode_member(self, key, s, end):
+        if key == 'nodes' and s[end] == '{':
+            return self.decode_object(s, end, self.decode_node)
+        return self.scan_once(s, end)
+
+    def decode_node(self, node_id, s, end):
+        node, end = self.scan_once(s, end)
+        return self.record(node), end
+
+    def decode_object(self, s, end, decode_value):
+        """Decode the object starting at s[end], each value with decode_value(key, s, end) -> (value, end)"""
+        if s[end] != '{':
+            raise ValueError("Expecting object at {0}".format(end))
+        decoded = {}
+        end = self.skip(s, end + 1)
+        if s[end] == '}':
+            return decoded, end + 1
+        while True:
+            if s[end] != '"':
+                raise ValueError("Expecting property name at {0}".format(end))
+            key, end = json.decoder.scanstring(s, end + 1)
+            end = self.skip(s, end)
+            if s[end] != ':':
+                raise ValueError("Expecting ':' at {0}".format(end))
+            decoded[key], end = decode_value(key, s, self.skip(s, end + 1))
+            end = self.skip(s, end)
+            if s[end] == '}':
+                return decoded, end + 1
+            if s[end] != ',':
+                raise ValueError("Expecting ',' at {0}".format(end))
+            end = self.skip(s, end + 1)
+
+    def skip(self, s, end):
+        """Skip any whitespace at s[end]"""
+        if end < len(s) and s[end] in ' \t\n\r':
+            end = json.decoder.WHITESPACE.match(s, end).end()
+        return end
+
+
+class NodeStatsSerializer(object):
+    """Wraps the client's JSONSerializer to decode the response to a request with a NodeStatsDecoder, if one is set
+    on the request's thread (see Elasticstat.request_nodes_stats); every other response is decoded as usual
+    """
+
+    mimetype = 'application/json'
+
+    def __init__(self):
+        from elasticsearch.serializer import JSONSerializer
+        self.serializer = JSONSerializer()
+        self.local = threading.local()
+
+    def dumps(self, data):
+        return self.serializer.dumps(data)
+
+    def loads(self, s):
+        decoder = getattr(self.local, 'decoder', None)
+        if decoder is None:
+            return self.serializer.loads(s)
+        try:
+            return decoder.decode(s)
+        except (ValueError, IndexError, StopIteration):
+            # not a JSON object; leave it to the client's serializer to decode, or to raise its own error
+            return decoder.project(self.serializer.loads(s))
+
+
+class MeasuringJSONSerializer(NodeStatsSerializer):
+    """Notes the size and decode time of the responses decoded, per thread
+
+    ESFetcher runs each request on its own thread, so the request can take() what was decoded for it.
+    """
+
+    def __init__(self):
+        super(MeasuringJSONSerializer, self).__init__()
+        self.measured = threading.local()
+
+    def loads(self, s):
+        started = monotonic()
+        try:
+            return super(MeasuringJSONSerializer, self).loads(s)
+        finally:
+            self.measured.size = getattr(self.measured, 'size', 0) + len(s)
+            self.measured.decode_time = getattr(self.measured, 'decode_time', 0) + monotonic() - started
+
+    def take(self):
+        """Return and reset the (bytes, decode seconds) decoded on this thread, or (None, None) if nothing was"""
+        measured = (getattr(self.measured, 'size', None), getattr(self.measured, 'decode_time', None))
+        self.measured.__dict__.clear()
+        return measured
+
+
+class SelfStats(object):
+    """Measures where elasticstat's own time goes each tick, for --self-stats
+
+    Each tick records the wall time, response bytes and decode time of each request, the time spent processing
+    (in total and in each category's get_node_* and process_node_* methods), rendering and writing the output,
+    and the process RSS.  Ticks are optionally appended to a trace file as JSON lines, and summarized on close.
+    """
+
+    def __init__(self, trace_path=None):
+        self.trace = open(trace_path, 'a') if trace_path else None
+        self.lock = threading.Lock()
+        self.responses = {}  # request name -> (bytes, decode seconds), noted from the fetcher's threads
+        self.tick = None  # metric -> value for the tick in progress
+        self.last_tick = {}
+        self.history = collections.OrderedDict()  # metric -> value of each tick, for the summary
+
+    def start_tick(self):
+        self.tick = collections.OrderedDict()
+
+    def add(self, metric, value):
+        self.tick[metric] = self.tick.get(metric, 0) + value
+
+    def timed(self, metric, func):
+        """Wrap func to add the milliseconds each call takes to metric"""
+        def timed_func(*args):
+            started = monotonic()
+            try:
+                return func(*args)
+            finally:
+                self.add(metric, (monotonic() - started) * 1000)
+        return timed_func
+
+    def note_response(self, name, size, decode_time):
+        with self.lock:
+            # with --fan-out, each batch of node stats adds to the same response
+            noted_size, noted_time = self.responses.get(name, (None, None))
+            if noted_size is not None and size is not None:
+                size += noted_size
+            if noted_time is not None and decode_time is not None:
+                decode_time += noted_time
+            self.responses[name] = (size, decode_time)
+
+    def add_fetch(self, results):
+        for name, result in results.items():
+            if result.stale or result.elapsed is None:
+                continue
+            self.add('fetch_' + name + '_ms', result.elapsed * 1000)
+            with self.lock:
+                size, decode_time = self.responses.pop(name, (None, None))
+            if size is not None:
+                self.add('bytes_' + name, size)
+            if decode_time is not None:
+                self.add('decode_' + name + '_ms', decode_time * 1000)
+
+    def end_tick(self, now):
+        self.add('rss_kb', get_rss_kb())
+        for metric, value in self.tick.items():
+            self.history.setdefault(metric, []).append(value)
+        if self.trace is not None:
+            trace = collections.OrderedDict([('time', now)])
+            trace.update(self.tick)
+            self.trace.write(json.dumps(trace) + "\n")
+            self.trace.flush()
+        self.last_tick = self.tick
+
+    def footer(self):
+        """Format this tick's fetch and processing measurements, with the last tick's render time, for the table"""
+        tick = self.tick
+        segments = []
+        for name in ['cluster_health', 'nodes_stats', 'active_master']:
+            if 'fetch_' + name + '_ms' not in tick:
+                segments.append("{0} stale".format(name))
+                continue
+            segment = "{0} {1:.0f}ms".format(name, tick['fetch_' + name + '_ms'])
+            if 'bytes_' + name in tick:
+                segment += " {0:.1f}kb".format(tick['bytes_' + name] / 1024.0)
+            if 'decode_' + name + '_ms' in tick:
+                segment += " (decode {0:.1f}ms)".format(tick['decode_' + name + '_ms'])
+            segments.append(segment)
+        lines = ["self: " + "  ".join(segments)]
+        categories = ["{0} {1:.1f}".format(metric[len('get_node_'):-len('_ms')],
+                                           value + tick.get(metric.replace('get_node_', 'process_node_'), 0))
+                      for metric, value in tick.items() if metric.startswith('get_node_')]
+        lines.append("self: process {0:.1f}ms ({1})  render {2:.1f}ms (write {3:.1f}ms, last update)  rss {4:.1f}mb".format(
+            tick.get('process_ms', 0), ", ".join(categories), self.last_tick.get('render_ms', 0),
+            self.last_tick.get('write_ms', 0), get_rss_kb() / 1024.0))
+        return lines
+
+    def summary(self):
+        """Format the p50/p95/max of every metric over the ticks seen"""
+        ticks = max([len(values) for values in self.history.values()] or [0])
+        lines = ["{0:40} {1:>10} {2:>10} {3:>10}".format("self stats over {0} updates".format(ticks), "p50", "p95", "max")]
+        for metric, values in self.history.items():
+            lines.append("{0:40} {1:>10.1f} {2:>10.1f} {3:>10.1f}".format(
+                metric, percentile(values, 50), percentile(values, 95), max(values)))
+        return lines
+
+    def close(self):
+        if self.trace is not None:
+            self.trace.close()
+
+
+class TickScheduler(object):
+    """Starts ticks on a fixed-rate grid of the monotonic clock
+
+    Sleeping a fixed interval after each update makes the real period fetch time + render time + interval.
+    Instead, tick N is started at start + N * interval; a tick that runs past its slot is counted as an
+    overrun and the slots it overran are skipped, so the grid (and the window each delta covers) never drifts.
+    """
+
+    def __init__(self, interval):
+        self.interval = interval
+        self.start = None
+        self.slot = 0
+        self.next_start = None
+        self.last_tick = None
+        self.period = None  # real time between the starts of the last two ticks
+        self.overruns = 0
+
+    def tick(self):
+        """Mark the start of a tick"""
+        now = monotonic()
+        if self.start is None:
+            self.start = now
+        if self.last_tick is not None:
+            self.period = now - self.last_tick
+        self.last_tick = now
+        self.next_start = self.start + (self.slot + 1) * self.interval
+
+    def wait(self):
+        """Sleep until the next free slot on the grid"""
+        now = monotonic()
+        self.slot += 1
+        if now > self.next_start:
+            # overran our slot; skip ahead to the next slot that is still in the future
+            self.overruns += 1
+            self.slot += int((now - self.next_start) // self.interval) + 1
+            self.next_start = self.start + self.slot * self.interval
+        time.sleep(self.next_start - now)
+
+    def set_interval(self, interval):
+        """Change the interval from the next tick on, re-anchoring the grid at the start of the current tick"""
+        if interval == self.interval or self.last_tick is None:
+            self.interval = interval
+            return
+        self.interval = interval
+        self.start = self.last_tick
+        self.slot = 0
+        self.next_start = self.start + interval
+
+
+class AdaptiveInterval(object):
+    """Stretches the polling interval while a cluster is struggling, and eases it back as the cluster recovers
+
+    An update shows strain if a request failed or timed out, node stats took over half the interval being
+    polled at or three times as long as usual, or more than pending_floor tasks are pending and that number grew.
+    Each update showing strain doubles the interval, up to max_interval; each healthy one shrinks it by a quarter,
+    back down to the configured interval (or min_interval, if that is longer), as long as node stats would still
+    take under half the shorter interval.
+    """
+
+    def __init__(self, interval, min_interval, max_interval, pending_floor=10):
+        self.base_interval = max(interval, min_interval)
+        self.max_interval = max(max_interval, self.base_interval)
+        self.pending_floor = pending_floor
+        self.interval = self.base_interval
+        self.usual_latency = None  # moving average of node stats latency over healthy updates
+        self.pending_tasks = None
+
+    def strained(self, results, latency, pending_tasks):
+        if any(result.error is not None for result in results.values()):
+            return True
+        if latency is not None:
+            if latency > self.interval / 2.0:
+                return True
+            if self.usual_latency is not None and latency > 3 * self.usual_latency:
+                return True
+        return (pending_tasks is not None and self.pending_tasks is not None and
+                pending_tasks > self.pending_floor and pending_tasks > self.pending_tasks)
+
+    def update(self, results, cluster_row):
+        """Take an update's fetch results and cluster row into account, returning the interval to poll at next"""
+        nodes_stats = results['nodes_stats']
+        latency = nodes_stats.elapsed if not nodes_stats.stale else None
+        pending_tasks = cluster_row.get('number_of_pending_tasks')
+        if self.strained(results, latency, pending_tasks):
+            self.interval = min(self.max_interval, round(self.interval * 2, 1))
+        else:
+            if latency is not None:
+                self.usual_latency = latency if self.usual_latency is None else 0.8 * self.usual_latency + 0.2 * latency
+            shorter = max(self.base_interval, round(self.interval * 0.75, 1))
+            if latency is None or latency <= shorter / 2.0:
+                # otherwise the shorter interval would only show strain again
+                self.interval = shorter
+        if pending_tasks is not None:
+            self.pending_tasks = pending_tasks
+        return self.interval
+
+
+class NodeFanOut(object):
+    """Splits node stats into requests for batches of nodes, so a slow node holds back only its own batch
+
+    Node ids come from the cluster state, refreshed alongside each update (so a node which joins is fetched from
+    the update after).  A node whose batch misses the deadline keeps its last stats, flagged stale; since those
+    carry the node's own timestamp, its rates cover the whole time since once fresh stats arrive.
+    """
+
+    def __init__(self, batch_size):
+        self.batch_size = batch_size
+        self.node_ids = []  # nodes in the cluster, as of the latest node list
+        self.batches = []  # node ids of each batch requested this update
+        self.last_stats = {}  # node id -> (last stats received, time received)
+
+    def update_node_ids(self, node_list):
+        """Take a new node list (cluster state with the nodes metric), forgetting nodes no longer in it"""
+        self.node_ids = sorted(node_list.get('nodes', {}))
+        node_ids = set(self.node_ids)
+        for node_id in list(self.last_stats):
+            if node_id not in node_ids:
+                del self.last_stats[node_id]
+
+    def requests(self, request_batch):
+        """This update's (name, callable) requests, one per batch, with request_batch(node_ids) making each"""
+        self.batches = [self.node_ids[start:start + self.batch_size]
+                        for start in range(0, len(self.node_ids), self.batch_size)]
+        return [('nodes_stats/{0}'.format(index), request_batch(batch)) for index, batch in enumerate(self.batches)]
+
+    def merge(self, results):
+        """Take the batch results out of results, returning them merged into one node stats FetchResult along
+        with the stale nodes (node id -> time their stats were received)"""
+        nodes = {}
+        stale_nodes = {}
+        errors = []
+        elapsed = []
+        fetched_at = []
+        for index in range(len(self.batches)):
+            result = results.pop('nodes_stats/{0}'.format(index))
+            if result.stale:
+                errors.append(result.error)
+                continue
+            elapsed.append(result.elapsed)
+            fetched_at.append(result.fetched_at)
+            for node_id, node in result.response.get('nodes', {}).items():
+                # may be an earlier update's batch which has just finished; any node in it is still fresher
+                self.last_stats[node_id] = (node, result.fetched_at)
+                nodes[node_id] = node
+        for batch in self.batches:
+            for node_id in batch:
+                if node_id not in nodes and node_id in self.last_stats:
+                    nodes[node_id], stale_nodes[node_id] = self.last_stats[node_id]
+        error = None
+        if errors:
+            error = "{0} of {1} batches: {2}".format(len(errors), len(self.batches), errors[0])
+        if not fetched_at:
+            if not self.last_stats:
+                return (FetchResult(None, error, None, None, True), {})
+            return (FetchResult({'nodes': nodes}, error, None, max(stale_nodes.values() or [None]), True), {})
+        return (FetchResult({'nodes': nodes}, error, max(elapsed), max(fetched_at), False), stale_nodes)
+
+
+class CounterRates(object):
+    """Previous sample of each node's cumulative counters, used to derive deltas and per-second rates
+
+    Rates are computed over the stats timestamp reported by the node itself, so they are not skewed by fetch
+    latency or by a node whose response was late.  A counter lower than its previous sample means the node
+    restarted while keeping its node id; the new value is then the best available delta.
+    """
+
+    def __init__(self):
+        self.samples = {}  # node_id -> (timestamp in ms, {counter: value})
+        self.rates = {}  # node_id -> {counter: Rate} between the last two samples
+
+    def update(self, node_id, timestamp, counters):
+        """Add a sample of a node's counters, returning {counter: Rate} (empty for the node's first sample)"""
+        previous = self.samples.get(node_id)
+        if previous is not None and timestamp <= previous[0]:
+            # Same sample as last time (i.e. a stale response), keep the rates we already have
+            return self.rates[node_id]
+        self.samples[node_id] = (timestamp, counters)
+        rates = {}
+        if previous is not None:
+            elapsed = (timestamp - previous[0]) / 1000.0
+            for counter, value in counters.items():
+                last_value = previous[1].get(counter)
+                if last_value is None:
+                    continue
+                delta = value - last_value if value >= last_value else value
+                rates[counter] = Rate(delta, delta / elapsed)
+        self.rates[node_id] = rates
+        return rates
+
+    def forget(self, node_id):
+        self.samples.pop(node_id, None)
+        self.rates.pop(node_id, None)
+
+
+class NodeWindow(object):
+    """A node's ring buffers for RollingWindows"""
+    __slots__ = ['samples', 'position', 'timestamp']
+
+    def __init__(self, samples):
+        self.samples = samples  # array('d'), a ring of RollingWindows.size samples per metric, one after the other
+        self.position = 0  # slot the next sample goes in
+        self.timestamp = None  # node timestamp of the latest sample
+
+
+class RollingWindows(object):
+    """The last few samples of some node values, kept per node in ring buffers, with min/avg/max/p95 over them
+
+    Each node's samples are held in a single preallocated array('d') which is overwritten in turn, so the memory
+    held per node stays the same however long elasticstat runs.  A missing value is stored as NaN and left out of
+    the statistics.
+    """
+
+    def __init__(self, size, metrics, stats):
+        self.size = size
+        self.metrics = metrics  # [(metric, [node values summed into each sample])]
+        self.stats = stats
+        self.windows = {}  # node_id -> NodeWindow
+
+    def heading(self, metric):
+        return "{0} {1}".format(metric, "/".join(self.stats))
+
+    def get_fields(self):
+        return [metric + '_' + stat for metric, fields in self.metrics for stat in self.stats]
+
+    def sample(self, values, fields):
+        present = [values[field] for field in fields if values.get(field) is not None]
+        return float(sum(present)) if present else float('nan')
+
+    def update(self, node_id, timestamp, values):
+        """Add a node's values as a sample (once per node timestamp), returning its statistics over the window"""
+        window = self.windows.get(node_id)
+        if window is None:
+            window = NodeWindow(array.array('d', [float('nan')]) * (self.size * len(self.metrics)))
+            self.windows[node_id] = window
+        if timestamp != window.timestamp:
+            window.timestamp = timestamp
+            for index, (metric, fields) in enumerate(self.metrics):
+                window.samples[index * self.size + window.position] = self.sample(values, fields)
+            window.position = (window.position + 1) % self.size
+        statistics = {}
+        for index, (metric, fields) in enumerate(self.metrics):
+            start = index * self.size
+            samples = sorted(sample for sample in window.samples[start:start + self.size] if sample == sample)  # not NaN
+            for stat in self.stats:
+                if not samples:
+                    statistics[metric + '_' + stat] = None
+                elif stat == 'min':
+                    statistics[metric + '_' + stat] = samples[0]
+                elif stat == 'max':
+                    statistics[metric + '_' + stat] = samples[-1]
+                elif stat == 'avg':
+                    statistics[metric + '_' + stat] = sum(samples) / len(samples)
+                else:
+                    statistics[metric + '_' + stat] = percentile(samples, 95)
+        return statistics
+
+    def forget(self, node_id):
+        self.windows.pop(node_id, None)
+
+
+class RoleRollups(object):
+    """Sums, means, spread and skew of node values for each role
+
+    Each update the node values are sampled into CounterArrays, a slot per node, and the column of each role and
+    metric is then taken from its nodes' slots in one go (by index, with numpy when installed) and summarized as a
+    whole (see summarize_column).
+    """
+
+    def __init__(self, metrics):
+        self.metrics = metrics  # [(metric, [node values summed for each node])]
+        self.arrays = CounterArrays([metric for metric, fields in metrics])
+
+    def sample(self, values):
+        """A node's values of each metric, None where the node has none"""
+        sample = []
+        for metric, fields in self.metrics:
+            present = [values[field] for field in fields if values.get(field) is not None]
+            sample.append(sum(present) if present else None)
+        return sample
+
+    def get_columns(self, slots_by_role):
+        """Take the role -> [slot] of each role's nodes into an OrderedDict of role -> [array('d') per metric],
+        leaving out nodes without a value"""
+        columns = collections.OrderedDict()
+        for role, slots in slots_by_role.items():
+            if numpy is not None:
+                index = numpy.array(slots, dtype=numpy.intp)
+                role_columns = []
+                for values in self.arrays.values:
+                    column = numpy.frombuffer(values, dtype=numpy.float64)[index]
+                    role_columns.append(column[~numpy.isnan(column)])
+            else:
+                role_columns = [array.array('d', [values[slot] for slot in slots if values[slot] == values[slot]])
+                                for values in self.arrays.values]
+            columns[role] = role_columns
+        return columns
+
+    def update(self, node_rows, sampled_at):
+        """Summarize the node rows sampled at sampled_at, as an OrderedDict of role -> (number of nodes,
+        {metric: Rollup or None})"""
+        samples = {}
+        node_ids_by_role = collections.OrderedDict()
+        for values in node_rows:
+            if not values['missing']:
+                samples[values['node_id']] = self.sample(values)
+                node_ids_by_role.setdefault(values['role'], []).append(values['node_id'])
+        self.arrays.update(samples, sampled_at)
+        slots_by_role = collections.OrderedDict((role, [self.arrays.slots[node_id] for node_id in node_ids])
+                                                for role, node_ids in node_ids_by_role.items())
+        rollups = collections.OrderedDict()
+        for role, role_columns in self.get_columns(slots_by_role).items():
+            nodes = max(len(column) for column in role_columns)
+            rollups[role] = (nodes, dict((metric, summarize_column(column))
+                                         for column, (metric, fields) in zip(role_columns, self.metrics)))
+        return rollups
+
+
+class CounterArrays(object):
+    """Cumulative counters of a changing set of keys (such as indices or shard copies), with per-second rates
+
+    Counters and rates are held in parallel array('d') columns, a slot per key; the slots of keys which have gone
+    are reused, so the columns only grow to the most keys seen at once.  Rates are NaN until a key's second sample,
+    and after a counter goes backwards (such as an index deleted and created again).
+    """
+
+    def __init__(self, counters):
+        self.counters = counters
+        self.slots = {}  # key -> slot
+        self.keys = []  # slot -> key, or None for a free slot
+        self.free = []  # free slots
+        self.values = [array.array('d') for counter in counters]  # latest sample of each counter
+        self.rates = [array.array('d') for counter in counters]
+        self.sampled_at = None
+
+    def add(self, key):
+        if self.free:
+            slot = self.free.pop()
+            self.keys[slot] = key
+            for column in self.values + self.rates:
+                column[slot] = float('nan')  # nothing carried over from the key which had the slot
+        else:
+            slot = len(self.keys)
+            self.keys.append(key)
+            for column in self.values + self.rates:
+                column.append(float('nan'))
+        self.slots[key] = slot
+        return slot
+
+    def remove(self, key):
+        slot = self.slots.pop(key)
+        self.keys[slot] = None
+        self.free.append(slot)
+
+    def update(self, samples, sampled_at):
+        """Take a sample ({key: [counter values]}) taken at sampled_at, once per sample time"""
+        if sampled_at == self.sampled_at:
+            return  # a stale response, already taken
+        elapsed = None if self.sampled_at is None else sampled_at - self.sampled_at
+        for key in [key for key in self.slots if key not in samples]:
+            self.remove(key)
+        nan = float('nan')
+        for key, sample in samples.items():
+            slot = self.slots.get(key)
+            if slot is None:
+                slot = self.add(key)
+            for values, rates, value in zip(self.values, self.rates, sample):
+                previous = values[slot]
+                if elapsed and value is not None and previous == previous and value >= previous:
+                    rates[slot] = (value - previous) / elapsed
+                else:
+                    rates[slot] = nan
+                values[slot] = nan if value is None else value
+        self.sampled_at = sampled_at
+
+    def get(self, key, counter, rate=True):
+        """A key's latest rate (or value) of a counter, None if there is none"""
+        column = (self.rates if rate else self.values)[self.counters.index(counter)]
+        value = column[self.slots[key]]
+        return None if value != value else value
+
+    def top(self, count, counters):
+        """The count keys with the highest sum of these counters' rates, highest first, of those with a rate"""
+        columns = [self.rates[self.counters.index(counter)] for counter in counters]
+
+        def busy(slot):
+            return sum(column[slot] for column in columns if column[slot] == column[slot])
+
+        def rated(slot):
+            return self.keys[slot] is not None and any(column[slot] == column[slot] for column in columns)
+        slots = heapq.nlargest(count, (slot for slot in range(len(self.keys)) if rated(slot)), key=busy)
+        return [self.keys[slot] for slot in slots]
+
+
+class NodeRecord(object):
+    """A node seen in the cluster"""
+    __slots__ = ['node_id', 'name', 'role', 'first_seen', 'last_seen']
+
+    def __init__(self, node_id, name, role, tick):
+        self.node_id = node_id
+        self.name = name
+        self.role = role
+        self.first_seen = tick
+        self.last_seen = tick
+
+
+class NodeRegistry(object):
+    """Every node seen in the cluster, indexed by node id, node name and role
+
+    Nodes missing from the latest node stats are kept (so they can be reported as having left the cluster)
+    until they rejoin, which after a restart is usually under a new node id but the same node name.
+    """
+
+    def __init__(self):
+        self.tick = 0
+        self.by_id = {}  # node_id -> NodeRecord
+        self.by_name = {}  # node name -> NodeRecord most recently seen with that name
+        self.by_role = {}  # role -> OrderedDict of node_id -> NodeRecord, in order of joining
+        self.new_nodes = set()  # node ids which joined the cluster on the latest tick
+        self.rejoined = {}  # node id which rejoined on the latest tick -> node id it replaced
+
+    def add(self, node_id, name, role):
+        record = NodeRecord(node_id, name, role, self.tick)
+        self.by_id[node_id] = record
+        self.by_name[name] = record
+        self.by_role.setdefault(role, collections.OrderedDict())[node_id] = record
+        return record
+
+    def remove(self, node_id):
+        record = self.by_id.pop(node_id)
+        if self.by_name.get(record.name) is record:
+            del self.by_name[record.name]
+        del self.by_role[record.role][node_id]
+        if not self.by_role[record.role]:
+            del self.by_role[record.role]
+        return record
+
+    def set_role(self, record, role):
+        if record.role != role:
+            del self.by_role[record.role][record.node_id]
+            if not self.by_role[record.role]:
+                del self.by_role[record.role]
+            record.role = role
+            self.by_role.setdefault(role, collections.OrderedDict())[record.node_id] = record
+
+    def is_present(self, record):
+        return record.last_seen == self.tick
+
+    def update(self, nodes, role_of):
+        """Record a tick's node stats (node_id -> stats), with role_of(node_id) giving each node's current role"""
+        first_run = not self.by_id
+        self.tick += 1
+        self.new_nodes = set()
+        self.rejoined = {}
+        for node_id, node in nodes.items():
+            record = self.by_id.get(node_id)
+            if record is None:
+                previous = self.by_name.get(node['name'])
+                if previous is not None and previous.node_id not in nodes:
+                    # Node left and has re-joined the cluster under a new node_id (such as a node restart)
+                    self.remove(previous.node_id)
+                    self.rejoined[node_id] = previous.node_id
+                record = self.add(node_id, node['name'], role_of(node_id))
+                if not first_run:
+                    self.new_nodes.add(node_id)
+            else:
+                # make sure node's role hasn't changed
+                self.set_role(record, role_of(node_id))
+                record.last_seen = self.tick
+
+
+class DiscoveryCache(object):
+    """What elasticstat last discovered about a cluster, kept on disk so the next start need not wait for it
+
+    One small JSON file per cluster, named by a hash of its hosts (which may carry credentials): the Elasticsearch
+    version, which the thread pool names follow, and the node list in the shape of the cluster state's (nodes ->
+    node id -> name), which --fan-out batches the first update by.  A cache older than ttl seconds is ignored.
+    """
+
+    def __init__(self, directory, hosts, ttl):
+        self.path = os.path.join(directory, hashlib.sha1(hosts).hexdigest()[:16] + '.json')
+        self.ttl = ttl
+
+    def load(self, now):
+        """Return what was cached, or None if nothing was or it has expired"""
+        try:
+            with open(self.path) as cache_file:
+                discovery = json.load(cache_file)
+            if 0 <= now - discovery['saved_at'] < self.ttl:
+                return discovery
+        except (IOError, ValueError, KeyError, TypeError):
+            pass  # missing or unreadable, so discovered afresh
+        return None
+
+    def save(self, now, es_version, nodes):
+        """Save the version and nodes (node id -> name), replacing the file whole so readers never see half of it"""
+        directory = os.path.dirname(self.path)
+        temp_path = "{0}.{1}.tmp".format(self.path, os.getpid())
+        try:
+            if not os.path.isdir(directory):
+                os.makedirs(directory)
+            with open(temp_path, 'w') as cache_file:
+                json.dump({'saved_at': now, 'version': es_version, 'nodes': nodes}, cache_file, separators=(',', ':'))
+            os.rename(temp_path, self.path)
+        except (IOError, OSError):
+            pass  # a cache we cannot write only costs the next start a round trip
+
+
+def gzip_lines(raw, chunk_size=4096):
+    """Yield the lines of the gzip members in raw, from its position on, as they are decompressed
+
+    Unlike reading through GzipFile, every whole line before a member which was cut short is yielded before the
+    zlib.error it ends with is raised.  A last line without a newline (one only partly written) is left out.
+    """
+    decompressor = zlib.decompressobj(16 + zlib.MAX_WBITS)
+    pending = ""
+    while True:
+        data = raw.read(chunk_size)
+        if not data:
+            return
+        while data:
+            saved = decompressor.copy()
+            try:
+                pending += decompressor.decompress(data)
+            except zlib.error as e:
+                # take what decompresses before the bad data, a byte at a time, then give up
+                for byte in data:
+                    try:
+                        pending += saved.decompress(byte)
+                    except zlib.error:
+                        break
+                for line in pending.split("\n")[:-1]:
+                    yield line
+                raise e
+            data = decompressor.unused_data  # the start of the next member
+            if data:
+                decompressor = zlib.decompressobj(16 + zlib.MAX_WBITS)
+        lines = pending.split("\n")
+        pending = lines.pop()
+        for line in lines:
+            yield line
+
+
+class SnapshotRecorder(object):
+    """Appends the responses of each tick to a recording file, from a background thread
+
+    The recording is a series of gzip members of up to chunk_ticks ticks each, one JSON document per line (a
+    concatenation of gzip members is itself a valid gzip file, so zcat works on it).  gzip's window takes care of
+    the field names repeated for every node.  The start time and byte offset of each member is appended to an
+    index file (FILE.idx), so a recording can be read from any point in time without decompressing what comes
+    before it.  Ticks are queued rather than written in line, and dropped (and counted) if the writer falls behind.
+    Both files are opened up front, so a path which can't be written fails straight away; should writing fail
+    later, the error is kept and the remaining ticks are counted as failed.  Appending to a recording whose last
+    member was left unterminated (elasticstat being killed while recording) first closes that member off.
+    """
+
+    def __init__(self, path, chunk_ticks=60, max_queued=60, close_timeout=10):
+        self.path = path
+        self.index_path = path + '.idx'
+        self.chunk_ticks = chunk_ticks
+        self.close_timeout = close_timeout
+        self.raw = open(path, 'ab')
+        try:
+            self.index = open(self.index_path, 'a')
+        except IOError:
+            self.raw.close()
+            raise
+        try:
+            self._close_tail()
+        except (IOError, OSError):
+            self.raw.close()
+            self.index.close()
+            raise
+        self.raw.seek(0, 2)
+        self.member = None  # the gzip member being written
+        self.member_ticks = 0
+        self.queue = Queue.Queue(max_queued)
+        self.dropped = 0  # ticks dropped as the queue was full, counted by record()
+        self.failed = 0  # ticks not written after an error, counted by the writer
+        self.error = None  # the error writing failed with
+        self.writer = threading.Thread(target=self._write)
+        self.writer.daemon = True
+        self.writer.start()
+
+    def _close_tail(self):
+        """Rewrite an unterminated last member as a complete one holding the ticks which can still be read from it,
+        so ticks appended after it can be read back too.  A last member with nothing readable is dropped."""
+        with open(self.index_path) as index:
+            entries = index.readlines()
+        if not entries:
+            return
+        offset = int(entries[-1].split()[1])
+        with open(self.path, 'rb') as raw:
+            raw.seek(offset)
+            try:
+                # GzipFile rather than gzip_lines, as only it tells a member cut short at the end of the file
+                gzip.GzipFile(fileobj=raw, mode='rb').read()
+                return  # the last member is complete
+            except (IOError, EOFError, zlib.error):
+                raw.seek(offset)
+                lines = list(gzip_lines(raw))
+        self.raw.truncate(offset)
+        if lines:
+            member = gzip.GzipFile(fileobj=self.raw, mode='wb')
+            member.write("".join(line + "\n" for line in lines))
+            member.close()
+        else:
+            self.index.truncate(sum(len(entry) for entry in entries[:-1]))
+
+    def record(self, snapshot):
+        try:
+            self.queue.put_nowait(snapshot)
+        except Queue.Full:
+            self.dropped += 1
+
+    def close(self):
+        """Write out everything queued so far and close the recording, waiting at most close_timeout seconds for
+        the writer to catch up"""
+        try:
+            self.queue.put(None, timeout=self.close_timeout)
+        except Queue.Full:
+            pass
+        self.writer.join(self.close_timeout)
+        if self.writer.is_alive():
+            self.dropped += self.queue.qsize()
+
+    def summary(self):
+        """Describe the ticks which were not recorded, or None if all were"""
+        if not self.dropped and not self.failed:
+            return None
+        summary = "elasticstat: {0} updates were not recorded to {1}".format(self.dropped + self.failed, self.path)
+        if self.dropped:
+            summary += ", {0} dropped while writing fell behind".format(self.dropped)
+        if self.failed:
+            summary += ", {0} after writing failed: {1}".format(self.failed, self.error)
+        return summary
+
+    def _write(self):
+        while True:
+            snapshot = self.queue.get()
+            if snapshot is None:
+                break
+            if self.error is None:
+                try:
+                    self._append(snapshot)
+                    continue
+                except (IOError, OSError) as e:
+                    self.error = e
+            self.failed += 1
+        try:
+            if self.member is not None and self.error is None:
+                self.member.close()
+        except (IOError, OSError) as e:
+            self.error = e
+        finally:
+            self.raw.close()
+            self.index.close()
+
+    def _append(self, snapshot):
+        if self.member is None:
+            self.index.write("{0:.3f} {1}\n".format(snapshot['time'], self.raw.tell()))
+            self.index.flush()
+            self.member = gzip.GzipFile(fileobj=self.raw, mode='wb')
+        self.member.write(json.dumps(snapshot, separators=(',', ':')) + "\n")
+        # sync flush, so everything up to the last tick can be read back even if we are killed
+        self.member.flush()
+        self.member_ticks += 1
+        if self.member_ticks >= self.chunk_ticks:
+            self.member.close()
+            self.member = None
+            self.member_ticks = 0
+
+
+class HotThreadsCapture(object):
+    """Captures the hot threads and tasks of nodes to timestamped files, from a background thread
+
+    Each node is captured at most once every min_interval seconds, and only a few captures are queued (the rest
+    are dropped and counted), so a cluster in trouble cannot bury elasticstat in captures and no update waits on
+    one.  A capture writes PREFIX-hot_threads.txt, headed by the rules which fired on each node, and
+    PREFIX-tasks.json, where PREFIX is the cluster name and the time of the update in the capture directory.
+    Captures which fail to be written are counted, keeping the last error.
+    """
+
+    def __init__(self, es_client, directory, min_interval, max_queued=4):
+        self.es_client = es_client
+        self.directory = directory
+        self.min_interval = min_interval
+        self.last_captured = {}  # node id -> time of its last capture
+        self.queue = Queue.Queue(max_queued)
+        self.dropped = 0  # captures dropped as the queue was full, counted by capture()
+        self.failed = 0  # captures which could not be written, counted by the worker
+        self.error = None  # the last error a capture failed with
+        self.worker = threading.Thread(target=self._run)
+        self.worker.daemon = True
+        self.worker.start()
+
+    def capture(self, triggers, cluster, now):
+        """Queue a capture of the nodes in triggers (node id -> rules fired) not captured recently"""
+        node_ids = sorted(node_id for node_id in triggers
+                          if node_id not in self.last_captured or now - self.last_captured[node_id] >= self.min_interval)
+        if not node_ids:
+            return
+        try:
+            self.queue.put_nowait((node_ids, triggers, cluster, now))
+        except Queue.Full:
+            self.dropped += 1
+            return
+        for node_id in node_ids:
+            self.last_captured[node_id] = now
+
+    def _run(self):
+        while True:
+            try:
+                self._write(*self.queue.get())
+            except Exception as e:
+                self.failed += 1
+                self.error = e
+
+    def summary(self):
+        """Describe the captures which were lost, or None if none were"""
+        lost = []
+        if self.failed:
+            lost.append("{0} failed: {1}".format(self.failed, getattr(self.error, 'strerror', None) or self.error))
+        if self.dropped:
+            lost.append("{0} dropped".format(self.dropped))
+        return "captures " + ", ".join(lost) if lost else None
+
+    def _write(self, node_ids, triggers, cluster, now):
+        prefix = os.path.join(self.directory, "{0}-{1}.{2:03d}".format(
+            cluster or 'cluster', time.strftime('%Y%m%d-%H%M%S', time.localtime(now)), int(now * 1000) % 1000))
+        node_list = ",".join(node_ids)
+        try:
+            hot_threads = self.es_client.nodes.hot_threads(node_id=node_list)
+        except Exception as e:
+            hot_threads = "error: {0}\n".format(e)
+        try:
+            tasks = json.dumps(self.es_client.tasks.list(nodes=node_list, detailed=True), indent=2)
+        except Exception as e:
+            tasks = json.dumps({'error': str(e)})
+        with open(prefix + '-hot_threads.txt', 'w') as hot_threads_file:
+            for node_id in node_ids:
+                hot_threads_file.write("# {0}: {1}\n".format(node_id, triggers[node_id]))
+            hot_threads_file.write(hot_threads)
+        with open(prefix + '-tasks.json', 'w') as tasks_file:
+            tasks_file.write(tasks + "\n")
+
+
+class JSONLinesWriter(object):
+    """Writes each tick's cluster and node rows as JSON lines, in a single write per tick"""
+
+    def __init__(self, out):
+        self.out = out
+
+    def write_tick(self, cluster_row, node_rows):
+        lines = [json.dumps(cluster_row, separators=(',', ':'))]
+        lines.extend(json.dumps(row, separators=(',', ':')) for row in node_rows)
+        self.out.write("\n".join(lines) + "\n")
+        self.out.flush()
+
+
+class CSVWriter(object):
+    """Writes each tick's cluster and node rows as CSV with a fixed set of columns, in a single write per tick"""
+
+    def __init__(self, out, fields):
+        self.out = out
+        self.fields = fields
+        self.header = True
+
+    def csv_value(self, value):
+        if value is None:
+            return ''
+        if isinstance(value, bool):
+            return int(value)
+        if isinstance(value, unicode):
+            return value.encode('utf-8')
+        return value
+
+    def write_tick(self, cluster_row, node_rows):
+        buf = StringIO.StringIO()
+        writer = csv.writer(buf)
+        if self.header:
+            writer.writerow(self.fields)
+            self.header = False
+        for row in [cluster_row] + node_rows:
+            writer.writerow([self.csv_value(row.get(field)) for field in self.fields])
+        self.out.write(buf.getvalue())
+        self.out.flush()
+
+
+class FrameWriter(object):
+    """Writes each update's table as a single frame, assembled in one buffer and written with one write"""
+
+    def __init__(self, out):
+        self.out = out
+
+    def write_frame(self, lines):
+        lines.append("\n")  # space out each run for readability
+        self.out.write("\n".join(lines))
+        self.out.flush()
+
+
+class InPlaceFrameWriter(FrameWriter):
+    """Redraws the table in place on the terminal, rewriting only the lines which changed since the last frame"""
+
+    def __init__(self, out):
+        FrameWriter.__init__(self, out)
+        self.last_lines = None
+
+    def write_frame(self, lines):
+        if self.last_lines is None:
+            buf = ["\033[H\033[2J"]  # first frame: clear the screen
+            last_lines = []
+        else:
+            buf = []
+            last_lines = self.last_lines
+        for row, line in enumerate(lines):
+            if row >= len(last_lines) or line != last_lines[row]:
+                # move to the start of the line, write it and clear whatever is left of the old line
+                buf.append("\033[{0};1H{1}\033[K".format(row + 1, line))
+        if len(lines) < len(last_lines):
+            buf.append("\033[{0};1H\033[J".format(len(lines) + 1))  # clear lines no longer used
+        buf.append("\033[{0};1H".format(len(lines) + 1))  # leave the cursor below the table
+        self.out.write("".join(buf))
+        self.out.flush()
+        self.last_lines = lines
+
+
+class MetricsWriter(object):
+    """Renders each tick's rows into a Prometheus text exposition page, kept for MetricsServer to serve
+
+    Each numeric value of the cluster and node rows becomes a gauge, e.g. heap_used_percent of a node becomes
+    elasticstat_node_heap_used_percent{cluster="...",node="...",node_id="...",role="..."}.  The page is rendered
+    once per tick, so scrapes never cause requests to Elasticsearch or any processing.
+    """
+
+    def __init__(self):
+        self.page = "# no data received yet\n"
+
+    def label_value(self, value):
+        if value is None:
+            return ""
+        if isinstance(value, unicode):
+            value = value.encode('utf-8')
+        return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+    def labels(self, labels):
+        return "{" + ",".join('{0}="{1}"'.format(name, self.label_value(value)) for name, value in labels) + "}"
+
+    def add_sample(self, metrics, metric, labels, value):
+        metrics.setdefault(metric, []).append("{0}{1} {2!r}".format(metric, labels, float(value)))
+
+    def add_row(self, metrics, prefix, row, labels, skip):
+        for field, value in row.items():
+            if field not in skip and isinstance(value, (int, long, float)):
+                self.add_sample(metrics, prefix + field, labels, value)
+
+    def write_ticks(self, ticks):
+        """Render the page from the (cluster row, node rows) of each cluster monitored"""
+        metrics = collections.OrderedDict()
+        for cluster_row, node_rows in ticks:
+            self.add_tick(metrics, cluster_row, node_rows)
+        lines = []
+        for metric, samples in metrics.items():
+            lines.append("# TYPE {0} gauge".format(metric))
+            lines.extend(samples)
+        self.page = "\n".join(lines) + "\n"
+
+    def add_tick(self, metrics, cluster_row, node_rows):
+        cluster_labels = self.labels([('cluster', cluster_row['cluster'])])
+        self.add_sample(metrics, 'elasticstat_last_update_timestamp_seconds', cluster_labels, cluster_row['time'])
+        self.add_sample(metrics, 'elasticstat_cluster_stale', cluster_labels, cluster_row['stale'])
+        if cluster_row.get('status') is not None:
+            for status in ['green', 'yellow', 'red']:
+                status_labels = self.labels([('cluster', cluster_row['cluster']), ('status', status)])
+                self.add_sample(metrics, 'elasticstat_cluster_status', status_labels, cluster_row['status'] == status)
+        self.add_row(metrics, 'elasticstat_cluster_', cluster_row, cluster_labels, ['time', 'stale'])
+        for row in node_rows:
+            node_labels = self.labels([('cluster', row['cluster']), ('node', row['name']), ('node_id', row['node_id']),
+                                       ('role', row['role'])])
+            self.add_sample(metrics, 'elasticstat_node_up', node_labels, not row['missing'])
+            self.add_sample(metrics, 'elasticstat_node_stale', node_labels, row['stale'])
+            self.add_row(metrics, 'elasticstat_node_', row, node_labels, ['time', 'stale', 'missing', 'new'])
+
+
+class MetricsHandler(BaseHTTPServer.BaseHTTPRequestHandler):
+    """Serves the page last rendered by the server's MetricsWriter at /metrics"""
+
+    def do_GET(self):
+        if self.path.split('?')[0] != '/metrics':
+            self.send_error(404)
+            return
+        page = self.server.metrics.page
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/plain; version=0.0.4; charset=utf-8')
+        self.send_header('Content-Length', str(len(page)))
+        self.end_headers()
+        self.wfile.write(page)
+
+    def log_message(self, format, *args):
+        # don't log every scrape to stderr
+        pass
+
+
+class MetricsServer(SocketServer.ThreadingMixIn, BaseHTTPServer.HTTPServer):
+    """HTTP server for the metrics page, run in a background thread"""
+    daemon_threads = True
+
+    def __init__(self, address, metrics):
+        BaseHTTPServer.HTTPServer.__init__(self, address, MetricsHandler)
+        self.metrics = metrics
+
+    def start(self):
+        server_thread = threading.Thread(target=self.serve_forever)
+        server_thread.daemon = True
+        server_thread.start()
+
+
+def run_bounded(tasks, parallel):
+    """Run the callables in tasks on at most parallel threads, returning their results in order"""
+    pending = Queue.Queue()
+    for index, task in enumerate(tasks):
+        pending.put((index, task))
+    results = [None] * len(tasks)
+    errors = []
+
+    def worker():
+        while True:
+            try:
+                index, task = pending.get_nowait()
+            except Queue.Empty:
+                return
+            try:
+                results[index] = task()
+            except Exception as e:
+                errors.append(e)
+
+    workers = [threading.Thread(target=worker) for _ in range(min(parallel, len(tasks)))]
+    for thread in workers:
+        thread.daemon = True
+        thread.start()
+    for thread in workers:
+        thread.join()
+    if errors:
+        raise errors[0]
+    return results
+
+
+def describe_error(error):
+    """Describe an error in a line, by its class and message: a client error by its own message, rather than
+    the urllib3 error (and connection object) it wraps"""
+    if isinstance(error, basestring):
+        return error
+    message = str(error)
+    if len(error.args) > 1 and isinstance(error.args[1], basestring):
+        # elasticsearch TransportError(status code, error, info)
+        message = re.sub(r"^<[^>]*>: ", "", error.args[1])
+    return "{0}: {1}".format(type(error).__name__, message)
+
+
+def build_writer(output_format, output, node_fields):
+    """Create the writer for the jsonl and csv output formats (the table is printed directly)"""
+    if output_format == 'table':
+        return None
+    out = sys.stdout if output in [None, '-'] else open(output, 'w')
+    if output_format == 'jsonl':
+        return JSONLinesWriter(out)
+    return CSVWriter(out, csv_fields(node_fields))
+
+
+def csv_fields(node_fields):
+    """List the columns of the csv output format, given the node fields output"""
+    return ROW_FIELDS + CLUSTER_FIELDS + ['period', 'overruns', 'interval'] + node_fields
+
+
+def build_metrics(serve):
+    """Start serving Prometheus metrics if requested, returning the MetricsWriter to render them with"""
+    if serve is None:
+        return None
+    metrics = MetricsWriter()
+    MetricsServer(serve, metrics).start()
+    return metrics
+
+
+def build_frames(in_place):
+    """Create the FrameWriter the table is written with"""
+    if in_place:
+        return InPlaceFrameWriter(sys.stdout)
+    return FrameWriter(sys.stdout)
+
+
+def parse_clusters(hostlists, inventory):
+    """List the (name, hostlist) of each cluster to monitor, from -h [NAME=]HOSTLIST and an inventory file"""
+    entries = list(hostlists or [])
+    if inventory is not None:
+        with open(inventory) as inventory_file:
+            for line in inventory_file:
+                line = line.split('#')[0].strip()
+                if line:
+                    # one cluster per line, as NAME HOSTLIST or NAME=HOSTLIST
+                    entries.append("=".join(line.split(None, 1)) if '=' not in line else line)
+    clusters = []
+    for entry in entries or ['localhost']:
+        name, named, hostlist = entry.partition('=')
+        clusters.append((name, hostlist) if named else (entry, entry))
+    return clusters
+
+
+class ClusterMonitor(object):
+    """Monitors several clusters from one process
+
+    Each cluster gets its own Elasticstat, and so its own client, counters and node registry.  All clusters are
+    polled on the same tick, by at most `parallel` threads at once.  The table shows one summary line per
+    cluster, followed by the node table of each cluster which is not green (and the hot indices of each, with
+    --hot-indices).  A cluster which can't be reached (e.g. because it is down when elasticstat starts) is shown
+    as an error and set up again in the background, so it does not hold up the other clusters.
+    """
+
+    # versions to check the options against up front: thread pools were renamed in Elasticsearch 7
+    LAYOUT_VERSIONS = ['6.8.23', '7.17.0']
+
+    def __init__(self, args, clusters):
+        self.args = args
+        self.no_color = args.no_color
+        self.parallel = args.parallel
+        self.scheduler = TickScheduler(args.delay_interval)
+        self.hostlists = collections.OrderedDict(clusters)
+        self.clusters = collections.OrderedDict((name, None) for name in self.hostlists)  # name -> Elasticstat
+        self.errors = {}  # name -> why the cluster could not be set up
+        self.check_options()
+        self.connector = ESFetcher(args.fetch_timeout or args.delay_interval)  # sets up clusters in the background
+        self.reconnect()
+        node_fields = []
+        for stat in self.clusters.values():
+            if stat is not None:
+                node_fields.extend(field for field in stat.get_node_fields() if field not in node_fields)
+        self.writer = build_writer(args.output_format, args.output, node_fields)
+        self.metrics = build_metrics(args.serve)
+        self.frames = build_frames(args.in_place)
+        self.adaptive = args.adaptive
+
+    def check_options(self):
+        """Check the options once, before any cluster is reached, raising ArgumentTypeError if they can't be shown
+        whichever Elasticsearch version a cluster runs"""
+        for es_version in self.LAYOUT_VERSIONS:
+            try:
+                Elasticstat(self.args, standalone=False, es_version=es_version)
+                return
+            except argparse.ArgumentTypeError as e:
+                error = e
+        raise error
+
+    def connect(self, name):
+        """Set up the named cluster's Elasticstat, returning it"""
+        stat = Elasticstat(self.args, self.hostlists[name], standalone=False, name=name)
+        stat.scheduler = self.scheduler
+        stat.format_headings()
+        return stat
+
+    def reconnect(self, wait=True):
+        """Set up the clusters which are not yet, waiting for them at most the connector's timeout, or not at all
+        (taking up those which have been set up since the last time); those still connecting carry on in the
+        background"""
+        from elasticsearch import TransportError
+        names = [name for name, stat in self.clusters.items() if stat is None]
+        if not names:
+            return
+        requests = [(name, lambda name=name: self.connect(name)) for name in names]
+        for name, result in self.connector.fetch(requests, background=[] if wait else names).items():
+            if not result.stale:
+                self.clusters[name] = result.response
+                self.errors.pop(name, None)
+            elif isinstance(result.error, (TransportError, basestring)):
+                # can't be reached, or has not answered yet (timed out)
+                self.errors[name] = result.error
+            else:
+                raise result.error
+
+    def format_headings(self):
+        for stat in self.clusters.values():
+            if stat is not None:
+                stat.format_headings()
+
+    def close(self):
+        for stat in self.clusters.values():
+            if stat is not None:
+                stat.close()
+
+    def colorize(self, msg, color):
+        return msg if self.no_color is True else color + msg + ESColors.END
+
+    def poll(self, name, now):
+        """Poll the named cluster; returns its tick, or None if it is not set up"""
+        stat = self.clusters[name]
+        if stat is None:
+            return None
+        stat.now, stat.period, stat.overruns = now, self.scheduler.period, self.scheduler.overruns
+        stat.interval = self.scheduler.interval
+        return stat.poll()
+
+    def error_tick(self, name, now):
+        """The tick of a cluster which could not be set up: no results, a cluster row holding the error and no
+        node rows"""
+        cluster_row = {'type': 'cluster', 'time': now, 'stale': True, 'age': None,
+                       'error': describe_error(self.errors[name]), 'cluster': name}
+        return (None, cluster_row, [])
+
+    def print_table(self, ticks):
+        stats = [stat for stat in self.clusters.values() if stat is not None]
+        lines = [stats[0].colorize(stats[0].cluster_headings, ESColors.GRAY)] if stats else []
+        for (name, stat), (results, cluster_row, node_rows) in zip(self.clusters.items(), ticks):
+            if results is None:
+                lines.append(self.colorize("{0:33} (can't connect: {1})".format(name, cluster_row['error']), ESColors.RED))
+                continue
+            cluster_line, color = stat.format_cluster(results['cluster_health'], cluster_row)
+            if 'status' not in cluster_row:
+                cluster_line = "{0:33} {1}".format(name, cluster_line)
+            lines.append(stat.colorize(cluster_line, color))
+        for (name, stat), (results, cluster_row, node_rows) in zip(self.clusters.items(), ticks):
+            shows_nodes = cluster_row.get('status') != 'green'
+            if results is None or not (shows_nodes or stat.hot_indices):
+                continue
+            lines.append("")
+            lines.append(stat.colorize(name, ESColors.WHITE))
+            if shows_nodes:
+                lines.extend(stat.format_nodes(results, node_rows))
+            if stat.hot_indices:
+                lines.extend(stat.format_indices(results['index_stats']))
+        self.frames.write_frame(lines)
+
+    def print_stats(self):
+        # just run forever until ctrl-c
+        while True:
+            self.scheduler.tick()
+            now = time.time()
+            self.reconnect(wait=False)
+            ticks = run_bounded([lambda name=name: self.poll(name, now) for name in self.clusters], self.parallel)
+            ticks = [tick if tick is not None else self.error_tick(name, now) for name, tick in zip(self.clusters, ticks)]
+            if self.metrics is not None:
+                self.metrics.write_ticks([(cluster_row, node_rows) for results, cluster_row, node_rows in ticks])
+            if self.writer is not None:
+                for results, cluster_row, node_rows in ticks:
+                    self.writer.write_tick(cluster_row, node_rows)
+            elif self.metrics is None:
+                self.print_table(ticks)
+            if self.adaptive:
+                # poll at the pace of the most struggling cluster
+                intervals = [stat.adaptive.update(results, cluster_row)
+                             for stat, (results, cluster_row, node_rows) in zip(self.clusters.values(), ticks)
+                             if results is not None]
+                if intervals:
+                    self.scheduler.set_interval(max(intervals))
+            self.scheduler.wait()
+
+
+class SnapshotReader(object):
+    """Reads back the ticks of a recording written by SnapshotRecorder"""
+
+    def __init__(self, path):
+        self.path = path
+        self.index = []  # (time, byte offset) of the start of each gzip member
+        try:
+            with open(path + '.idx') as index:
+                for line in index:
+                    chunk_time, chunk_offset = line.split()
+                    self.index.append((float(chunk_time), int(chunk_offset)))
+        except IOError:
+            # no index, so any replay has to start from the beginning of the recording
+            pass
+
+    def read(self, start=None, end=None):
+        """Yield the recorded ticks from the start time up to the end time (seconds since the epoch), in order
+
+        A recording cut short (elasticstat killed while it was being written) ends at the last tick which can be
+        read; if more was recorded after it, reading picks up at the next member in the index, with a warning.
+        """
+        offset = 0
+        for chunk_time, chunk_offset in self.index:
+            if start is not None and chunk_time <= start:
+                offset = chunk_offset
+        last_time = None  # time of the last tick read
+        warned = False
+        while offset is not None:
+            resume, offset = offset, None
+            with open(self.path, 'rb') as raw:
+                raw.seek(resume)
+                try:
+                    for line in gzip_lines(raw):
+                        snapshot = json.loads(line)  # ValueError if the tick was only partly written
+                        last_time = snapshot['time']
+                        if start is not None and snapshot['time'] < start:
+                            continue
+                        if end is not None and snapshot['time'] >= end:
+                            return
+                        yield snapshot
+                except (IOError, EOFError, zlib.error, ValueError):
+                    offset = self._next_member(resume, last_time)
+                    if offset is not None and not warned:
+                        sys.stderr.write("elasticstat: part of {0} can't be read (a recording cut short?), skipping to "
+                                         "what was recorded after it\n".format(self.path))
+                        warned = True
+
+    def _next_member(self, offset, last_time):
+        """Offset of the first member in the index after offset with ticks after last_time, or None"""
+        for chunk_time, chunk_offset in self.index:
+            if chunk_offset > offset and (last_time is None or chunk_time > last_time):
+                return chunk_offset
+        return None
+
+
 class Elasticstat:
     """Elasticstat"""
 
     STATUS_COLOR = {'red': ESColors.RED, 'green': ESColors.GREEN, 'yellow': ESColors.YELLOW}
 
-    def __init__(self, args):
+    def __init__(self, args, hostlist=None, standalone=True, es_client=None, name=None, es_version=None):
         self.sleep_interval = args.delay_interval
-        self.node_counters = {}
-        self.node_counters['gc'] = {}
-        self.node_counters['fd'] = {}
-        self.node_counters['hconn'] = {}
-        self.nodes_list = []  # used for detecting new nodes
-        self.nodes_by_role = {}  # main list of nodes, organized by role
-        self.node_names = {}  # node names, organized by id
-        self.new_nodes = []  # used to track new nodes that join the cluster
+        self.node_counters = CounterRates()
+        self.nodes = NodeRegistry()
         self.active_master = ""
+        self.last_node_rows = []  # node rows from the last tick with fresh node stats, for reuse when stale
+        self.fan_out = NodeFanOut(args.fan_out) if args.fan_out else None
+        self.stale_nodes = {}  # with --fan-out, node id -> time its stats were received, for nodes shown stale
+        self.hot_indices = args.hot_indices
+        if self.hot_indices:
+            self.index_counters = CounterArrays(['index_total', 'query_total', 'merges_current'])
+            self.shard_counters = CounterArrays(['index_total', 'query_total'])
+            self.shard_placement = {}  # (index, shard, node id) -> whether that copy is the primary
+            self.placement_key = None  # (hot indices, cluster state version) shard_placement was fetched for
+            self.hot_index_names = []  # hot indices of the last update, whose shard stats are fetched
+            self.index_rows = []
+        self.cluster_name = None
+        self.name = name  # given with -h NAME=HOSTLIST or in the inventory, to identify the cluster by over cluster_name
+        self.fetcher = ESFetcher(args.fetch_timeout or self.sleep_interval)
+        self.scheduler = TickScheduler(self.sleep_interval)
+        self.recorder = self._parse_record(args.record) if args.record else None
+        self.self_stats = None
+        self.serializer = None
+        self.decodes_node_stats = False  # whether our own client decodes node stats, so can decode them straight into records
+        if args.self_stats is not None:
+            self.self_stats = SelfStats(args.self_stats or None)
+            self.serializer = MeasuringJSONSerializer()
         self.no_color = args.no_color
         self.categories = self._parse_categories(args.categories)
-        self.cluster_categories = CLUSTER_CATEGORIES
+        self.cluster_categories = list(CLUSTER_CATEGORIES)
         if args.no_pending_tasks:
             # Elasticsearch pre v.1.5 does not include number of pending tasks in cluster health
             self.cluster_categories.remove('tasks')
+        self.adaptive = None
+        if args.adaptive:
+            self.adaptive = AdaptiveInterval(self.sleep_interval, args.min_interval or self.sleep_interval,
+                                             args.max_interval or 8 * self.sleep_interval)
+            self.cluster_categories.append('adaptive')
+
+        self.now = None  # time of the tick being displayed
+        self.period = None  # real time since the previous tick
+        self.interval = self.sleep_interval  # interval being polled at, which --adaptive changes
+        self.overruns = 0
+        self.replay_speed = args.replay_speed
+        self.replay_last = {}  # last recorded response of each request, for stale sections in the recording
+        self.discovery = None
+        self.discovered_at = None  # when the version was last had from the cluster, rather than the cache
+        self.discovery_unsaved = False  # whether to save the cache once the nodes are known
+        self.recorded_threadpools = None  # thread pools a recording being replayed holds
+        if args.replay:
+            # Replaying a recording, so no client; the Elasticsearch version comes from the recording itself
+            self.es_client = None
+            self.replay_snapshots = self._parse_replay(args.replay, args.replay_from, args.replay_to)
+            first_snapshot = next(self.replay_snapshots, None)
+            if first_snapshot is None:
+                raise argparse.ArgumentTypeError("{0} has no recorded updates in the requested time range".format(args.replay))
+            self.replay_snapshots = itertools.chain([first_snapshot], self.replay_snapshots)
+            self.es_version = first_snapshot['version']
+            if 'categories' in first_snapshot:
+                # recorded since the categories were recorded along with the responses
+                self.categories = self._limit_to_recording(args.replay, 'categories', self.categories,
+                                                           first_snapshot['categories'], args.categories not in ('all', ['all']))
+                self.recorded_threadpools = first_snapshot['threadpools']
+        elif es_version is not None:
+            # laid out for a version without connecting, to check the options (see ClusterMonitor.check_options)
+            self.es_client = None
+            self.es_version = es_version
+        else:
+            # Create Elasticsearch client, unless given one to use
+            if es_client is None:
+                es_client = self._build_client(hostlist or args.hostlist, args)
+                if args.discovery_ttl > 0:
+                    self.discovery = DiscoveryCache(args.discovery_cache, "{0} {1}".format(hostlist or args.hostlist, args.port),
+                                                    args.discovery_ttl)
+            self.es_client = es_client
+            discovered = self.discovery.load(time.time()) if self.discovery is not None else None
+            if discovered is not None:
+                # start straight away from what was cached, which the first update checks the version of
+                self.es_version = discovered['version']
+                if self.fan_out is not None:
+                    self.fan_out.update_node_ids(discovered)
+            else:
+                # moving threadpool after client creation to use version discovery
+                self.es_version = self.es_client.info()['version']['number']
+                self.discovered_at = time.time()
+                self.discovery_unsaved = self.discovery is not None
+                if self.fan_out is not None:
+                    # the first update's batches need the node list up front
+                    self.fan_out.update_node_ids(self.fetch_node_list())
+        self.args = args
+        self._build_layout(args)
+        self.capture = None
+        if self.capture_rules and self.es_client is not None:
+            # nothing to capture from when replaying, but rows are still flagged
+            self.capture = HotThreadsCapture(self.es_client, args.capture_dir, args.capture_every)
+        self.writer = None
+        self.metrics = None
+        if standalone:
+            # when monitoring several clusters, ClusterMonitor does the output for all of them
+            self.writer = build_writer(args.output_format, args.output, self.get_node_fields())
+            self.metrics = build_metrics(args.serve)
+        self.frames = build_frames(args.in_place) if standalone else None
 
-        # Create Elasticsearch client
-        self.es_client = Elasticsearch(self._parse_connection_properties(args.hostlist, args.port, args.username,
-                                                                         args.password, args.use_ssl))
-        # moving threadpool after client creation to use version discovery
+    def _build_client(self, hostlist, args):
+        from elasticsearch import Elasticsearch
+        if self.serializer is None:
+            self.serializer = NodeStatsSerializer()
+        self.decodes_node_stats = True
+        return Elasticsearch(self._parse_connection_properties(hostlist, args.port, args.username, args.password,
+                                                               args.use_ssl),
+                             serializer=self.serializer)
+
+    def _build_layout(self, args):
+        """Set up everything which follows from the thread pools, and so from the Elasticsearch version"""
         self.threadpools = self._parse_threadpools(args.threadpools)
+        if self.recorded_threadpools is not None:
+            self.threadpools = self._limit_to_recording(args.replay, 'threadpools', self.threadpools,
+                                                        self.recorded_threadpools, args.threadpools is not DEFAULT_THREAD_POOLS)
+        self.windows = self._build_windows(args.window, args.window_stats) if args.window else None
+        self.rollups = None
+        if args.rollup:
+            import_numpy()
+            self.rollups = RoleRollups(self._select_metrics(ROLLUP_METRICS, '--rollup'))
+            self.rollup_format, self.rollup_headings = self._compile_rollup_row()
+        self.counter_fields = self._build_counter_fields()
+        fields = self._build_nodes_stats_fields()
+        self.nodes_stats_params = self._build_nodes_stats_params(fields)
+        self.node_decoder = NodeStatsDecoder(fields)
+        self.streams_node_stats = self._streams_node_stats()
+        self.thread_fields = [(pool + '_' + stat, 'thread_pool.{0}.{1}'.format(pool, stat))
+                              for pool in self.threadpools for stat in ['active', 'queue', 'rejected']]
+        self.node_row_format, self.node_row_cells = self._compile_node_row()
+        self.node_getters = [getattr(self, 'get_node_' + category) for category in self.categories]
+        if self.self_stats is not None:
+            # time each category's methods (only when asked to, as it costs a little on every node)
+            row_categories = self.categories + (['window'] if self.windows is not None else [])
+            self.node_getters = [self.self_stats.timed('get_node_' + category + '_ms', getter)
+                                 for category, getter in zip(self.categories, self.node_getters)]
+            self.node_row_cells = [self.self_stats.timed('process_node_' + category + '_ms', process_cells)
+                                   for category, process_cells in zip(row_categories, self.node_row_cells)]
+        self.sort_fields = self._parse_sort(args.sort or ('heap' if args.top is not None else None))
+        self.top = args.top
+        self.node_filter = self._parse_node_filter(args.node_filter)
+        self.capture_rules = self._parse_capture_rules(args.capture_rules)
 
     def _parse_connection_properties(self, host, port, username, password, use_ssl):
+        from urllib3.util import parse_url
         hosts_list = []
 
         if isinstance(host, str):
@@ -151,6 +2178,49 @@ class Elasticstat:
             hosts_list.append(host_properties)
         return hosts_list
 
+    def _parse_record(self, path):
+        """Open a recording to append to, failing straight away if it can't be written"""
+        try:
+            return SnapshotRecorder(path)
+        except IOError as e:
+            raise argparse.ArgumentTypeError("can't record to {0}: {1}".format(path, e.strerror))
+
+    def _parse_replay(self, path, from_time, to_time):
+        """Open a recording, resolving --from/--to times of day against the day the recording started"""
+        reader = SnapshotReader(path)
+        start = end = None
+        if from_time is not None or to_time is not None:
+            if reader.index:
+                started_at = reader.index[0][0]
+            else:
+                # no index, so go by the first update recorded
+                first_snapshot = next(reader.read(), None)
+                if first_snapshot is None:
+                    return iter([])
+                started_at = first_snapshot['time']
+            recording_start = datetime.datetime.fromtimestamp(started_at)
+            if from_time is not None:
+                start = datetime.datetime.combine(recording_start.date(), from_time.time)
+                if start < recording_start.replace(second=0, microsecond=0):
+                    start += datetime.timedelta(days=1)  # recording runs past midnight
+            if to_time is not None:
+                end = datetime.datetime.combine((start or recording_start).date(), to_time.time)
+                if end < (start or recording_start):
+                    end += datetime.timedelta(days=1)
+            start = time.mktime(start.timetuple()) if start is not None else None
+            # include the whole of the last minute, or second, given
+            end = time.mktime(end.timetuple()) + to_time.span if end is not None else None
+        return reader.read(start, end)
+
+    def _limit_to_recording(self, path, what, selected, recorded, named):
+        """Limit the categories or thread pools shown when replaying to those the recording holds, refusing any
+        named on the command line which it does not"""
+        missing = [item for item in selected if item not in recorded]
+        if missing and named:
+            msg = "{0} only holds the {1} {2}, not {3}".format(path, ', '.join(recorded), what, ', '.join(missing))
+            raise argparse.ArgumentTypeError(msg)
+        return [item for item in selected if item in recorded]
+
     def _parse_categories(self, categories):
         if isinstance(categories, list):
             if categories[0] == 'all':
@@ -166,18 +2236,165 @@ class Elasticstat:
                 raise argparse.ArgumentTypeError(msg)
         return ['general'] + categories
 
+    def _streams_node_stats(self):
+        """Whether to decode node stats straight into records as they are read, rather than decoding them whole and
+        projecting the records out of them.  Only quicker where the server ignores filter_path (before Elasticsearch
+        1.6), leaving every node's full stats in the response."""
+        return self.decodes_node_stats and version.parse(json.dumps(self.es_version).strip('"')) < version.parse("1.6.0")
+
     def _parse_threadpools(self, threadpools):
         # adding version discovery for ES7 to get correct threadpool
-        if version.parse(json.dumps(self.es_client.info()['version']['number']).strip('"')) > version.parse("7.0.0"):
+        if version.parse(json.dumps(self.es_version).strip('"')) > version.parse("7.0.0"):
             threadpools = filter(None, [re.sub(r".*index*", r"", i) for i in threadpools])
             threadpools = filter(None, [re.sub(r".*bulk*", r"", i) for i in threadpools])
         else:
             threadpools = filter(None, [re.sub(r".*write*", r"", i) for i in threadpools])
         # end vesion discovery
-        if isinstance(threadpools, list) and ',' in threadpools[0]:
+        if isinstance(threadpools, list) and threadpools and ',' in threadpools[0]:
             threadpools = threadpools[0].split(',')
         return threadpools
 
+    def _build_windows(self, size, stats):
+        """Set up --window over the metrics the selected categories provide"""
+        return RollingWindows(size, self._select_metrics(WINDOW_METRICS, '--window'), stats)
+
+    def _compile_rollup_row(self):
+        """Build the --rollup row template and its headings for the metrics being rolled up"""
+        headings = {'role': "roles", 'nodes': "nodes"}
+        cell_formats = []
+        for metric, fields in self.rollups.metrics:
+            headings['rollup_' + metric] = "{0} {1}".format(metric, ROLLUP_HEADINGS[ROLLUP_METRICS[metric][2]])
+            cell_formats.append("{{rollup_{0}:>{1}}}".format(metric, max(16, len(headings['rollup_' + metric]))))
+        rollup_format = ROLLUP_TEMPLATE + "   " + "  ".join(cell_formats)
+        return (rollup_format, rollup_format.format(**headings))
+
+    def _select_metrics(self, metrics, option):
+        """List the (metric, [node values]) of metrics (metric -> (category, fields, ...)) which the selected
+        categories provide, with {pool} fields given for each threadpool"""
+        selected = []
+        for metric, settings in metrics.items():
+            category, fields = settings[:2]
+            if category in self.categories:
+                selected.append((metric, [field.format(pool=pool) for field in fields
+                                          for pool in (self.threadpools if '{pool}' in field else [None])]))
+        if not selected:
+            categories = sorted(set(settings[0] for settings in metrics.values()))
+            msg = "{0} needs one of the {1} categories".format(option, ', '.join(categories))
+            raise argparse.ArgumentTypeError(msg)
+        return selected
+
+    def _build_counter_fields(self):
+        """List the (counter, node stats field) pairs to sample for the selected categories"""
+        counter_fields = []
+        for category in self.categories:
+            for counter, field in sorted(NODE_COUNTERS[category].items()):
+                if '{pool}' in counter:
+                    for pool in self.threadpools:
+                        counter_fields.append((counter.format(pool=pool), field.format(pool=pool)))
+                else:
+                    counter_fields.append((counter, field))
+        return counter_fields
+
+    def _build_nodes_stats_fields(self):
+        """List the node stats fields (relative to each node) used by the selected categories and counters"""
+        fields = []
+        for category in self.categories:
+            for field in NODES_STATS_FIELDS[category]:
+                if '{pool}' in field:
+                    fields.extend(field.format(pool=pool) for pool in self.threadpools)
+                else:
+                    fields.append(field)
+        for counter, field in self.counter_fields:
+            fields.append(field)
+        return [field for i, field in enumerate(fields) if field not in fields[:i]]  # a category may be listed twice
+
+    def _build_nodes_stats_params(self, fields):
+        """Build the smallest node stats request (metrics, filter_path) covering the selected categories"""
+        metrics = []
+        index_metrics = []
+        for category in self.categories:
+            metrics.extend(m for m in NODES_STATS_METRICS[category] if m not in metrics)
+            index_metrics.extend(m for m in NODES_STATS_INDEX_METRICS.get(category, []) if m not in index_metrics)
+        params = {}
+        params['filter_path'] = ",".join("nodes.*." + field for field in fields)
+        if metrics:
+            params['metric'] = ",".join(metrics)
+        if index_metrics:
+            params['index_metric'] = ",".join(index_metrics)
+        return params
+
+    def _parse_sort(self, sort):
+        """Resolve --sort KEY[:THREADPOOL] into the node values ranked on"""
+        if sort is None:
+            return None
+        key, _, pool = sort.partition(':')
+        if key not in SORT_KEYS:
+            msg = "{0} is not valid, please choose a sort from {1}".format(key, ', '.join(SORT_KEYS))
+            raise argparse.ArgumentTypeError(msg)
+        sort_fields = []
+        for field in SORT_KEYS[key]:
+            if '{pool}' in field:
+                sort_fields.extend(field.format(pool=sort_pool) for sort_pool in ([pool] if pool else self.threadpools))
+            else:
+                sort_fields.append(field)
+        node_fields = self.get_node_fields()
+        if not sort_fields or any(field not in node_fields for field in sort_fields):
+            msg = "sorting by {0} needs {1}, which the selected categories and threadpools do not show".format(
+                sort, ', '.join(sort_fields) or 'a threadpool')
+            raise argparse.ArgumentTypeError(msg)
+        return sort_fields
+
+    def _parse_node_filter(self, terms):
+        if terms is None:
+            return None
+        node_fields = ROW_FIELDS + self.get_node_fields()
+        for field, pattern, is_glob in terms:
+            if field not in node_fields:
+                msg = "{0} is not valid, please filter on one of {1}".format(field, ', '.join(node_fields))
+                raise argparse.ArgumentTypeError(msg)
+        return terms
+
+    def _parse_capture_rules(self, rules):
+        if not rules:
+            return []
+        fields = self.get_node_fields() + CLUSTER_FIELDS
+        for rule, field, compare, threshold in rules:
+            if field not in fields:
+                msg = "{0} is not valid, please capture on one of {1}".format(field, ', '.join(fields))
+                raise argparse.ArgumentTypeError(msg)
+        return rules
+
+    def _compile_node_row(self):
+        """Resolve the selected categories once into a single node row template and the methods filling its cells"""
+        templates = []
+        for category in self.categories:
+            if category == 'threads':
+                templates.append(" ".join(NODES_TEMPLATE['threads'].replace('{threads', '{threads_' + pool)
+                                          for pool in self.threadpools))
+            else:
+                templates.append(NODES_TEMPLATE[category])
+        row_cells = [getattr(self, 'process_node_' + category) for category in self.categories]
+        if self.windows is not None:
+            # a cell per metric, wide enough for its heading or each statistic to one decimal place (100.0)
+            templates.append(" ".join("{{window_{0}:>{1}}}".format(
+                metric, max(len(self.windows.heading(metric)), 6 * len(self.windows.stats) - 1))
+                for metric, fields in self.windows.metrics))
+            row_cells.append(self.process_node_window)
+        return ("   ".join(templates), row_cells)
+
+    def get_node_fields(self):
+        """List the typed node values output for the selected categories and threadpools"""
+        node_fields = []
+        for category in self.categories:
+            for field in NODE_FIELDS[category]:
+                if '{pool}' in field:
+                    node_fields.extend(field.format(pool=pool) for pool in self.threadpools)
+                else:
+                    node_fields.append(field)
+        if self.windows is not None:
+            node_fields.extend(self.windows.get_fields())
+        return node_fields
+
     def colorize(self, msg, color):
         if self.no_color is True:
             return(msg)
@@ -185,7 +2402,7 @@ class Elasticstat:
             return(color + msg + ESColors.END)
 
     def thetime(self):
-        return datetime.datetime.now().strftime("%H:%M:%S")
+        return datetime.datetime.fromtimestamp(self.now).strftime("%H:%M:%S")
 
     def size_human(self, size):
         for unit in ['B', 'KB', 'MB', 'GB', 'TB', 'PB', 'EB', 'ZB']:
@@ -194,19 +2411,41 @@ class Elasticstat:
             size /= 1024.0
         return "{:6.2f} {}".format(size, 'YB')
 
-    def get_disk_usage(self, node_fs_stats):
-        # Calculate used disk space
-        if node_fs_stats["total"] == {}:
+    def one_decimal(self, value, unit):
+        # Elasticsearch's human readable format: truncated to one decimal place, with a trailing .0 dropped
+        value = int(value * 10) / 10.0
+        if value == int(value):
+            return "{0}{1}".format(int(value), unit)
+        return "{0:.1f}{1}".format(value, unit)
+
+    def es_size_human(self, size):
+        """Format a byte count as Elasticsearch does with human=true, e.g. 1.2gb"""
+        for unit in ['pb', 'tb', 'gb', 'mb', 'kb']:
+            scale = 1024 ** (['kb', 'mb', 'gb', 'tb', 'pb'].index(unit) + 1)
+            if size >= scale:
+                return self.one_decimal(float(size) / scale, unit)
+        return "{0}b".format(size)
+
+    def es_time_human(self, millis):
+        """Format a duration in milliseconds as Elasticsearch does with human=true, e.g. 1.1m"""
+        if millis == 0:
+            return "0s"
+        for unit, scale in [('d', 86400000), ('h', 3600000), ('m', 60000), ('s', 1000)]:
+            if millis >= scale:
+                return self.one_decimal(float(millis) / scale, unit)
+        return "{0}ms".format(millis)
+
+    def get_disk_usage(self, node):
+        # Calculate used disk space, returns (used bytes, total bytes, used percent)
+        if "fs.total.total_in_bytes" not in node or "fs.total.available_in_bytes" not in node:
             # Not a data node
-            return "-"
+            return (None, None, None)
 
-        total_in_bytes = node_fs_stats["total"]["total_in_bytes"]
-        used_in_bytes = total_in_bytes - node_fs_stats["total"]["available_in_bytes"]
+        total_in_bytes = node["fs.total.total_in_bytes"]
+        used_in_bytes = total_in_bytes - node["fs.total.available_in_bytes"]
 
         used_percent = int((float(used_in_bytes) / float(total_in_bytes)) * 100)
-        used_human = self.size_human(used_in_bytes)
-
-        return "{}|{}%".format(used_human, used_percent)
+        return (used_in_bytes, total_in_bytes, used_percent)
 
     def get_role(self, node_id, node_stats):
         try:
@@ -224,7 +2463,7 @@ class Elasticstat:
             # Section to handle ES < 2.x
             ismaster = 'true'
             isdata = 'true'
-            role = node_stats['nodes'][node_id]['attributes']
+            role = node_stats['nodes'][node_id].get('attributes', {})
             if 'data' in role:
                 isdata = role['data']
             if 'master' in role:
@@ -251,192 +2490,248 @@ class Elasticstat:
             else:
                 return "UNK"
 
-    def get_gc_stats(self, node_id, node_gc_stats):
-        # check if this is a new node
-        if node_id not in self.node_counters['gc']:
-            # new so init counters and return no data
-            self.node_counters['gc'][node_id] = {'old': 0, 'young': 0}
-            self.node_counters['gc'][node_id]['old'] = node_gc_stats['old']['collection_count']
-            self.node_counters['gc'][node_id]['young'] = node_gc_stats['young']['collection_count']
-            return("-|-", "-|-")
-        else:
-            # existing node, so calculate the new deltas, update counters, and return results
-            old_gc_count = node_gc_stats['old']['collection_count']
-            young_gc_count = node_gc_stats['young']['collection_count']
-            old_gc_delta = old_gc_count - self.node_counters['gc'][node_id]['old']
-            young_gc_delta = young_gc_count - self.node_counters['gc'][node_id]['young']
-            self.node_counters['gc'][node_id]['old'] = old_gc_count
-            self.node_counters['gc'][node_id]['young'] = young_gc_count
-            old_gc_results = "{0}|{0}ms".format(old_gc_delta, node_gc_stats['old']['collection_time_in_millis'])
-            young_gc_results = "{0}|{0}ms".format(young_gc_delta, node_gc_stats['young']['collection_time_in_millis'])
-            return(old_gc_results, young_gc_results)
-
-    def get_fd_stats(self, node_id, current_evictions, current_tripped):
-        # check if this is a new node
-        if node_id not in self.node_counters['fd']:
-            # new so init counters and return no data
-            self.node_counters['fd'][node_id] = {'fde': 0, 'fdt': 0}
-            self.node_counters['fd'][node_id]['fde'] = current_evictions
-            self.node_counters['fd'][node_id]['fdt'] = current_tripped
-            return("-|-")
-        else:
-            # existing node, so calc new deltas, update counters, and return results
-            fde_delta = current_evictions - self.node_counters['fd'][node_id]['fde']
-            self.node_counters['fd'][node_id]['fde'] = current_evictions
-            fdt_delta = current_tripped - self.node_counters['fd'][node_id]['fdt']
-            self.node_counters['fd'][node_id]['fdt'] = current_tripped
-            return("{0}|{1}".format(fde_delta, fdt_delta))
-
-    def get_http_conns(self, node_id, http_conns):
-        # check if this is a new node
-        if node_id not in self.node_counters['hconn']:
-            self.node_counters['hconn'][node_id] = http_conns['total_opened']
-            return ("{0}|-".format(http_conns['current_open']))
-        else:
-            open_delta = http_conns['total_opened'] - self.node_counters['hconn'][node_id]
-            self.node_counters['hconn'][node_id] = http_conns['total_opened']
-            return("{0}|{1}".format(http_conns['current_open'], open_delta))
+    def get_node_counters(self, node):
+        counters = {}
+        for counter, field in self.counter_fields:
+            if field in node:
+                counters[counter] = node[field]
+        return counters
 
-    def process_node_general(self, role, node_id, node):
-        if node_id in self.new_nodes:
-            # Flag that this is a node that joined the cluster this round
-            node_name = node['name'] + "+"
-        else:
-            node_name = node['name']
-        if self.active_master == node_id:
-            # Flag active master in role column
-            node_role = role + "*"
-        else:
-            node_role = role
-        return(NODES_TEMPLATE['general'].format(name=node_name, role=node_role))
+    def get_delta(self, rates, counter):
+        rate = rates.get(counter)
+        return None if rate is None else rate.delta
 
-    def process_node_os(self, role, node_id, node):
-        if 'cpu' in node['os'] and 'load_average' in node['os']['cpu']:
+    def get_rate(self, rates, counter):
+        rate = rates.get(counter)
+        return None if rate is None else rate.per_second
+
+    def format_value(self, value, value_format="{0}"):
+        if value is None:
+            return "-"
+        return value_format.format(value)
+
+    def get_node_general(self, role, node_id, node, rates):
+        return {'name': node['name'], 'role': role, 'master': self.active_master == node_id,
+                'new': node_id in self.nodes.new_nodes}
+
+    def get_node_os(self, role, node_id, node, rates):
+        load_avgs = [None, None, None]
+        if 'os.cpu.load_average' in node:
             # Elasticsearch 5.x+ move load average to cpu key
-            node_load_avgs = []
-            for load_avg in node['os']['cpu']['load_average'].values():
-                node_load_avgs.append(load_avg)
-            node_load_avg = "/".join("{0:.2f}".format(x) for x in node_load_avgs)
+            cpu_load_avgs = node['os.cpu.load_average']
+            load_avgs = [cpu_load_avgs.get('1m'), cpu_load_avgs.get('5m'), cpu_load_avgs.get('15m')]
         else:
             # Pre Elasticsearch 5.x
-            node_load_avg = node['os'].get('load_average')
+            node_load_avg = node.get('os.load_average')
             if isinstance(node_load_avg, list):
-                node_load_avg = "/".join(str(x) for x in node_load_avg)
+                load_avgs = (node_load_avg + load_avgs)[:3]
             elif isinstance(node_load_avg, float):
                 # Elasticsearch 2.0-2.3 only return 1 load average, not the standard 5/10/15 min avgs
-                node_load_avg = "{0:.2f}".format(node_load_avg)
-            else:
-                node_load_avg = 'N/A'
+                load_avgs[0] = node_load_avg
+        node_used_mem = node.get('os.mem.used_percent')
+        return {'load_1m': load_avgs[0], 'load_5m': load_avgs[1], 'load_15m': load_avgs[2],
+                'mem_used_percent': node_used_mem}
+
+    def get_node_jvm(self, role, node_id, node, rates):
+        node_jvm = {}
+        node_jvm['heap_used_percent'] = node.get('jvm.mem.heap_used_percent')
+        node_jvm['old_pool_used_bytes'] = node.get('jvm.mem.pools.old.used_in_bytes')
+        for generation in ['old', 'young']:
+            # deltas are None for a new node, until its next sample
+            node_jvm[generation + '_gc_count'] = self.get_delta(rates, generation + '_gc_count')
+            node_jvm[generation + '_gc_time_ms'] = self.get_delta(rates, generation + '_gc_time')
+            node_jvm[generation + '_gc_rate'] = self.get_rate(rates, generation + '_gc_count')
+        return node_jvm
+
+    def get_node_threads(self, role, node_id, node, rates):
+        node_threads = {}
+        for name, field in self.thread_fields:
+            node_threads[name] = node.get(field)
+        for pool in self.threadpools:
+            node_threads[pool + '_rejected_delta'] = self.get_delta(rates, pool + '_rejected')
+            node_threads[pool + '_completed_rate'] = self.get_rate(rates, pool + '_completed')
+        return node_threads
+
+    def get_node_throughput(self, role, node_id, node, rates):
+        node_throughput = {}
+        for counter in ['index', 'search', 'get', 'merge', 'refresh', 'flush']:
+            node_throughput[counter + '_rate'] = self.get_rate(rates, counter + '_total')
+        return node_throughput
+
+    def get_node_fielddata(self, role, node_id, node, rates):
+        return {'fielddata_evictions': self.get_delta(rates, 'fd_evictions'),
+                'fielddata_tripped': self.get_delta(rates, 'fd_tripped')}
+
+    def get_node_connections(self, role, node_id, node, rates):
+        node_conns = {}
+        node_conns['http_current_open'] = node.get('http.current_open', 0)
+        node_conns['http_opened'] = self.get_delta(rates, 'http_opened')
+        node_conns['transport_server_open'] = node.get('transport.server_open')
+        node_conns['transport_rx_rate'] = self.get_rate(rates, 'transport_rx')
+        node_conns['transport_tx_rate'] = self.get_rate(rates, 'transport_tx')
+        return node_conns
 
-        if 'mem' in node['os']:
-            node_used_mem = "{0}%".format(node['os']['mem']['used_percent'])
+    def get_node_data_nodes(self, role, node_id, node, rates):
+        node_dn = dict.fromkeys(NODE_FIELDS['data_nodes'])
+        # Data node specific metrics
+        if role in ['DATA', 'ALL']:
+            node_dn['merge_time_ms'] = node.get('indices.merges.total_time_in_millis')
+            node_dn['store_size_bytes'] = node.get('indices.store.size_in_bytes')
+            node_dn['docs_count'] = node.get('indices.docs.count')
+            node_dn['docs_deleted'] = node.get('indices.docs.deleted')
+            node_dn['disk_used_bytes'], node_dn['disk_total_bytes'], node_dn['disk_used_percent'] = \
+                self.get_disk_usage(node)
+        return node_dn
+
+    def process_node_general(self, values):
+        node_name = values['name']
+        if values['new']:
+            # Flag that this is a node that joined the cluster this round
+            node_name += "+"
+        node_role = values['role']
+        if values['master']:
+            # Flag active master in role column
+            node_role += "*"
+        return {'name': node_name, 'role': node_role}
+
+    def process_node_os(self, values):
+        node_load_avgs = [values[load] for load in ['load_1m', 'load_5m', 'load_15m'] if values[load] is not None]
+        if node_load_avgs:
+            node_load_avg = "/".join("{0:.2f}".format(x) for x in node_load_avgs)
+        else:
+            node_load_avg = 'N/A'
+        if values['mem_used_percent'] is not None:
+            node_used_mem = "{0}%".format(values['mem_used_percent'])
         else:
             node_used_mem = "N/A"
-        return(NODES_TEMPLATE['os'].format(load_avg=node_load_avg, used_mem=node_used_mem))
+        return {'load_avg': node_load_avg, 'used_mem': node_used_mem}
 
-    def process_node_jvm(self, role, node_id, node):
+    def process_node_jvm(self, values):
         processed_node_jvm = {}
-        processed_node_jvm['used_heap'] = "{0}%".format(node['jvm']['mem']['heap_used_percent'])
-        processed_node_jvm['old_gc_sz'] = node['jvm']['mem']['pools']['old']['used']
-        node_gc_stats = node['jvm']['gc']['collectors']
-        processed_node_jvm['old_gc'], processed_node_jvm['young_gc'] = self.get_gc_stats(node_id, node_gc_stats)
-        return(NODES_TEMPLATE['jvm'].format(**processed_node_jvm))
-
-    def process_node_threads(self, role, node_id, node):
-        thread_segments = []
+        processed_node_jvm['used_heap'] = self.format_value(values['heap_used_percent'], "{0}%")
+        if values['old_pool_used_bytes'] is not None:
+            processed_node_jvm['old_gc_sz'] = self.es_size_human(values['old_pool_used_bytes'])
+        else:
+            processed_node_jvm['old_gc_sz'] = "-"
+        for generation in ['old', 'young']:
+            if values[generation + '_gc_count'] is None or values[generation + '_gc_time_ms'] is None:
+                processed_node_jvm[generation + '_gc'] = "-|-"
+            else:
+                processed_node_jvm[generation + '_gc'] = "{0}|{1}ms".format(values[generation + '_gc_count'],
+                                                                            values[generation + '_gc_time_ms'])
+        return processed_node_jvm
+
+    def process_node_threads(self, values):
+        processed_node_threads = {}
         for pool in self.threadpools:
-            if pool in node['thread_pool']:
-                threads = "{0}|{1}|{2}".format(node['thread_pool'][pool]['active'],
-                                               node['thread_pool'][pool]['queue'],
-                                               node['thread_pool'][pool]['rejected'])
-                thread_segments.append(NODES_TEMPLATE['threads'].format(threads=threads))
+            if values[pool + '_active'] is not None:
+                threads = "{0}|{1}|{2}".format(values[pool + '_active'], values[pool + '_queue'], values[pool + '_rejected'])
             else:
-                thread_segments.append(NODES_TEMPLATE['threads'].format(threads='-|-|-'))
-        return(" ".join(thread_segments))
+                threads = '-|-|-'
+            processed_node_threads['threads_' + pool] = threads
+        return processed_node_threads
 
-    def process_node_fielddata(self, role, node_id, node):
-        fielddata = self.get_fd_stats(node_id,
-                                      node['indices']['fielddata']['evictions'],
-                                      node['breakers']['fielddata']['tripped'])
-        return(NODES_TEMPLATE['fielddata'].format(fielddata=fielddata))
+    def process_node_throughput(self, values):
+        processed_node_tp = {}
+        for counter in ['index', 'search', 'get', 'merge', 'refresh', 'flush']:
+            processed_node_tp[counter + '_rate'] = self.format_value(values[counter + '_rate'], "{0:.1f}")
+        return processed_node_tp
 
-    def process_node_connections(self, role, node_id, node):
+    def process_node_fielddata(self, values):
+        if values['fielddata_evictions'] is None or values['fielddata_tripped'] is None:
+            fielddata = "-|-"
+        else:
+            fielddata = "{0}|{1}".format(values['fielddata_evictions'], values['fielddata_tripped'])
+        return {'fielddata': fielddata}
+
+    def process_node_connections(self, values):
         processed_node_conns = {}
-        if node.get('http') is None:
-            node['http'] = {u'total_opened': 0, u'current_open': 0}
-        processed_node_conns['http_conn'] = self.get_http_conns(node_id, node['http'])
-        processed_node_conns['transport_conn'] = node['transport']['server_open']
-        return(NODES_TEMPLATE['connections'].format(**processed_node_conns))
+        processed_node_conns['http_conn'] = "{0}|{1}".format(values['http_current_open'],
+                                                             self.format_value(values['http_opened']))
+        processed_node_conns['transport_conn'] = self.format_value(values['transport_server_open'])
+        for counter in ['transport_rx', 'transport_tx']:
+            if values[counter + '_rate'] is not None:
+                processed_node_conns[counter] = self.size_human(values[counter + '_rate'])
+            else:
+                processed_node_conns[counter] = "-"
+        return processed_node_conns
 
-    def process_node_data_nodes(self, role, node_id, node):
+    def process_node_data_nodes(self, values):
         processed_node_dn = {}
-        # Data node specific metrics
-        if role in ['DATA', 'ALL']:
-            processed_node_dn['merge_time'] = node['indices']['merges']['total_time']
-            processed_node_dn['store_throttle'] = node['indices']['store']['size_in_bytes']
-            doc_count = node['indices']['docs']['count']
-            deleted_count = node['indices']['docs']['deleted']
-            if deleted_count > 0:
-                processed_node_dn['docs'] = "{0}|{1}".format(doc_count, deleted_count)
+        if values['docs_count'] is not None:
+            if values['merge_time_ms'] is not None:
+                processed_node_dn['merge_time'] = self.es_time_human(values['merge_time_ms'])
+            else:
+                processed_node_dn['merge_time'] = "-"
+            processed_node_dn['store_throttle'] = self.format_value(values['store_size_bytes'])
+            if values['docs_deleted'] > 0:
+                processed_node_dn['docs'] = "{0}|{1}".format(values['docs_count'], values['docs_deleted'])
             else:
-                processed_node_dn['docs'] = str(doc_count)
-            processed_node_dn['fs'] = self.get_disk_usage(node['fs'])
+                processed_node_dn['docs'] = str(values['docs_count'])
+            if values['disk_used_bytes'] is not None:
+                processed_node_dn['fs'] = "{}|{}%".format(self.size_human(values['disk_used_bytes']),
+                                                          values['disk_used_percent'])
+            else:
+                processed_node_dn['fs'] = "-"
         else:
             processed_node_dn['merge_time'] = "-"
             processed_node_dn['store_throttle'] = "-"
             processed_node_dn['docs'] = "-"
             processed_node_dn['fs'] = "-"
-        return(NODES_TEMPLATE['data_nodes'].format(**processed_node_dn))
+        return processed_node_dn
+
+    def process_node_window(self, values):
+        processed_node_window = {}
+        for metric, fields in self.windows.metrics:
+            processed_node_window['window_' + metric] = "/".join(
+                self.format_value(values[metric + '_' + stat], "{0:.1f}") for stat in self.windows.stats)
+        return processed_node_window
 
     def process_node(self, role, node_id, node):
-        node_segments = []
-        for category in self.categories:
-            category_func = getattr(self, 'process_node_' + category)
-            node_segments.append(category_func(role, node_id, node))
-        return("   ".join(node_segments))
+        """Extract a node's typed values for the selected categories into a row"""
+        # Sample the node's counters once, before the categories read their deltas and rates
+        timestamp = node.get('timestamp') or int(time.time() * 1000)
+        rates = self.node_counters.update(node_id, timestamp, self.get_node_counters(node))
+        values = {'type': 'node', 'node_id': node_id, 'missing': False, 'stale': False}
+        for get_values in self.node_getters:
+            values.update(get_values(role, node_id, node, rates))
+        if self.windows is not None:
+            values.update(self.windows.update(node_id, timestamp, values))
+        return values
+
+    def format_node(self, values):
+        """Format a node row for the table"""
+        if values['missing']:
+            failed_node = {}
+            failed_node['name'] = values['name'] + '-'
+            failed_node['role'] = "({0})".format(values['role'])  # Role it had when we last saw this node in the cluster
+            return NODES_FAILED_TEMPLATE.format(**failed_node)
+        cells = {}
+        for process_cells in self.node_row_cells:
+            cells.update(process_cells(values))
+        return self.node_row_format.format(**cells)
 
     def process_role(self, role, nodes_stats):
-        procs = []
-        for node_id in self.nodes_by_role[role]:
-            if node_id not in nodes_stats['nodes']:
+        rows = []
+        for record in list(self.nodes.by_role[role].values()):
+            if not self.nodes.is_present(record):
                 # did not get any data on this node, likely it left the cluster
-                # ...however it may have re-joined the cluster under a new node_id (such as a node restart)
-                failed_node_name = self.node_names[node_id]
-                new_nodes_by_name = {nodes_stats['nodes'][id]['name']: id for id in self.new_nodes}
-                if failed_node_name in new_nodes_by_name:
-                    # ...found it!  Remove the old node_id, we've already added the new node_id at this point
-                    new_node_id = new_nodes_by_name[failed_node_name]
-                    self.nodes_list.remove(node_id)
-                    self.node_names.pop(node_id)
-                    self.nodes_by_role[role].remove(node_id)
-                else:
-                    failed_node = {}
-                    failed_node['name'] = failed_node_name + '-'
-                    failed_node['role'] = "({0})".format(role)  # Role it had when we last saw this node in the cluster
-                    print self.colorize(NODES_FAILED_TEMPLATE.format(**failed_node), ESColors.GRAY)
+                rows.append({'type': 'node', 'node_id': record.node_id, 'name': record.name, 'role': role,
+                             'missing': True, 'stale': False})
+                if self.windows is not None:
+                    self.windows.forget(record.node_id)
                 continue
-            # make sure node's role hasn't changed
-            current_role = self.get_role(node_id, nodes_stats)
-            if current_role != role:
-                # Role changed, update lists so output will be correct on next iteration
-                self.nodes_by_role.setdefault(current_role, []).append(node_id)  # add to new role
-                self.nodes_by_role[role].remove(node_id)  # remove from current role
-            row = self.process_node(current_role, node_id, nodes_stats['nodes'][node_id])
-            if node_id in self.new_nodes:
-                print self.colorize(row, ESColors.WHITE)
-            else:
-                print row
-
-    def get_threads_headings(self):
-        thread_segments = []
-        for pool in self.threadpools:
-            thread_segments.append(NODES_TEMPLATE['threads'].format(threads=pool))
-        return(" ".join(thread_segments))
+            values = self.process_node(role, record.node_id, nodes_stats['nodes'][record.node_id])
+            if record.node_id in self.stale_nodes:
+                # --fan-out: this node's batch missed the deadline, so these are its last stats
+                values['stale'] = True
+                values['age'] = self.now - self.stale_nodes[record.node_id]
+            rows.append(values)
+        return rows
 
     def format_headings(self):
         """Format both cluster and node headings once and then store for later output"""
         cluster_heading_segments = []
-        node_heading_segments = []
 
         # cluster headings
         for category in self.cluster_categories:
@@ -444,69 +2739,555 @@ class Elasticstat:
         self.cluster_headings = "   ".join(cluster_heading_segments)
 
         # node headings
-        for category in self.categories:
-            if category == 'threads':
-                node_heading_segments.append(self.get_threads_headings())
+        node_headings = dict(NODE_HEADINGS)
+        for pool in self.threadpools:
+            node_headings['threads_' + pool] = pool
+        if self.windows is not None:
+            for metric, fields in self.windows.metrics:
+                node_headings['window_' + metric] = self.windows.heading(metric)
+        self.node_headings = self.node_row_format.format(**node_headings)
+
+    def fetch_stats(self):
+        """Fetch cluster health, node stats and the active master concurrently"""
+        if self.args.fetch_timeout is None:
+            # wait as long as the interval being polled at, which --adaptive stretches while requests are slow
+            self.fetcher.timeout = self.interval
+        # Leave a tenth of the tick for rendering, so a slow response does not push us past our slot
+        deadline = self.scheduler.next_start - 0.1 * self.scheduler.interval
+        requests = [
+            ('cluster_health', self.es_client.cluster.health),
+            ('nodes_stats', lambda: self.request_nodes_stats(**self.nodes_stats_params)),
+            ('active_master', lambda: self.es_client.cat.master(h="id").strip()),  # needed to remove trailing newline
+        ]
+        if self.fan_out is not None:
+            requests[1:2] = [('node_list', self.fetch_node_list)] + self.fan_out.requests(self.batch_request)
+        if self.hot_indices:
+            requests.append(('index_stats', lambda: self.es_client.indices.stats(**INDEX_STATS_PARAMS)))
+            requests.append(('state_version', lambda: self.es_client.cluster.state(**STATE_VERSION_PARAMS)))
+            if self.hot_index_names:
+                requests.append(('shard_stats', self.shard_stats_request(self.hot_index_names)))
+        if self.self_stats is not None:
+            # every batch's response is noted as part of nodes_stats
+            requests = [(name, self.measure_request(name.partition('/')[0], request)) for name, request in requests]
+        if self.discovery is not None and (self.discovered_at is None or self.now - self.discovered_at >= self.discovery.ttl):
+            # the version probe rides along with an update rather than holding up startup
+            requests.append(('info', self.es_client.info))
+        results = self.fetcher.fetch(requests, deadline, background=['info'])
+        if self.hot_indices:
+            results.update(self.fetch_placement(results, deadline))
+        info = results.pop('info', None)
+        if info is not None and not info.stale:
+            self.update_version(info.response['version']['number'])
+        if self.fan_out is not None:
+            node_list = results.pop('node_list')
+            results['nodes_stats'], self.stale_nodes = self.fan_out.merge(results)
+            if not node_list.stale:
+                self.fan_out.update_node_ids(node_list.response)
+            elif results['nodes_stats'].error is None:
+                results['nodes_stats'] = results['nodes_stats']._replace(error=node_list.error)
+        return results
+
+    def update_version(self, es_version):
+        """Take the version the cluster reports, laying the table out afresh if the cached version had other thread
+        pools"""
+        self.discovered_at = self.now
+        self.discovery_unsaved = True
+        if es_version == self.es_version:
+            return
+        self.es_version = es_version
+        self.streams_node_stats = self._streams_node_stats()
+        if self._parse_threadpools(self.args.threadpools) != self.threadpools:
+            self._build_layout(self.args)
+            self.format_headings()
+            if isinstance(self.writer, CSVWriter) and self.writer.header:
+                # columns are fixed once the header is out
+                self.writer.fields = csv_fields(self.get_node_fields())
+
+    def save_discovery(self):
+        """Cache the version and the nodes present, for the next start"""
+        nodes = dict((record.node_id, record.name) for record in self.nodes.by_id.values() if self.nodes.is_present(record))
+        self.discovery.save(self.now, self.es_version, nodes)
+        self.discovery_unsaved = False
+
+    def fetch_node_list(self):
+        return self.es_client.cluster.state(metric='nodes', filter_path='nodes.*.name')
+
+    def fetch_placement(self, results, deadline):
+        """With --hot-indices, fetch where the shard copies of the hot indices are if that may have changed: the
+        hot indices are not those the placement was fetched for, or the cluster state has a new version.  The hot
+        indices are taken from this update's index stats, and an index which has just become hot has its shard stats
+        fetched too, so its shards are shown from this update on."""
+        self.update_indices(results['index_stats'])
+        hot_index_names = self.index_counters.top(self.hot_indices, ['index_total', 'query_total'])
+        state_version = results['state_version']
+        if state_version.stale and self.placement_key is not None:
+            version = self.placement_key[1]  # no news of the cluster state: keep the placement we have
+        else:
+            version = (state_version.response or {}).get('version')
+        if not hot_index_names or (frozenset(hot_index_names), version) == self.placement_key:
+            return {}
+        requests = [('placement', lambda: self.es_client.cluster.state(index=",".join(hot_index_names), **PLACEMENT_PARAMS))]
+        if not set(hot_index_names) <= set(self.hot_index_names):
+            requests.append(('shard_stats', self.shard_stats_request(hot_index_names)))
+        if self.self_stats is not None:
+            requests = [(name, self.measure_request(name, request)) for name, request in requests]
+        return self.fetcher.fetch(requests, deadline, background=['info'])
+
+    def shard_stats_request(self, index_names):
+        """A shard level stats request for just these indices, for --hot-indices"""
+        return lambda: self.es_client.indices.stats(index=",".join(index_names), **SHARD_STATS_PARAMS)
+
+    def batch_request(self, node_ids):
+        """A node stats request for just these nodes, for --fan-out"""
+        return lambda: self.request_nodes_stats(node_id=",".join(node_ids), **self.nodes_stats_params)
+
+    def request_nodes_stats(self, **params):
+        """Request node stats, returning the response with a flat record (see NodeStatsDecoder) for each node"""
+        decoder = self.node_decoder
+        if not self.streams_node_stats:
+            # filter_path has trimmed the response to the fields used, or a client given to us decodes it its own way
+            return decoder.project(self.es_client.nodes.stats(**params))
+        self.serializer.local.decoder = decoder
+        try:
+            return self.es_client.nodes.stats(**params)
+        finally:
+            self.serializer.local.decoder = None
+
+    def measure_request(self, name, request):
+        """Wrap a request to note the size and decode time of its response for --self-stats"""
+        def measured_request():
+            self.serializer.take()  # start from nothing decoded on this thread
+            response = request()
+            size, decode_time = self.serializer.take()
+            if size is None and isinstance(response, basestring):
+                size = len(response)  # plain text, e.g. from the cat API
+            self.self_stats.note_response(name, size, decode_time)
+            return response
+        return measured_request
+
+    def record_snapshot(self, results):
+        """Queue this tick's fresh responses (stale ones are recorded as null) and fetch timings for recording"""
+        snapshot = {'time': self.now, 'version': self.es_version, 'timings': {}, 'errors': {},
+                    'period': self.scheduler.period, 'overruns': self.scheduler.overruns, 'interval': self.interval,
+                    'node_records': True, 'categories': self.categories, 'threadpools': self.threadpools}
+        for name, result in results.items():
+            snapshot[name] = None if result.stale else result.response
+            if not result.stale:
+                snapshot['timings'][name] = result.elapsed
+            if result.error is not None:
+                snapshot['errors'][name] = str(result.error)
+        if self.stale_nodes:
+            snapshot['stale_nodes'] = self.stale_nodes
+        self.recorder.record(snapshot)
+
+    def close(self):
+        if self.recorder is not None:
+            self.recorder.close()
+            if self.recorder.summary() is not None:
+                sys.stderr.write(self.recorder.summary() + "\n")
+        if self.self_stats is not None:
+            self.self_stats.close()
+            sys.stderr.write("\n".join(self.self_stats.summary()) + "\n")
+
+    def get_age(self, result):
+        """Seconds since a stale result was received, or None if it is fresh (or nothing was ever received)"""
+        if not result.stale or result.fetched_at is None:
+            return None
+        return self.now - result.fetched_at
+
+    def stale_note(self, result):
+        if result.fetched_at is None:
+            return "(no data received yet: {0})".format(result.error)
+        return "(stale, {0:.0f}s old: {1})".format(self.now - result.fetched_at, result.error)
+
+    def process_cluster(self, result):
+        """Build the cluster row from a cluster health result"""
+        cluster_row = {'type': 'cluster', 'time': self.now, 'stale': result.stale, 'age': self.get_age(result),
+                       'error': None if result.error is None else str(result.error)}
+        if result.response is not None:
+            for field in CLUSTER_FIELDS:
+                cluster_row[field] = result.response.get(field)
+            self.cluster_name = cluster_row['cluster_name']
+        cluster_row['cluster'] = self.name or self.cluster_name
+        cluster_row['period'] = self.period
+        cluster_row['overruns'] = self.overruns
+        cluster_row['interval'] = self.interval
+        return cluster_row
+
+    def process_nodes(self, result):
+        """Build the node rows from a node stats result, reusing the last rows (flagged stale) if it is stale"""
+        if result.stale:
+            # Reuse what we had last time rather than holding up the whole tick on a slow response
+            age = self.get_age(result)
+            return [dict(row, stale=True, age=age) for row in self.last_node_rows]
+        self.update_nodes(result.response)
+        node_rows = []
+        for role in list(self.nodes.by_role):
+            node_rows.extend(self.process_role(role, result.response))
+        self.last_node_rows = node_rows
+        return node_rows
+
+    def update_indices(self, result):
+        """Take an index stats result into the index counters, unless it is already in them"""
+        if result.response is None or result.fetched_at == self.index_counters.sampled_at:
+            return
+        samples = {}
+        for index, stats in result.response.get('indices', {}).items():
+            total = stats.get('total', {})
+            samples[index] = [total.get('indexing', {}).get('index_total'), total.get('search', {}).get('query_total'),
+                              total.get('merges', {}).get('current')]
+        self.index_counters.update(samples, result.fetched_at)
+
+    def update_shards(self, result):
+        """Take a shard level stats result into the shard counters, keyed by each copy's index, shard and node"""
+        samples = {}
+        for index, index_stats in result.response.get('indices', {}).items():
+            for shard, copies in index_stats.get('shards', {}).items():
+                for copy in copies:
+                    key = (index, int(shard), copy.get('routing', {}).get('node'))
+                    samples[key] = [copy.get('indexing', {}).get('index_total'),
+                                    copy.get('search', {}).get('query_total')]
+        self.shard_counters.update(samples, result.fetched_at)
+
+    def update_placement(self, result):
+        """Take the routing table of the hot indices as where their (assigned) shard copies are"""
+        placement = {}
+        indices = result.response.get('routing_table', {}).get('indices', {})
+        for index, index_routing in indices.items():
+            for shard, copies in index_routing.get('shards', {}).items():
+                for copy in copies:
+                    if copy.get('node') is not None:
+                        placement[(index, int(shard), copy['node'])] = copy.get('primary')
+        self.shard_placement = placement
+        self.placement_key = (frozenset(indices), result.response.get('version'))
+
+    def process_indices(self, results):
+        """Build the --hot-indices rows: the busiest indices by indexing and search rate, with their hottest shards"""
+        self.update_indices(results['index_stats'])
+        placement = results.get('placement')
+        if placement is not None and not placement.stale:
+            self.update_placement(placement)
+        shard_stats = results.get('shard_stats')
+        if shard_stats is not None and shard_stats.response is not None and \
+                shard_stats.fetched_at != self.shard_counters.sampled_at:
+            self.update_shards(shard_stats)
+
+        self.hot_index_names = self.index_counters.top(self.hot_indices, ['index_total', 'query_total'])
+        shards_by_index = {}
+        for key in self.shard_placement:
+            shards_by_index.setdefault(key[0], []).append(key)
+        index_rows = []
+        for index in self.hot_index_names:
+            shards = []
+            for key in shards_by_index.get(index, []):
+                node = self.nodes.by_id.get(key[2])
+                counted = key in self.shard_counters.slots
+                shards.append({'shard': key[1], 'primary': self.shard_placement[key], 'node_id': key[2],
+                               'node': node.name if node is not None else key[2],
+                               'index_rate': self.shard_counters.get(key, 'index_total') if counted else None,
+                               'search_rate': self.shard_counters.get(key, 'query_total') if counted else None})
+            shards.sort(key=lambda shard: (shard['index_rate'] or 0) + (shard['search_rate'] or 0), reverse=True)
+            index_rows.append({'type': 'index', 'index': index,
+                               'index_rate': self.index_counters.get(index, 'index_total'),
+                               'search_rate': self.index_counters.get(index, 'query_total'),
+                               'merges': self.index_counters.get(index, 'merges_current', rate=False),
+                               'shards': shards[:HOT_SHARDS]})
+        return index_rows
+
+    def check_triggers(self, cluster_row, node_rows):
+        """Flag the rows a --capture rule fires on, and capture hot threads and tasks of their nodes (the active
+        master's for the cluster row)"""
+        triggers = {}
+        for row in [cluster_row] + node_rows:
+            row['triggers'] = None
+            if row['stale'] or row.get('missing'):
+                continue  # a rule firing again on data already seen
+            fired = [rule for rule, field, compare, threshold in self.capture_rules
+                     if row.get(field) is not None and compare(row[field], threshold)]
+            if fired:
+                row['triggers'] = ",".join(fired)
+                node_id = row['node_id'] if row['type'] == 'node' else self.active_master
+                if node_id:
+                    triggers[node_id] = ",".join(fired + ([triggers[node_id]] if node_id in triggers else []))
+        if triggers and self.capture is not None:
+            self.capture.capture(triggers, cluster_row['cluster'], self.now)
+
+    def update_nodes(self, nodes_stats):
+        # Nodes can join and leave cluster with each iteration -- in order to report on nodes
+        # that have left the cluster, the registry keeps every node seen, grouped by role.
+        self.nodes.update(nodes_stats['nodes'], lambda node_id: self.get_role(node_id, nodes_stats))
+        for node_id in self.nodes.rejoined.values():
+            self.node_counters.forget(node_id)
+            if self.windows is not None:
+                self.windows.forget(node_id)
+
+    def format_cluster(self, cluster_result, cluster_row):
+        """Format the cluster line of the table, returning the line and its color"""
+        if 'status' not in cluster_row:
+            return (self.stale_note(cluster_result), ESColors.GRAY)
+        cluster_health = dict(cluster_row)
+        cluster_health['cluster_name'] = cluster_row['cluster']
+        cluster_health['timestamp'] = self.thetime()
+        cluster_health['period'] = self.format_value(self.period, "{0:.2f}s")
+        cluster_health['interval'] = self.format_value(self.interval, "{0:g}s")
+        cluster_segments = []
+        for category in self.cluster_categories:
+            cluster_segments.append(CLUSTER_TEMPLATE[category].format(**cluster_health))
+        cluster_health_formatted = "   ".join(cluster_segments)
+        if cluster_row.get('triggers'):
+            cluster_health_formatted += "   [{0}]".format(cluster_row['triggers'])
+        if self.capture is not None and self.capture.summary() is not None:
+            cluster_health_formatted += "   [{0}]".format(self.capture.summary())
+        if cluster_result.stale:
+            return (cluster_health_formatted + "   " + self.stale_note(cluster_result), ESColors.GRAY)
+        return (cluster_health_formatted, self.STATUS_COLOR[cluster_health['status']])
+
+    def sort_key(self, values):
+        if values['missing']:
+            return float('inf')  # a node which has left the cluster ranks worst of all
+        return sum(values[field] or 0 for field in self.sort_fields)
+
+    def filter_matches(self, values):
+        for field, pattern, is_glob in self.node_filter:
+            value = values.get(field)
+            value = "" if value is None else str(value)
+            if not (fnmatch.fnmatchcase(value, pattern) if is_glob else value == pattern):
+                return False
+        return True
+
+    def select_nodes(self, node_rows):
+        """Pick the node rows the table shows: those matching --filter, worst first by --sort, at most --top"""
+        if self.node_filter is not None:
+            node_rows = [values for values in node_rows if self.filter_matches(values)]
+        if self.sort_fields is None:
+            return node_rows
+        if self.top is not None:
+            # partial selection, so picking the worst few of hundreds of nodes does not sort them all
+            return heapq.nlargest(self.top, node_rows, key=self.sort_key)
+        return sorted(node_rows, key=self.sort_key, reverse=True)
+
+    def format_rollup(self, metric, rollup):
+        """Format a role's Rollup of a metric: its mean and standard deviation or its total, and its skew"""
+        if rollup is None:
+            return "-"
+        category, fields, shown, value_format = ROLLUP_METRICS[metric]
+
+        def format_rollup_value(value):
+            if value_format is None:
+                return self.size_human(value).strip()
+            return value_format.format(value)
+
+        if shown == 'mean':
+            value = "{0}({1})".format(format_rollup_value(rollup.mean), format_rollup_value(rollup.spread))
+        else:
+            value = format_rollup_value(rollup.total)
+        return "{0} x{1}".format(value, self.format_value(rollup.skew, "{0:.1f}"))
+
+    def format_rollups(self, node_rows):
+        """Format the --rollup lines, a line per role"""
+        lines = [self.colorize(self.rollup_headings, ESColors.GRAY)]
+        for role, (nodes, rollups) in self.rollups.update(node_rows, self.now).items():
+            cells = {'role': role, 'nodes': nodes}
+            for metric, fields in self.rollups.metrics:
+                cells['rollup_' + metric] = self.format_rollup(metric, rollups[metric])
+            lines.append(self.rollup_format.format(**cells))
+        return lines
+
+    def format_nodes(self, results, node_rows):
+        """Format the node table, returning its lines"""
+        gray = ESColors.GRAY
+        lines = []
+        if self.rollups is not None:
+            # summarize every node, whichever of them --filter and --top leave in the table
+            lines.extend(self.format_rollups(node_rows))
+        lines.append(self.colorize(self.node_headings, gray))
+        if results['nodes_stats'].stale:
+            lines.append(self.colorize(self.stale_note(results['nodes_stats']), gray))
+        elif self.stale_nodes:
+            lines.append(self.colorize("({0} of {1} nodes stale: {2})".format(
+                len(self.stale_nodes), len(node_rows), results['nodes_stats'].error), gray))
+        shown_rows = self.select_nodes(node_rows)
+        if len(shown_rows) < len(node_rows):
+            lines.append(self.colorize("({0} of {1} nodes shown)".format(len(shown_rows), len(node_rows)), gray))
+        node_rows = shown_rows
+        for values in node_rows:
+            row = self.format_node(values)
+            if values['node_id'] in self.stale_nodes:
+                row += "  ({0:.0f}s old)".format(values['age'])
+            if values.get('triggers'):
+                row = self.colorize(row + "  [{0}]".format(values['triggers']), ESColors.RED)
+            elif values['stale'] or values['missing']:
+                row = self.colorize(row, gray)
+            elif values['new']:
+                row = self.colorize(row, ESColors.WHITE)
+            lines.append(row)
+        return lines
+
+    def format_indices(self, result):
+        """Format the --hot-indices table, returning its lines"""
+        gray = ESColors.GRAY
+        lines = [self.colorize(INDICES_TEMPLATE.format(**INDEX_HEADINGS), gray)]
+        if result.stale:
+            lines.append(self.colorize(self.stale_note(result), gray))
+        for values in self.index_rows:
+            shards = ", ".join("{0}{1} {2}: {3}|{4}".format(
+                shard['shard'], 'p' if shard['primary'] else 'r', shard['node'],
+                self.format_value(shard['index_rate'], "{0:.0f}"), self.format_value(shard['search_rate'], "{0:.0f}"))
+                for shard in values['shards'])
+            lines.append(INDICES_TEMPLATE.format(
+                index=values['index'], index_rate=self.format_value(values['index_rate'], "{0:.1f}"),
+                search_rate=self.format_value(values['search_rate'], "{0:.1f}"),
+                merges=self.format_value(values['merges'], "{0:.0f}"), shards=shards or "-"))
+        return lines
+
+    def print_table(self, results, cluster_row, node_rows):
+        lines = [self.colorize(self.cluster_headings, ESColors.GRAY),
+                 self.colorize(*self.format_cluster(results['cluster_health'], cluster_row))]
+        lines.extend(self.format_nodes(results, node_rows))
+        if self.hot_indices:
+            lines.extend(self.format_indices(results['index_stats']))
+        if self.self_stats is not None:
+            lines.extend(self.colorize(line, ESColors.GRAY) for line in self.self_stats.footer())
+            started = monotonic()
+            self.frames.write_frame(lines)
+            self.self_stats.add('write_ms', (monotonic() - started) * 1000)
+        else:
+            self.frames.write_frame(lines)
+
+    def process_tick(self, results):
+        """Process a tick's fetch results into the cluster row and node rows"""
+        if results['active_master'].response is not None:
+            self.active_master = results['active_master'].response
+        cluster_row = self.process_cluster(results['cluster_health'])
+        node_rows = self.process_nodes(results['nodes_stats'])
+        for row in node_rows:
+            row['time'] = self.now
+            row['cluster'] = cluster_row['cluster']
+        if self.hot_indices:
+            self.index_rows = self.process_indices(results)
+        if self.capture_rules:
+            self.check_triggers(cluster_row, node_rows)
+        return (cluster_row, node_rows)
+
+    def output_tick(self, results, cluster_row, node_rows):
+        if self.metrics is not None:
+            self.metrics.write_ticks([(cluster_row, node_rows)])
+        if self.writer is not None:
+            self.writer.write_tick(cluster_row, node_rows)
+        elif self.metrics is None:
+            self.print_table(results, cluster_row, node_rows)
+
+    def poll(self):
+        """Fetch and process a live tick, returning the fetch results, cluster row and node rows"""
+        results = self.fetch_stats()
+        if self.recorder is not None:
+            self.record_snapshot(results)
+        if self.self_stats is None:
+            rows = self.process_tick(results)
+        else:
+            self.self_stats.add_fetch(results)
+            rows = self.self_stats.timed('process_ms', self.process_tick)(results)
+        if self.discovery_unsaved and not results['nodes_stats'].stale:
+            self.save_discovery()
+        return (results,) + rows
+
+    def measured_tick(self, tick):
+        """Run one tick's poll-and-output callable, measuring it for --self-stats"""
+        if self.self_stats is None:
+            return tick()
+        self.self_stats.start_tick()
+        tick()
+        self.self_stats.end_tick(self.now)
+
+    def replay_results(self, snapshot):
+        """Turn a recorded tick back into fetch results, with sections not recorded that tick shown as stale"""
+        results = {}
+        self.stale_nodes = snapshot.get('stale_nodes', {})
+        names = ['cluster_health', 'nodes_stats', 'active_master']
+        if self.hot_indices:
+            # recorded when the recording was made with --hot-indices
+            names.extend(['index_stats', 'shard_stats', 'placement'])
+        for name in names:
+            if snapshot.get(name) is not None:
+                response = snapshot[name]
+                if name == 'nodes_stats' and not snapshot.get('node_records'):
+                    # recorded before node stats were kept as records
+                    response = self.node_decoder.project(response)
+                self.replay_last[name] = FetchResult(response, None, snapshot['timings'].get(name),
+                                                     snapshot['time'], False)
+                results[name] = self.replay_last[name]
+                continue
+            error = snapshot['errors'].get(name, "not recorded")
+            if name in self.replay_last:
+                results[name] = self.replay_last[name]._replace(error=error, stale=True)
             else:
-                node_heading_segments.append(NODES_TEMPLATE[category].format(**NODE_HEADINGS))
-        self.node_headings = "   ".join(node_heading_segments)
+                results[name] = FetchResult(None, error, None, None, True)
+        return results
+
+    def replay_stats(self):
+        """Display a recording, paced by the recorded times sped up by the replay speed"""
+        replay_start = recording_start = None
+        for snapshot in self.replay_snapshots:
+            if replay_start is None:
+                replay_start, recording_start = monotonic(), snapshot['time']
+            else:
+                time.sleep(max(0, replay_start + (snapshot['time'] - recording_start) / self.replay_speed - monotonic()))
+            self.now, self.period, self.overruns = snapshot['time'], snapshot.get('period'), snapshot.get('overruns', 0)
+            self.interval = snapshot.get('interval', self.sleep_interval)
+            self.measured_tick(lambda: self.replay_tick(snapshot))
+
+    def replay_tick(self, snapshot):
+        results = self.replay_results(snapshot)
+        if self.self_stats is None:
+            return self.output_tick(results, *self.process_tick(results))
+        self.self_stats.add_fetch(results)
+        rows = self.self_stats.timed('process_ms', self.process_tick)(results)
+        self.self_stats.timed('render_ms', self.output_tick)(results, *rows)
 
     def print_stats(self):
+        if self.es_client is None:
+            return self.replay_stats()
         # just run forever until ctrl-c
         while True:
-            cluster_segments = []
-            cluster_health = self.es_client.cluster.health()
-            nodes_stats = self.es_client.nodes.stats(human=True)
-            self.active_master = self.es_client.cat.master(h="id").strip()  # needed to remove trailing newline
-
-            # Print cluster health
-            cluster_health['timestamp'] = self.thetime()
-            status = cluster_health['status']
-            for category in self.cluster_categories:
-                cluster_segments.append(CLUSTER_TEMPLATE[category].format(**cluster_health))
-                cluster_health_formatted = "   ".join(cluster_segments)
-            print self.colorize(self.cluster_headings, ESColors.GRAY)
-            print self.colorize(cluster_health_formatted, self.STATUS_COLOR[status])
-
-            # Nodes can join and leave cluster with each iteration -- in order to report on nodes
-            # that have left the cluster, maintain a list grouped by role.
-            current_nodes_count = len(self.nodes_list)
-            if current_nodes_count == 0:
-                # First run, so we need to build the list of nodes by role
-                for node_id in nodes_stats['nodes']:
-                    self.nodes_list.append(node_id)
-                    self.node_names[node_id] = nodes_stats['nodes'][node_id]['name']
-                    node_role = self.get_role(node_id, nodes_stats)
-                    self.nodes_by_role.setdefault(node_role, []).append(node_id)
-            else:
-                # Check for new nodes that have joined the cluster
-                self.new_nodes = list(set(nodes_stats['nodes']) - set(self.nodes_list))
-                if len(self.new_nodes) > 0:
-                    # At least one new node id found, so add to the list
-                    for node_id in self.new_nodes:
-                        self.nodes_list.append(node_id)
-                        self.node_names[node_id] = nodes_stats['nodes'][node_id]['name']
-                        node_role = self.get_role(node_id, nodes_stats)
-                        self.nodes_by_role.setdefault(node_role, []).append(node_id)
-
-            # Print node stats
-            print self.colorize(self.node_headings, ESColors.GRAY)
-            for role in self.nodes_by_role:
-                self.process_role(role, nodes_stats)
-            print ""  # space out each run for readability
-            time.sleep(self.sleep_interval)
+            self.scheduler.tick()
+            self.now, self.period, self.overruns = time.time(), self.scheduler.period, self.scheduler.overruns
+            self.interval = self.scheduler.interval
+            self.measured_tick(self.live_tick)
+            self.scheduler.wait()
 
+    def live_tick(self):
+        results, cluster_row, node_rows = self.poll()
+        if self.self_stats is not None:
+            self.self_stats.timed('render_ms', self.output_tick)(results, cluster_row, node_rows)
+        else:
+            self.output_tick(results, cluster_row, node_rows)
+        if self.adaptive is not None:
+            self.scheduler.set_interval(self.adaptive.update(results, cluster_row))
 
-def main():
-    # get command line input
+
+def build_parser():
+    """Build the command line parser"""
     description = 'Elasticstat is a utility for real-time performance monitoring of an Elasticsearch cluster from the command line'
     parser = ESArgParser(description=description, add_help=False)
 
     parser.add_argument('-h',
                         '--host',
-                        default='localhost',
-                        dest='hostlist',
-                        help='Host in Elasticsearch cluster (or a comma-delimited list of hosts)')
+                        default=None,
+                        action='append',
+                        dest='hostlists',
+                        metavar='[NAME=]HOSTLIST',
+                        help='Host in Elasticsearch cluster (or a comma-delimited list of hosts); repeat, optionally '
+                             'naming each cluster, to monitor several clusters')
+    parser.add_argument('--inventory',
+                        dest='inventory',
+                        default=None,
+                        metavar='FILE',
+                        help='File listing clusters to monitor, one per line as NAME HOSTLIST')
+    parser.add_argument('--parallel',
+                        dest='parallel',
+                        default=8,
+                        type=int,
+                        help='Maximum number of clusters to poll at once (default: 8)')
     parser.add_argument('--port',
                         dest='port',
                         default=9200,
@@ -542,6 +3323,72 @@ def main():
                         metavar='THREADPOOL',
                         nargs='+',
                         help='Threadpools to show')
+    parser.add_argument('--sort',
+                        dest='sort',
+                        default=None,
+                        metavar='KEY[:THREADPOOL]',
+                        help='Show nodes worst first by {0} (queue and rejected sum every threadpool shown, '
+                             'or only THREADPOOL)'.format('|'.join(SORT_KEYS)))
+    parser.add_argument('--top',
+                        dest='top',
+                        default=None,
+                        type=int,
+                        metavar='N',
+                        help='Only show the N worst nodes by --sort (default sort: heap)')
+    parser.add_argument('--filter',
+                        dest='node_filter',
+                        default=None,
+                        type=node_filter,
+                        metavar='FIELD=VALUE[,...]',
+                        help='Only show nodes matching every FIELD=VALUE or FIELD=~GLOB, e.g. role=DATA,name=~hot-*')
+    parser.add_argument('--window',
+                        dest='window',
+                        default=None,
+                        type=window_size,
+                        metavar='TICKS',
+                        help='Show statistics over each node\'s last TICKS updates of heap, load, threadpool queue, '
+                             'GC rate and disk usage (as the selected categories provide them)')
+    parser.add_argument('--window-stats',
+                        dest='window_stats',
+                        default=WINDOW_STATS,
+                        type=window_stats,
+                        metavar='STAT[,...]',
+                        help='Statistics --window shows, from {0} (default: all of them)'.format(','.join(WINDOW_STATS)))
+    parser.add_argument('--rollup',
+                        dest='rollup',
+                        action='store_true',
+                        default=False,
+                        help='Show a line per node role above the nodes: means or totals of heap, load, threadpool '
+                             'active/queue/rejected, docs, store size and disk usage, with their skew (max/median)')
+    parser.add_argument('--hot-indices',
+                        dest='hot_indices',
+                        default=None,
+                        type=int,
+                        metavar='N',
+                        help='Show the N busiest indices by indexing and search rate, with the nodes holding their '
+                             'hottest shards')
+    parser.add_argument('--capture',
+                        dest='capture_rules',
+                        default=None,
+                        action='append',
+                        type=capture_rule,
+                        metavar='FIELD>VALUE',
+                        help='When a node\'s FIELD (any --format jsonl field, e.g. search_queue, write_rejected_delta, '
+                             'heap_used_percent, old_gc_count) goes over VALUE (or >= VALUE), flag its row and save '
+                             'its hot threads and tasks to files; on number_of_pending_tasks, the active master\'s. '
+                             'Repeat for more rules')
+    parser.add_argument('--capture-dir',
+                        dest='capture_dir',
+                        default='.',
+                        type=capture_directory,
+                        metavar='DIR',
+                        help='Directory --capture saves to, created if need be (default: the current directory)')
+    parser.add_argument('--capture-every',
+                        dest='capture_every',
+                        default=60.0,
+                        type=float,
+                        metavar='SECONDS',
+                        help='Capture each node at most once every SECONDS (default: 60)')
     parser.add_argument('-C',
                         '--no-color',
                         dest='no_color',
@@ -552,19 +3399,150 @@ def main():
                         dest='no_pending_tasks',
                         default=False,
                         help='Disable display of pending tasks in cluster health (use for Elasticsearch <v1.5)')
+    parser.add_argument('--timeout',
+                        dest='fetch_timeout',
+                        default=None,
+                        type=float,
+                        metavar='SECONDS',
+                        help='How long to wait for Elasticsearch responses each update before showing stale data '
+                             '(default: the interval being polled at)')
+    parser.add_argument('--fan-out',
+                        dest='fan_out',
+                        default=None,
+                        type=int,
+                        metavar='BATCH',
+                        help='Fetch node stats in parallel requests of BATCH nodes each, so a slow node only holds '
+                             'back its own batch; nodes whose batch misses --timeout show their last stats, marked '
+                             'stale with their age')
+    parser.add_argument('--adaptive',
+                        dest='adaptive',
+                        action='store_true',
+                        default=False,
+                        help='Poll less often while the cluster is struggling (slow or failing requests, growing '
+                             'pending tasks), returning to DELAYINTERVAL as it recovers')
+    parser.add_argument('--min-interval',
+                        dest='min_interval',
+                        default=None,
+                        type=positive_float,
+                        metavar='SECONDS',
+                        help='Shortest interval --adaptive polls at (default: DELAYINTERVAL)')
+    parser.add_argument('--max-interval',
+                        dest='max_interval',
+                        default=None,
+                        type=positive_float,
+                        metavar='SECONDS',
+                        help='Longest interval --adaptive polls at (default: 8 x DELAYINTERVAL)')
+    parser.add_argument('--discovery-ttl',
+                        dest='discovery_ttl',
+                        default=3600,
+                        type=float,
+                        metavar='SECONDS',
+                        help='Start from the Elasticsearch version and node list cached by the last run for up to '
+                             'SECONDS, checking them on the first update instead of before it; 0 turns the cache off '
+                             '(default: 3600)')
+    parser.add_argument('--discovery-cache',
+                        dest='discovery_cache',
+                        default=os.path.join(os.environ.get('XDG_CACHE_HOME') or os.path.expanduser('~/.cache'),
+                                             'elasticstat'),
+                        metavar='DIR',
+                        help='Directory the discovery cache is kept in (default: $XDG_CACHE_HOME/elasticstat, or '
+                             '~/.cache/elasticstat)')
+    parser.add_argument('-f',
+                        '--format',
+                        dest='output_format',
+                        default='table',
+                        choices=OUTPUT_FORMATS,
+                        help='Output format: table, or jsonl/csv rows of typed values for each update (default: table)')
+    parser.add_argument('-o',
+                        '--output',
+                        dest='output',
+                        default=None,
+                        metavar='FILE',
+                        help='Write output to FILE instead of stdout')
+    parser.add_argument('--in-place',
+                        dest='in_place',
+                        action='store_true',
+                        default=False,
+                        help='Redraw the table in place on the terminal instead of scrolling')
+    parser.add_argument('--serve',
+                        dest='serve',
+                        default=None,
+                        type=listen_address,
+                        metavar='[HOST]:PORT',
+                        help='Serve the latest update as Prometheus metrics at http://HOST:PORT/metrics '
+                             '(instead of printing the table)')
+    parser.add_argument('--self-stats',
+                        dest='self_stats',
+                        nargs='?',
+                        const='',
+                        default=None,
+                        metavar='TRACEFILE',
+                        help="Show where elasticstat's own time goes each update below the table, optionally "
+                             "appending it to TRACEFILE as JSON lines, and summarize it on exit")
+    parser.add_argument('--record',
+                        dest='record',
+                        default=None,
+                        metavar='FILE',
+                        help='Also append the responses of each update to FILE (gzip compressed JSON lines)')
+    parser.add_argument('--replay',
+                        dest='replay',
+                        default=None,
+                        metavar='FILE',
+                        help='Display a recording made with --record instead of connecting to Elasticsearch')
+    parser.add_argument('--speed',
+                        dest='replay_speed',
+                        default=1.0,
+                        type=replay_speed,
+                        metavar='SPEED',
+                        help='Replay speed, e.g. 10x (default: 1x)')
+    parser.add_argument('--from',
+                        dest='replay_from',
+                        default=None,
+                        type=time_of_day,
+                        metavar='HH:MM',
+                        help='Start the replay at this time of day')
+    parser.add_argument('--to',
+                        dest='replay_to',
+                        default=None,
+                        type=time_of_day,
+                        metavar='HH:MM',
+                        help='End the replay at this time of day')
     parser.add_argument('delay_interval',
                         default='1',
                         nargs='?',
-                        type=int,
+                        type=positive_int,
                         metavar='DELAYINTERVAL',
                         help='How long to delay between updates, in seconds')
+    return parser
 
+
+def main():
+    # get command line input
+    parser = build_parser()
     args = parser.parse_args()
+    if args.max_interval is not None and args.max_interval < max(args.delay_interval, args.min_interval or 0):
+        parser.error("--max-interval can't be shorter than DELAYINTERVAL or --min-interval")
+    clusters = parse_clusters(args.hostlists, args.inventory)
+    name, args.hostlist = clusters[0]
 
     signal.signal(signal.SIGINT, lambda signum, frame: sys.exit())
-    elasticstat = Elasticstat(args)
-    elasticstat.format_headings()
-    elasticstat.print_stats()
+    try:
+        if len(clusters) > 1:
+            if args.record or args.replay or args.self_stats is not None:
+                parser.error("--record, --replay and --self-stats work with a single cluster")
+            elasticstat = ClusterMonitor(args, clusters)
+        else:
+            # a single cluster is only known by the name it reports, unless named with -h NAME=HOSTLIST
+            elasticstat = Elasticstat(args, name=name if name != args.hostlist else None)
+        elasticstat.format_headings()
+        try:
+            elasticstat.print_stats()
+        finally:
+            elasticstat.close()
+    except argparse.ArgumentTypeError as e:
+        # options which can only be checked against the cluster's version or the categories selected (which for
+        # a cluster monitored along with others is once it is reached)
+        parser.error(str(e))
 
 
 if __name__ == "__main__":
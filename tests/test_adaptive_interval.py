@@ -0,0 +1,87 @@
+import sys
+
+import pytest
+
+from elasticstat import elasticstat
+from elasticstat.elasticstat import AdaptiveInterval, FetchResult
+
+
+def results(latency=0.1, error=None):
+    nodes_stats = FetchResult(None if error else {}, error, latency, 0, error is not None)
+    return {'cluster_health': FetchResult({}, None, 0.01, 0, False), 'nodes_stats': nodes_stats}
+
+
+def intervals(adaptive, updates):
+    return [adaptive.update(update, {'number_of_pending_tasks': pending}) for update, pending in updates]
+
+
+def test_backs_off_while_requests_fail_up_to_the_max():
+    adaptive = AdaptiveInterval(1, 1, 8)
+    assert intervals(adaptive, [(results(error="timed out after 1s"), 0)] * 5) == [2, 4, 8, 8, 8]
+
+
+def test_recovers_to_the_base_interval():
+    adaptive = AdaptiveInterval(1, 1, 8)
+    intervals(adaptive, [(results(error="timed out after 1s"), 0)] * 3)
+    assert intervals(adaptive, [(results(), 0)] * 9) == [6, 4.5, 3.4, 2.5, 1.9, 1.4, 1, 1, 1]
+
+
+def test_settles_where_slow_node_stats_take_under_half_the_interval():
+    adaptive = AdaptiveInterval(1, 1, 8)
+    assert intervals(adaptive, [(results(latency=2.5), 0)] * 6) == [2, 4, 8, 6, 6, 6]
+
+
+def test_growing_pending_tasks_are_strain():
+    adaptive = AdaptiveInterval(1, 1, 8)
+    assert intervals(adaptive, [(results(), 20), (results(), 30), (results(), 30), (results(), 5)]) == [1, 2, 1.5, 1.1]
+
+
+def test_min_interval_is_the_floor():
+    adaptive = AdaptiveInterval(1, 3, 8)
+    assert intervals(adaptive, [(results(error="refused"), 0), (results(), 0), (results(), 0)]) == [6, 4.5, 3.4]
+    assert intervals(adaptive, [(results(), 0)] * 2) == [3, 3]
+
+
+def test_max_below_the_base_interval_keeps_the_base():
+    adaptive = AdaptiveInterval(4, 1, 2)
+    assert intervals(adaptive, [(results(error="refused"), 0), (results(), 0)]) == [4, 4]
+
+
+@pytest.mark.parametrize('options', [['--max-interval', '2', '--', '4'], ['--min-interval', '5', '--max-interval', '3']])
+def test_max_interval_below_the_base_is_refused(options, monkeypatch, capsys):
+    monkeypatch.setattr(sys, 'argv', ['elasticstat', '--adaptive'] + options)
+    with pytest.raises(SystemExit) as exit_info:
+        elasticstat.main()
+    assert exit_info.value.code == 2
+    assert "--max-interval can't be shorter than DELAYINTERVAL or --min-interval" in capsys.readouterr().err
+
+
+class Client(object):
+    """Just enough of a client to set up requests with, which are never run"""
+
+    def __init__(self):
+        self.cluster = self.cat = self
+
+    def info(self):
+        return {'version': {'number': '7.10.2'}}
+
+    def health(self):
+        return {}
+
+
+def fetch_timeouts(options, monkeypatch):
+    """The fetcher timeout of updates polled at 1s and then 4s"""
+    args = elasticstat.build_parser().parse_args(options + ['--adaptive', '-o', '/dev/null'])
+    stat = elasticstat.Elasticstat(args, 'es1:9200', es_client=Client())
+    stat.scheduler.tick()
+    timeouts = []
+    monkeypatch.setattr(stat.fetcher, 'fetch', lambda requests, deadline, background: timeouts.append(stat.fetcher.timeout) or {})
+    for interval in [1, 4]:
+        stat.interval = interval
+        stat.fetch_stats()
+    return timeouts
+
+
+def test_fetch_timeout_follows_the_interval_being_polled_at(monkeypatch):
+    assert fetch_timeouts([], monkeypatch) == [1, 4]
+    assert fetch_timeouts(['--timeout', '2.5'], monkeypatch) == [2.5, 2.5]
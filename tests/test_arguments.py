@@ -0,0 +1,29 @@
+import argparse
+
+import pytest
+
+from elasticstat import elasticstat
+
+
+@pytest.mark.parametrize('value', ['0', '-1', 'x', '1.5'])
+def test_delay_interval_must_be_positive(value):
+    with pytest.raises(argparse.ArgumentTypeError):
+        elasticstat.positive_int(value)
+
+
+@pytest.mark.parametrize('value', ['0', '-0.5', 'x', 'nan'])
+def test_adaptive_intervals_must_be_positive(value):
+    with pytest.raises(argparse.ArgumentTypeError):
+        elasticstat.positive_float(value)
+
+
+def test_intervals():
+    args = elasticstat.build_parser().parse_args(['--min-interval', '0.5', '--max-interval', '30', '--', '2'])
+    assert (args.delay_interval, args.min_interval, args.max_interval) == (2, 0.5, 30)
+    assert elasticstat.build_parser().parse_args([]).delay_interval == 1
+
+
+@pytest.mark.parametrize('options', [['--', '0'], ['--min-interval', '0'], ['--max-interval', '-1']])
+def test_zero_interval_is_refused(options, capsys):
+    with pytest.raises(SystemExit):
+        elasticstat.build_parser().parse_args(options)
@@ -0,0 +1,174 @@
+import os
+import threading
+import time
+
+import pytest
+from elasticsearch import ConnectionError
+
+from elasticstat import elasticstat
+
+
+class StubElasticstat(object):
+    """Stands in for a cluster's Elasticstat, failing to set up while its hostlist is listed in down, and not
+    answering while it is listed in hanging"""
+
+    down = set()
+    hanging = set()
+    answer = threading.Event()
+
+    def __init__(self, args, hostlist=None, standalone=True, name=None, es_version=None):
+        if hostlist in self.down:
+            raise ConnectionError('N/A', '<urllib3.connection.HTTPConnection object at 0x7f3c>: Failed to establish '
+                                  'a new connection: [Errno 111] Connection refused', None)
+        if hostlist in self.hanging:
+            self.answer.wait()
+        self.hostlist = hostlist
+        self.name = name
+        self.headings = 0
+        self.hot_indices = args.hot_indices
+
+    def get_node_fields(self):
+        return ['heap_used_percent']
+
+    def format_headings(self):
+        self.headings += 1
+        self.cluster_headings = "cluster"
+
+    def poll(self):
+        return ({}, {'type': 'cluster', 'cluster': self.hostlist}, [])
+
+    def colorize(self, msg, color):
+        return msg
+
+    def format_cluster(self, result, cluster_row):
+        return (cluster_row['cluster'] + " " + cluster_row['status'], None)
+
+    def format_nodes(self, results, node_rows):
+        return ["nodes of " + self.name]
+
+    def format_indices(self, result):
+        return ["indices of " + self.name]
+
+
+def build_monitor(monkeypatch, *options):
+    monkeypatch.setattr(elasticstat, 'Elasticstat', StubElasticstat)
+    args = elasticstat.build_parser().parse_args(['-f', 'jsonl', '-o', os.devnull] + list(options))
+    return elasticstat.ClusterMonitor(args, [('one', 'es1:9200'), ('two', 'es2:9200')])
+
+
+@pytest.fixture
+def monitor(monkeypatch):
+    StubElasticstat.down = set(['es2:9200'])
+    StubElasticstat.hanging = set()
+    return build_monitor(monkeypatch)
+
+
+def test_cluster_down_at_start_does_not_stop_the_others(monitor):
+    assert monitor.clusters['one'].hostlist == 'es1:9200'
+    assert monitor.clusters['two'] is None
+    assert monitor.poll('two', 100) is None
+    results, cluster_row, node_rows = monitor.error_tick('two', 100)
+    assert results is None and node_rows == []
+    assert cluster_row == {'type': 'cluster', 'time': 100, 'stale': True, 'age': None, 'cluster': 'two',
+                           'error': "ConnectionError: Failed to establish a new connection: [Errno 111] Connection refused"}
+
+
+def test_cluster_down_at_start_is_set_up_on_a_later_tick(monitor):
+    StubElasticstat.down = set()
+    monitor.reconnect()
+    assert monitor.poll('two', 100) == ({}, {'type': 'cluster', 'cluster': 'es2:9200'}, [])
+    stat = monitor.clusters['two']
+    assert stat.now == 100
+    assert stat.scheduler is monitor.scheduler
+    assert stat.headings == 1
+    assert 'two' not in monitor.errors
+
+
+def test_clusters_are_set_up_with_their_names(monitor):
+    assert monitor.clusters['one'].name == 'one'
+
+
+def test_cluster_which_does_not_answer_does_not_hold_up_the_others(monkeypatch):
+    StubElasticstat.down = set()
+    StubElasticstat.hanging = set(['es2:9200'])
+    StubElasticstat.answer.clear()
+    started = time.time()
+    monitor = build_monitor(monkeypatch, '--timeout', '0.2')
+    assert time.time() - started < 1
+    assert monitor.clusters['one'] is not None
+    assert monitor.clusters['two'] is None
+    assert monitor.error_tick('two', 100)[1]['error'] == "timed out after 0.2s"
+    monitor.reconnect(wait=False)
+    assert monitor.clusters['two'] is None
+    StubElasticstat.answer.set()
+    while monitor.clusters['two'] is None:
+        assert time.time() - started < 5
+        time.sleep(0.01)
+        monitor.reconnect(wait=False)
+    assert monitor.clusters['two'].hostlist == 'es2:9200'
+
+
+def test_errors_other_than_connecting_are_raised(monkeypatch):
+    StubElasticstat.down = set()
+    StubElasticstat.hanging = set()
+    monkeypatch.setattr(StubElasticstat, 'get_node_fields', None)
+    monkeypatch.setattr(StubElasticstat, 'format_headings', lambda self: 1 / 0)
+    with pytest.raises(ZeroDivisionError):
+        build_monitor(monkeypatch)
+
+
+@pytest.mark.parametrize('options', [['--sort', 'disk', '-c', 'jvm'], ['--capture', 'no_such_field>1'],
+                                     ['--rollup', '-c', 'fielddata']])
+def test_options_are_checked_before_any_cluster_is_reached(options):
+    args = elasticstat.build_parser().parse_args(['-f', 'jsonl', '-o', os.devnull] + options)
+    with pytest.raises(elasticstat.argparse.ArgumentTypeError):
+        elasticstat.ClusterMonitor(args, [('one', 'http://localhost:1'), ('two', 'http://localhost:2')])
+
+
+@pytest.mark.parametrize('pool', ['index', 'write'])
+def test_options_are_checked_against_thread_pools_before_and_after_7(pool):
+    args = elasticstat.build_parser().parse_args(['--discovery-ttl', '0', '-f', 'jsonl', '-o', os.devnull,
+                                                  '-t', pool, '--sort', 'queue:' + pool])
+    monitor = elasticstat.ClusterMonitor(args, [('one', 'http://localhost:1'), ('two', 'http://localhost:2')])
+    assert monitor.errors['one'] is not None
+
+
+class Frames(object):
+    def write_frame(self, lines):
+        self.lines = lines
+
+
+@pytest.mark.parametrize('options, shown', [
+    ([], ['', 'two', 'nodes of two']),
+    (['--hot-indices', '3'], ['', 'one', 'indices of one', '', 'two', 'nodes of two', 'indices of two']),
+])
+def test_table_shows_nodes_of_clusters_which_are_not_green_and_hot_indices_of_each(monkeypatch, options, shown):
+    StubElasticstat.down = set()
+    StubElasticstat.hanging = set()
+    monitor = build_monitor(monkeypatch, *options)
+    monitor.format_headings()
+    monitor.frames = Frames()
+    results = {'cluster_health': None, 'index_stats': None}
+    monitor.print_table([(results, {'cluster': 'es1', 'status': 'green'}, []),
+                         (results, {'cluster': 'es2', 'status': 'yellow'}, [])])
+    assert monitor.frames.lines == ['cluster', 'es1 green', 'es2 yellow'] + shown
+
+
+class InfoClient(object):
+    def info(self):
+        return {'version': {'number': '7.10.2'}}
+
+
+@pytest.mark.parametrize('name, identity', [('prod-eu', 'prod-eu'), (None, 'es-cluster-7')])
+def test_cluster_is_identified_by_its_configured_name(name, identity):
+    args = elasticstat.build_parser().parse_args(['-C', '-o', os.devnull])
+    stat = elasticstat.Elasticstat(args, 'es1:9200', es_client=InfoClient(), name=name)
+    stat.format_headings()
+    stat.now = stat.period = 1
+    health = {'cluster_name': 'es-cluster-7', 'status': 'green', 'active_shards': 1, 'active_primary_shards': 1,
+              'relocating_shards': 0, 'initializing_shards': 0, 'unassigned_shards': 0, 'number_of_pending_tasks': 0}
+    result = elasticstat.FetchResult(health, None, 0.01, 1, False)
+    cluster_row = stat.process_cluster(result)
+    assert cluster_row['cluster'] == identity
+    assert cluster_row['cluster_name'] == 'es-cluster-7'
+    assert stat.format_cluster(result, cluster_row)[0].startswith(identity + ' ')
@@ -0,0 +1,42 @@
+from elasticstat.elasticstat import CounterRates, Rate
+
+
+def test_first_sample_has_no_rates():
+    rates = CounterRates()
+    assert rates.update('n1', 1000, {'index_total': 10}) == {}
+
+
+def test_rates_use_node_timestamps():
+    rates = CounterRates()
+    rates.update('n1', 1000, {'index_total': 10})
+    assert rates.update('n1', 3000, {'index_total': 30}) == {'index_total': Rate(20, 10.0)}
+
+
+def test_counter_reset_counts_from_zero():
+    rates = CounterRates()
+    rates.update('n1', 1000, {'index_total': 500})
+    # the node restarted keeping its node id, so its counters start again from zero
+    assert rates.update('n1', 2000, {'index_total': 40}) == {'index_total': Rate(40, 40.0)}
+    assert rates.update('n1', 3000, {'index_total': 50}) == {'index_total': Rate(10, 10.0)}
+
+
+def test_stale_sample_keeps_last_rates():
+    rates = CounterRates()
+    rates.update('n1', 1000, {'index_total': 10})
+    last = rates.update('n1', 2000, {'index_total': 20})
+    assert rates.update('n1', 2000, {'index_total': 20}) is last
+    assert rates.update('n1', 1500, {'index_total': 15}) is last
+
+
+def test_counter_new_in_sample_is_skipped():
+    rates = CounterRates()
+    rates.update('n1', 1000, {'index_total': 10})
+    assert rates.update('n1', 2000, {'index_total': 20, 'search_total': 5}) == {'index_total': Rate(10, 10.0)}
+
+
+def test_forget():
+    rates = CounterRates()
+    rates.update('n1', 1000, {'index_total': 10})
+    rates.forget('n1')
+    assert rates.update('n1', 2000, {'index_total': 20}) == {}
+    rates.forget('unknown')
@@ -0,0 +1,79 @@
+import threading
+import time
+
+from elasticstat.elasticstat import ESFetcher, monotonic
+
+
+class Request(object):
+    """A request which counts its calls and returns its answer, or raises it if it is an exception, once let go"""
+
+    def __init__(self, answer, go=True):
+        self.answer = answer
+        self.calls = 0
+        self.go = threading.Event()
+        if go:
+            self.go.set()
+
+    def __call__(self):
+        self.calls += 1
+        self.go.wait(5)
+        if isinstance(self.answer, Exception):
+            raise self.answer
+        return self.answer
+
+
+def test_requests_run_concurrently():
+    fetcher = ESFetcher(5)
+
+    def slow(answer):
+        return lambda: time.sleep(0.2) or answer
+    started = monotonic()
+    results = fetcher.fetch([('one', slow(1)), ('two', slow(2)), ('three', slow(3))])
+    assert monotonic() - started < 0.5
+    assert dict((name, result.response) for name, result in results.items()) == {'one': 1, 'two': 2, 'three': 3}
+    assert not any(result.stale or result.error for result in results.values())
+
+
+def test_slow_request_times_out_and_is_not_issued_again_until_it_finishes():
+    fetcher = ESFetcher(0.1)
+    request = Request('late', go=False)
+    result = fetcher.fetch([('health', request)])['health']
+    assert (result.response, result.error, result.stale) == (None, "timed out after 0.1s", True)
+    fetcher.fetch([('health', request)])
+    assert request.calls == 1
+    request.go.set()
+    time.sleep(0.1)
+    result = fetcher.fetch([('health', request)])['health']
+    assert (result.response, result.stale) == ('late', False)
+    assert request.calls == 2  # issued again once it had finished
+
+
+def test_deadline_before_the_timeout_is_kept():
+    fetcher = ESFetcher(5)
+    started = monotonic()
+    result = fetcher.fetch([('health', Request(None, go=False))], deadline=monotonic() + 0.1)['health']
+    assert monotonic() - started < 1
+    assert result.stale
+
+
+def test_error_returns_the_last_good_response_flagged_stale():
+    fetcher = ESFetcher(1)
+    first = fetcher.fetch([('health', Request({'status': 'green'}))])['health']
+    error = ValueError("refused")
+    result = fetcher.fetch([('health', Request(error))])['health']
+    assert (result.response, result.error, result.stale) == ({'status': 'green'}, error, True)
+    assert result.fetched_at == first.fetched_at
+    result = fetcher.fetch([('master', Request(error))])['master']
+    assert (result.response, result.error, result.stale) == (None, error, True)  # nothing good to fall back on
+
+
+def test_background_requests_are_not_waited_for():
+    fetcher = ESFetcher(5)
+    info = Request('7.10.2', go=False)
+    started = monotonic()
+    results = fetcher.fetch([('health', Request('green')), ('info', info)], background=['info'])
+    assert monotonic() - started < 1
+    assert results['health'].response == 'green' and results['info'].stale
+    info.go.set()
+    time.sleep(0.1)
+    assert fetcher.fetch([('info', info)], background=['info'])['info'].response == '7.10.2'
@@ -0,0 +1,49 @@
+from elasticstat.elasticstat import FrameWriter, InPlaceFrameWriter
+
+
+class Out(object):
+    """An output which keeps each write, and counts flushes"""
+
+    def __init__(self):
+        self.writes = []
+        self.flushes = 0
+
+    def write(self, data):
+        self.writes.append(data)
+
+    def flush(self):
+        self.flushes += 1
+
+
+def test_frame_is_one_write_followed_by_a_blank_line():
+    out = Out()
+    FrameWriter(out).write_frame(["heading", "row 1", "row 2"])
+    assert out.writes == ["heading\nrow 1\nrow 2\n\n"]
+    assert out.flushes == 1
+
+
+def test_first_frame_clears_the_screen_and_draws_every_line():
+    out = Out()
+    InPlaceFrameWriter(out).write_frame(["heading", "row 1"])
+    assert out.writes == ["\033[H\033[2J\033[1;1Hheading\033[K\033[2;1Hrow 1\033[K\033[3;1H"]
+    assert out.flushes == 1
+
+
+def test_later_frames_redraw_only_the_lines_which_changed():
+    out = Out()
+    writer = InPlaceFrameWriter(out)
+    writer.write_frame(["heading", "row 1", "row 2"])
+    writer.write_frame(["heading", "row 1", "row 2 changed", "row 3"])
+    assert out.writes[1] == "\033[3;1Hrow 2 changed\033[K\033[4;1Hrow 3\033[K\033[5;1H"
+    writer.write_frame(["heading", "row 1", "row 2 changed", "row 3"])
+    assert out.writes[2] == "\033[5;1H"  # nothing to redraw
+
+
+def test_lines_no_longer_used_are_cleared():
+    out = Out()
+    writer = InPlaceFrameWriter(out)
+    writer.write_frame(["heading", "row 1", "row 2"])
+    writer.write_frame(["heading"])
+    assert out.writes[1] == "\033[2;1H\033[J\033[2;1H"
+    writer.write_frame(["heading", "row 1"])
+    assert out.writes[2] == "\033[2;1Hrow 1\033[K\033[3;1H"
@@ -0,0 +1,115 @@
+import os
+
+from elasticstat import elasticstat
+
+
+class Client(object):
+    """A cluster whose indices have one shard with a copy on each of two nodes, counting the requests made of it
+
+    busy maps an index to its documents indexed per update; the primary of every index is on n1.
+    """
+
+    def __init__(self, busy):
+        self.cluster = self.cat = self.nodes = self.indices = self
+        self.busy = busy
+        self.updates = 0
+        self.version = 1
+        self.requests = []
+
+    def info(self):
+        return {'version': {'number': '7.10.2'}}
+
+    def health(self):
+        return {}
+
+    def master(self, **params):
+        return "n1"
+
+    def total(self, index):
+        return self.busy[index] * self.updates
+
+    def state(self, metric, index=None, **params):
+        self.requests.append((metric, index))
+        response = {'version': self.version}
+        if 'routing_table' in metric:
+            response['routing_table'] = {'indices': dict(
+                (name, {'shards': {'0': [{'node': 'n1', 'primary': True}, {'node': 'n2', 'primary': False},
+                                         {'node': None, 'primary': False}]}})  # an unassigned copy
+                for name in index.split(','))}
+        return response
+
+    def stats(self, index=None, level='indices', **params):
+        if level == 'indices':
+            return {'indices': dict((name, {'total': {'indexing': {'index_total': self.total(name)},
+                                                      'search': {'query_total': 0},
+                                                      'merges': {'current': 0}}}) for name in self.busy)}
+        self.requests.append(('shards', index))
+        return {'indices': dict((name, {'shards': {'0': [
+            {'routing': {'node': node}, 'indexing': {'index_total': self.total(name)}, 'search': {'query_total': 0}}
+            for node in ['n1', 'n2']]}}) for name in index.split(','))}
+
+
+def build(client, hot=1):
+    args = elasticstat.build_parser().parse_args(['--hot-indices', str(hot), '-o', os.devnull])
+    return elasticstat.Elasticstat(args, 'es1:9200', es_client=client)
+
+
+def update(stat, client):
+    """Run an update, returning the requests for shard placement and stats made and the hot index rows"""
+    client.updates += 1
+    client.requests = []
+    stat.scheduler.tick()
+    rows = stat.process_indices(stat.fetch_stats())
+    return sorted(client.requests), rows
+
+
+def shards(row):
+    return [(shard['shard'], shard['primary'], shard['node_id']) for shard in row['shards']]
+
+
+def test_placement_is_fetched_again_only_when_the_cluster_state_changes():
+    client = Client({'logs': 10})
+    stat = build(client)
+    assert update(stat, client) == ([('version', None)], [])  # no index has a rate yet, so none is hot
+    requests, rows = update(stat, client)
+    assert requests == [('shards', 'logs'), ('version', None), ('version,routing_table', 'logs')]
+    assert shards(rows[0]) == [(0, True, 'n1'), (0, False, 'n2')]
+    requests, rows = update(stat, client)
+    assert requests == [('shards', 'logs'), ('version', None)]
+    assert shards(rows[0]) == [(0, True, 'n1'), (0, False, 'n2')]
+    client.version = 2  # e.g. a shard relocated
+    requests, rows = update(stat, client)
+    assert requests == [('shards', 'logs'), ('version', None), ('version,routing_table', 'logs')]
+
+
+def test_index_which_becomes_hot_shows_its_shards_at_once():
+    client = Client({'logs': 10})
+    stat = build(client)
+    update(stat, client)
+    client.busy['metrics'] = 1000  # a new index, with no rate until the update after
+    update(stat, client)
+    requests, rows = update(stat, client)
+    assert [row['index'] for row in rows] == ['metrics']
+    assert ('version,routing_table', 'metrics') in requests
+    assert requests.count(('shards', 'metrics')) == 1
+    assert shards(rows[0]) == [(0, True, 'n1'), (0, False, 'n2')]
+    assert [shard['index_rate'] for shard in rows[0]['shards']] == [None, None]  # first sample of its shards
+
+
+def test_shard_copies_have_their_own_rates():
+    client = Client({'logs': 10})
+    stat = build(client)
+    for _ in range(3):
+        requests, rows = update(stat, client)
+    assert rows[0]['index_rate'] > 0
+    assert all(shard['index_rate'] > 0 and shard['search_rate'] == 0 for shard in rows[0]['shards'])
+
+
+def test_key_given_a_freed_slot_starts_without_a_rate():
+    counters = elasticstat.CounterArrays(['index_total'])
+    counters.update({'a': [10]}, 1)
+    counters.update({'b': [20]}, 2)
+    assert counters.slots == {'b': 0}
+    assert counters.get('b', 'index_total') is None
+    counters.update({'b': [30]}, 3)
+    assert counters.get('b', 'index_total') == 10
@@ -0,0 +1,88 @@
+import argparse
+import os
+import Queue
+import sys
+import time
+
+import pytest
+
+from elasticstat import elasticstat
+from elasticstat.elasticstat import HotThreadsCapture, capture_directory
+
+
+class NodesClient(object):
+    """Just the hot threads and task list of a client"""
+
+    def __init__(self):
+        self.nodes = self
+        self.tasks = self
+
+    def hot_threads(self, node_id):
+        return "::: {{{0}}}\n".format(node_id)
+
+    def list(self, nodes, detailed):
+        return {'nodes': {}}
+
+
+def wait_for(condition):
+    deadline = time.time() + 5
+    while not condition():
+        assert time.time() < deadline
+        time.sleep(0.01)
+
+
+def test_capture_dir_is_created(tmpdir):
+    directory = str(tmpdir.join('captures', 'hot'))
+    assert capture_directory(directory) == directory
+    assert os.path.isdir(directory)
+    assert capture_directory(directory) == directory
+
+
+def test_capture_dir_which_cannot_be_created(tmpdir):
+    tmpdir.join('file').write('')
+    with pytest.raises(argparse.ArgumentTypeError):
+        capture_directory(str(tmpdir.join('file', 'hot')))
+
+
+def test_capture_writes_hot_threads_and_tasks(tmpdir):
+    capture = HotThreadsCapture(NodesClient(), str(tmpdir), 60)
+    capture.capture({'n1': 'search_queue>50'}, 'prod', 1600000000.5)
+    wait_for(lambda: len(tmpdir.listdir()) == 2)
+    hot_threads = [path for path in tmpdir.listdir() if path.basename.endswith('-hot_threads.txt')][0]
+    assert hot_threads.basename.startswith('prod-')
+    assert hot_threads.read() == "# n1: search_queue>50\n::: {n1}\n"
+    assert capture.summary() is None
+
+
+def test_failed_captures_are_counted(tmpdir):
+    directory = tmpdir.join('gone')
+    capture = HotThreadsCapture(NodesClient(), str(directory), 0)
+    capture.capture({'n1': 'search_queue>50'}, 'prod', 1)
+    capture.capture({'n1': 'search_queue>50'}, 'prod', 2)
+    wait_for(lambda: capture.failed == 2)
+    assert capture.worker.is_alive()
+    assert capture.summary() == "captures 2 failed: No such file or directory"
+
+
+def test_captures_beyond_the_queue_are_dropped(tmpdir):
+    capture = HotThreadsCapture(NodesClient(), str(tmpdir), 60, max_queued=1)
+    capture.queue = Queue.Queue(1)  # a full queue the worker is not taking from
+    capture.queue.put(None)
+    capture.capture({'n1': 'heap_used_percent>90'}, 'prod', 1)
+    assert capture.dropped == 1
+    assert capture.summary() == "captures 1 dropped"
+
+
+class InfoClient(object):
+    def info(self):
+        return {'version': {'number': '7.10.2'}}
+
+
+def test_capture_on_a_field_not_shown_is_reported_as_a_usage_error(monkeypatch, capsys, tmpdir):
+    monkeypatch.setattr(elasticstat.Elasticstat, '_build_client', lambda self, hostlist, args: InfoClient())
+    monkeypatch.setattr(sys, 'argv', ['elasticstat', '--discovery-ttl', '0', '-o', os.devnull, '-c', 'os',
+                                      '--capture-dir', str(tmpdir), '--capture', 'heap_used_percent>90'])
+    with pytest.raises(SystemExit) as exit_info:
+        elasticstat.main()
+    assert exit_info.value.code == 2
+    assert "error: heap_used_percent is not valid, please capture on one of" in capsys.readouterr().err
@@ -0,0 +1,75 @@
+# -*- coding: utf-8 -*-
+import urllib2
+
+import pytest
+
+from elasticstat.elasticstat import MetricsServer, MetricsWriter
+
+CLUSTER_ROW = {'type': 'cluster', 'cluster': 'prod', 'time': 1600000000.5, 'stale': False, 'status': 'yellow',
+               'active_shards': 10, 'error': None, 'cluster_name': 'prod'}
+NODE_ROWS = [{'type': 'node', 'cluster': 'prod', 'name': u'n\xf8de "1"', 'node_id': 'n1', 'role': 'DATA', 'time': 1,
+              'missing': False, 'stale': True, 'new': False, 'heap_used_percent': 42, 'load': None},
+             {'type': 'node', 'cluster': 'prod', 'name': 'gone', 'node_id': 'n2', 'role': 'MST', 'time': 1,
+              'missing': True, 'stale': False, 'new': False}]
+
+
+def rendered(ticks):
+    metrics = MetricsWriter()
+    metrics.write_ticks(ticks)
+    return metrics.page.splitlines()
+
+
+def test_nothing_rendered_yet():
+    assert MetricsWriter().page == "# no data received yet\n"
+
+
+def test_cluster_row_becomes_gauges():
+    page = rendered([(CLUSTER_ROW, [])])
+    assert 'elasticstat_last_update_timestamp_seconds{cluster="prod"} 1600000000.5' in page
+    assert 'elasticstat_cluster_stale{cluster="prod"} 0.0' in page
+    assert 'elasticstat_cluster_status{cluster="prod",status="yellow"} 1.0' in page
+    assert 'elasticstat_cluster_status{cluster="prod",status="green"} 0.0' in page
+    assert 'elasticstat_cluster_active_shards{cluster="prod"} 10.0' in page
+    assert not any(line.startswith('elasticstat_cluster_time') or 'cluster_name' in line for line in page)
+
+
+def test_node_rows_become_gauges_with_escaped_labels():
+    page = rendered([(CLUSTER_ROW, NODE_ROWS)])
+    labels = '{cluster="prod",node="n\xc3\xb8de \\"1\\"",node_id="n1",role="DATA"}'
+    assert 'elasticstat_node_heap_used_percent' + labels + ' 42.0' in page
+    assert 'elasticstat_node_up' + labels + ' 1.0' in page
+    assert 'elasticstat_node_stale' + labels + ' 1.0' in page
+    assert 'elasticstat_node_up{cluster="prod",node="gone",node_id="n2",role="MST"} 0.0' in page
+    assert not any(line.startswith(('elasticstat_node_load', 'elasticstat_node_missing', 'elasticstat_node_new'))
+                   for line in page)
+
+
+def test_each_metric_is_typed_once_across_clusters():
+    other = dict(CLUSTER_ROW, cluster='test')
+    page = rendered([(CLUSTER_ROW, NODE_ROWS), (other, [])])
+    assert page.count('# TYPE elasticstat_cluster_active_shards gauge') == 1
+    typed = page.index('# TYPE elasticstat_cluster_active_shards gauge')
+    assert page[typed + 1:typed + 3] == ['elasticstat_cluster_active_shards{cluster="prod"} 10.0',
+                                         'elasticstat_cluster_active_shards{cluster="test"} 10.0']
+
+
+@pytest.fixture
+def server():
+    metrics = MetricsWriter()
+    server = MetricsServer(('127.0.0.1', 0), metrics)
+    server.start()
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+def test_server_serves_the_last_page_rendered(server):
+    url = 'http://127.0.0.1:{0}'.format(server.server_address[1])
+    assert urllib2.urlopen(url + '/metrics').read() == "# no data received yet\n"
+    server.metrics.write_ticks([(CLUSTER_ROW, [])])
+    response = urllib2.urlopen(url + '/metrics?name[]=x')
+    assert response.info()['Content-Type'] == 'text/plain; version=0.0.4; charset=utf-8'
+    assert response.read() == server.metrics.page
+    with pytest.raises(urllib2.HTTPError) as error:
+        urllib2.urlopen(url + '/')
+    assert error.value.code == 404
@@ -0,0 +1,66 @@
+from elasticstat.elasticstat import FetchResult, NodeFanOut
+
+
+def node_list(*node_ids):
+    return {'nodes': dict((node_id, {'name': node_id}) for node_id in node_ids)}
+
+
+def fresh(fetched_at, *node_ids):
+    return FetchResult({'nodes': dict((node_id, {'at': fetched_at}) for node_id in node_ids)}, None, 0.1, fetched_at, False)
+
+
+def stale(error="timed out after 1s"):
+    return FetchResult(None, error, None, None, True)
+
+
+def fan_out(batch_size, *node_ids):
+    fan_out = NodeFanOut(batch_size)
+    fan_out.update_node_ids(node_list(*node_ids))
+    return fan_out
+
+
+def test_nodes_are_requested_in_batches():
+    requests = fan_out(2, 'c', 'a', 'b').requests(lambda node_ids: node_ids)
+    assert requests == [('nodes_stats/0', ['a', 'b']), ('nodes_stats/1', ['c'])]
+
+
+def test_batches_merge_into_one_result():
+    nodes = fan_out(2, 'a', 'b', 'c')
+    nodes.requests(lambda node_ids: None)
+    results = {'nodes_stats/0': fresh(10, 'a', 'b'), 'nodes_stats/1': fresh(11, 'c'), 'cluster_health': stale()}
+    merged, stale_nodes = nodes.merge(results)
+    assert sorted(merged.response['nodes']) == ['a', 'b', 'c']
+    assert (merged.error, merged.fetched_at, merged.stale, stale_nodes) == (None, 11, False, {})
+    assert list(results) == ['cluster_health']  # the batch results are taken out
+
+
+def test_late_batch_keeps_its_nodes_last_stats_flagged_stale():
+    nodes = fan_out(2, 'a', 'b', 'c')
+    nodes.requests(lambda node_ids: None)
+    nodes.merge({'nodes_stats/0': fresh(10, 'a', 'b'), 'nodes_stats/1': fresh(10, 'c')})
+    nodes.requests(lambda node_ids: None)
+    merged, stale_nodes = nodes.merge({'nodes_stats/0': stale(), 'nodes_stats/1': fresh(11, 'c')})
+    assert merged.response['nodes'] == {'a': {'at': 10}, 'b': {'at': 10}, 'c': {'at': 11}}
+    assert stale_nodes == {'a': 10, 'b': 10}
+    assert merged.error == "1 of 2 batches: timed out after 1s"
+    assert not merged.stale
+
+
+def test_every_batch_late_is_a_stale_result():
+    nodes = fan_out(2, 'a', 'b')
+    nodes.requests(lambda node_ids: None)
+    merged, stale_nodes = nodes.merge({'nodes_stats/0': stale()})
+    assert (merged.response, merged.stale) == (None, True)  # nothing received yet
+    nodes.merge({'nodes_stats/0': fresh(10, 'a', 'b')})
+    merged, stale_nodes = nodes.merge({'nodes_stats/0': stale()})
+    assert (merged.response, merged.fetched_at, merged.stale) == ({'nodes': {'a': {'at': 10}, 'b': {'at': 10}}}, 10, True)
+
+
+def test_nodes_which_leave_are_forgotten():
+    nodes = fan_out(2, 'a', 'b')
+    nodes.requests(lambda node_ids: None)
+    nodes.merge({'nodes_stats/0': fresh(10, 'a', 'b')})
+    nodes.update_node_ids(node_list('a', 'd'))
+    assert nodes.requests(lambda node_ids: node_ids) == [('nodes_stats/0', ['a', 'd'])]
+    merged, stale_nodes = nodes.merge({'nodes_stats/0': stale()})
+    assert merged.response['nodes'] == {'a': {'at': 10}}
@@ -0,0 +1,59 @@
+from elasticstat.elasticstat import NodeRegistry
+
+
+def stats(*names):
+    return dict(('id-' + name, {'name': name}) for name in names)
+
+
+def test_first_update_has_no_new_nodes():
+    registry = NodeRegistry()
+    registry.update(stats('a', 'b'), lambda node_id: 'DATA')
+    assert registry.new_nodes == set()
+    assert sorted(registry.by_id) == ['id-a', 'id-b']
+    assert set(registry.by_role['DATA']) == set(['id-a', 'id-b'])
+
+
+def test_joining_node_is_new():
+    registry = NodeRegistry()
+    registry.update(stats('a'), lambda node_id: 'DATA')
+    registry.update(stats('a', 'b'), lambda node_id: 'DATA')
+    assert registry.new_nodes == set(['id-b'])
+
+
+def test_left_node_is_kept_but_not_present():
+    registry = NodeRegistry()
+    registry.update(stats('a', 'b'), lambda node_id: 'DATA')
+    registry.update(stats('a'), lambda node_id: 'DATA')
+    assert not registry.is_present(registry.by_id['id-b'])
+    assert registry.is_present(registry.by_id['id-a'])
+
+
+def test_rejoin_under_new_node_id_replaces_old_record():
+    registry = NodeRegistry()
+    registry.update(stats('a', 'b'), lambda node_id: 'DATA')
+    registry.update(stats('a'), lambda node_id: 'DATA')
+    nodes = stats('a')
+    nodes['id-b2'] = {'name': 'b'}
+    registry.update(nodes, lambda node_id: 'DATA')
+    assert registry.rejoined == {'id-b2': 'id-b'}
+    assert 'id-b' not in registry.by_id
+    assert registry.by_name['b'].node_id == 'id-b2'
+    assert 'id-b' not in registry.by_role['DATA']
+
+
+def test_same_name_while_old_node_still_present_is_not_a_rejoin():
+    registry = NodeRegistry()
+    registry.update(stats('a'), lambda node_id: 'DATA')
+    nodes = stats('a')
+    nodes['id-a2'] = {'name': 'a'}
+    registry.update(nodes, lambda node_id: 'DATA')
+    assert registry.rejoined == {}
+    assert set(registry.by_id) == set(['id-a', 'id-a2'])
+
+
+def test_role_change_moves_node():
+    registry = NodeRegistry()
+    registry.update(stats('a'), lambda node_id: 'DATA')
+    registry.update(stats('a'), lambda node_id: 'MST')
+    assert 'DATA' not in registry.by_role
+    assert list(registry.by_role['MST']) == ['id-a']
@@ -0,0 +1,129 @@
+# -*- coding: utf-8 -*-
+import io
+import json
+import os
+
+import pytest
+from elasticsearch.exceptions import SerializationError
+
+from elasticstat import elasticstat
+from elasticstat.elasticstat import NodeStatsDecoder, NodeStatsSerializer
+
+DATA = os.path.join(os.path.dirname(__file__), 'data')
+PAYLOADS = {'5': 'nodes_stats_es5.json', '7': 'nodes_stats_es7.json'}
+VERSIONS = {'5': '5.6.16', '7': '7.10.2'}
+FIELD_SETS = [
+    # whole objects and metric groups kept whole
+    ['name', 'os.cpu.load_average', 'os.load_average', 'breakers', 'thread_pool'],
+    # wildcards, alone and alongside keys named at the same level
+    ['jvm.gc.collectors.*.collection_count', 'jvm.gc.collectors.old.collection_time_in_millis', 'breakers.*.tripped',
+     'thread_pool.*', 'ingest.pipelines.*.count', 'nodes.*.name'],
+    # paths through sections missing on some nodes, or which are not objects there
+    ['fs.total.total_in_bytes', 'jvm.mem.pools.old.used_in_bytes', 'os.mem.used_percent', 'http.current_open',
+     'thread_pool.write.queue', 'no.such.section'],
+    [],
+]
+
+
+class InfoClient(object):
+    """Just enough of a client for Elasticstat to lay itself out"""
+
+    def __init__(self, es_version):
+        self.es_version = es_version
+
+    def info(self):
+        return {'version': {'number': self.es_version}}
+
+
+def payload(es_version):
+    with io.open(os.path.join(DATA, PAYLOADS[es_version]), encoding='utf-8') as payload_file:
+        return payload_file.read()
+
+
+def elasticstat_decoder(es_version, options):
+    args = elasticstat.build_parser().parse_args(options + ['-o', os.devnull])
+    args.hostlist = 'test'
+    return elasticstat.Elasticstat(args, es_client=InfoClient(VERSIONS[es_version])).node_decoder
+
+
+def assert_decodes_as_projected(decoder, s):
+    decoded = decoder.decode(s)
+    assert decoded == decoder.project(json.loads(s))
+    return decoded
+
+
+@pytest.mark.parametrize('es_version', sorted(PAYLOADS))
+@pytest.mark.parametrize('fields', FIELD_SETS)
+def test_decode_matches_projected_json(es_version, fields):
+    assert_decodes_as_projected(NodeStatsDecoder(fields), payload(es_version))
+
+
+@pytest.mark.parametrize('es_version', sorted(PAYLOADS))
+@pytest.mark.parametrize('options', [['-c', 'all', '-C'], ['-c', 'general,jvm', '-t', 'search,get'], ['--window', '5']])
+def test_decode_matches_projected_json_for_elasticstat_fields(es_version, options):
+    decoded = assert_decodes_as_projected(elasticstat_decoder(es_version, options), payload(es_version))
+    assert len(decoded['nodes']) == len(json.loads(payload(es_version))['nodes'])
+
+
+@pytest.mark.parametrize('es_version', sorted(PAYLOADS))
+def test_decode_pretty_printed(es_version):
+    pretty = json.dumps(json.loads(payload(es_version)), indent=2, ensure_ascii=False)
+    decoder = elasticstat_decoder(es_version, ['-c', 'all', '-C'])
+    assert decoder.decode(u"\n " + pretty + u"\n") == decoder.decode(payload(es_version))
+
+
+def test_records_hold_the_wanted_fields():
+    decoder = NodeStatsDecoder(FIELD_SETS[1])
+    response = decoder.decode(payload('7'))
+    assert response['cluster_name'] == u'métriques'
+    assert response['_nodes'] == {'total': 3, 'successful': 3, 'failed': 0}
+    record = response['nodes']['hZ0zV3qUQ4G_v1Ls8fWc2A']
+    assert record['jvm.gc.collectors.young.collection_count'] == 91231
+    assert record['jvm.gc.collectors.old.collection_time_in_millis'] == 0
+    assert 'jvm.gc.collectors.young.collection_time_in_millis' not in record
+    assert record['breakers.parent.tripped'] == 3
+    assert record['thread_pool.write'] == {'threads': 16, 'queue': 81, 'active': 16, 'rejected': 8123, 'largest': 16,
+                                           'completed': 81231231}
+    assert record['ingest.pipelines.logs-été.count'.decode('utf-8')] == 8123123
+    assert response['nodes']['Qf8bN1rZRkOuPp5c3gX9wA'] == {}
+
+
+def test_unicode_names():
+    decoder = NodeStatsDecoder(['name', 'attributes.rack'])
+    nodes = decoder.decode(payload('7'))['nodes']
+    assert nodes['hZ0zV3qUQ4G_v1Ls8fWc2A'] == {'name': u'données-1', 'attributes.rack': u'salle été ☃'}
+    assert nodes['Ym4WcxwGTiWvTNGYhMr6Cw'] == {'name': u'coord-"1"'}
+    nodes = decoder.decode(payload('5'))['nodes']
+    assert nodes['mQ3p0RkUT8u2y9SJrXn4aw']['name'] == u'es-mäster-01'
+
+
+@pytest.mark.parametrize('s', [u'', u'[]', u'"nodes"', u'{"nodes": {"a": {}}', u'{"nodes": {}} {}', u'{"nodes" {}}'])
+def test_decode_rejects_what_is_not_one_object(s):
+    with pytest.raises((ValueError, IndexError, StopIteration)):
+        NodeStatsDecoder(['name']).decode(s)
+
+
+def test_response_without_node_objects_is_decoded_as_is():
+    decoder = NodeStatsDecoder(['name'])
+    assert decoder.decode(u'{"nodes": [1, 2], "error": null}') == {'nodes': [1, 2], 'error': None}
+    assert decoder.project([1, 2]) == [1, 2]
+    assert decoder.project({'nodes': None}) == {'nodes': None}
+
+
+def test_serializer_decodes_with_the_thread_decoder():
+    serializer = NodeStatsSerializer()
+    assert serializer.loads(payload('5')) == json.loads(payload('5'))
+    serializer.local.decoder = NodeStatsDecoder(['name'])
+    assert serializer.loads(payload('5'))['nodes']['V8xkT2nGQ3yUc1l0bQ1Z7g'] == {'name': u'es-data-01'}
+    assert serializer.loads(u'[1]') == [1]
+    with pytest.raises(SerializationError):
+        serializer.loads(u'{"nodes"')
+
+
+@pytest.mark.parametrize('es_version, streams', [('1.5.2', True), ('1.6.0', False), ('7.10.2', False)])
+def test_streams_only_where_the_server_ignores_filter_path(es_version, streams):
+    stat = elasticstat.Elasticstat(elasticstat.build_parser().parse_args(['-o', os.devnull]), es_client=InfoClient('7.10.2'))
+    assert not stat.streams_node_stats  # a client given to us decodes its responses itself
+    stat.decodes_node_stats = True
+    stat.update_version(es_version)
+    assert stat.streams_node_stats == streams
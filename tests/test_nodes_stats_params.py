@@ -0,0 +1,58 @@
+import os
+
+import pytest
+
+from elasticstat import elasticstat
+
+
+class InfoClient(object):
+    def info(self):
+        return {'version': {'number': '7.10.2'}}
+
+
+def params(options):
+    args = elasticstat.build_parser().parse_args(options + ['-o', os.devnull])
+    return elasticstat.Elasticstat(args, 'es1:9200', es_client=InfoClient()).nodes_stats_params
+
+
+def filter_path(options):
+    return params(options)['filter_path'].split(',')
+
+
+GENERAL = ['nodes.*.name', 'nodes.*.timestamp', 'nodes.*.roles', 'nodes.*.attributes', 'nodes.*.nodeRole']
+
+
+def test_only_the_metrics_of_the_categories_shown_are_asked_for():
+    assert params(['-c', 'jvm'])['metric'] == 'jvm'
+    assert 'index_metric' not in params(['-c', 'jvm'])
+    assert params(['-c', 'os,connections'])['metric'] == 'os,http,transport'
+
+
+def test_metrics_shared_by_categories_are_asked_for_once():
+    both = params(['-c', 'throughput,data_nodes'])
+    assert both['metric'] == 'indices,fs'
+    assert both['index_metric'] == 'indexing,search,get,merge,refresh,flush,store,docs'
+
+
+def test_general_alone_asks_for_no_metric_but_filters_to_its_fields():
+    only = params(['-c', 'general'])
+    assert 'metric' not in only
+    assert only['filter_path'].split(',') == GENERAL
+
+
+def test_filter_path_covers_the_fields_and_counters_of_the_categories_shown():
+    fields = filter_path(['-c', 'threads', '-t', 'search,write'])
+    assert fields[:len(GENERAL)] == GENERAL
+    assert sorted(fields[len(GENERAL):]) == sorted('nodes.*.thread_pool.{0}.{1}'.format(pool, stat)
+                                                   for pool in ['search', 'write']
+                                                   for stat in ['active', 'queue', 'rejected', 'completed'])
+    fields = filter_path(['-c', 'jvm'])
+    assert 'nodes.*.jvm.gc.collectors.young.collection_count' in fields  # a counter
+    assert len(fields) == len(set(fields))
+
+
+@pytest.mark.parametrize('category', elasticstat.CATEGORIES)
+def test_every_field_used_is_in_the_filter_path(category):
+    fields = filter_path(['-c', category])
+    stat_fields = [field for field in elasticstat.NODES_STATS_FIELDS[category] if '{pool}' not in field]
+    assert all('nodes.*.' + field in fields for field in stat_fields)
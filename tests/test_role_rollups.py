@@ -0,0 +1,79 @@
+import array
+import os
+import sys
+
+import pytest
+
+from elasticstat import elasticstat
+from elasticstat.elasticstat import RoleRollups, summarize_column
+
+
+@pytest.fixture(params=['numpy', 'python'])
+def vectorized(request, monkeypatch):
+    """Run with numpy, if it is installed, and without it"""
+    elasticstat.import_numpy()
+    if request.param == 'python':
+        monkeypatch.setattr(elasticstat, 'numpy', None)
+    elif elasticstat.numpy is None:
+        pytest.skip("numpy is not installed")
+    return request.param
+
+
+def rollups():
+    return RoleRollups([('heap', ['heap_used_percent']), ('queue', ['search_queue', 'write_queue'])])
+
+
+def node(node_id, role, heap, search_queue=None, write_queue=None, missing=False):
+    return {'node_id': node_id, 'role': role, 'missing': missing, 'heap_used_percent': heap,
+            'search_queue': search_queue, 'write_queue': write_queue}
+
+
+def test_summarize_column(vectorized):
+    rollup = summarize_column(array.array('d', [10, 20, 30, 60]))
+    assert rollup == elasticstat.Rollup(4, 120, 30, pytest.approx(18.708, abs=0.001), 25, 60, 2.4)
+    assert summarize_column(array.array('d')) is None
+    assert summarize_column(array.array('d', [0, 0])).skew is None
+
+
+def test_rollups_per_role(vectorized):
+    rolled = rollups().update([node('a', 'DATA', 50, 1, 2), node('b', 'MST', 10), node('c', 'DATA', 70, 3)], 1)
+    assert list(rolled) == ['DATA', 'MST']
+    nodes, data = rolled['DATA']
+    assert nodes == 2
+    assert (data['heap'].mean, data['heap'].max) == (60, 70)
+    assert data['queue'].total == 6
+    nodes, master = rolled['MST']
+    assert nodes == 1
+    assert master['queue'] is None  # no node of the role has a value
+
+
+def test_nodes_which_have_left_are_not_rolled_up(vectorized):
+    roles = rollups()
+    roles.update([node('a', 'DATA', 50), node('b', 'DATA', 90)], 1)
+    nodes, data = roles.update([node('a', 'DATA', 40), node('b', 'DATA', None, missing=True)], 2)['DATA']
+    assert nodes == 1
+    assert data['heap'].total == 40
+
+
+def test_slots_of_nodes_which_have_gone_are_reused(vectorized):
+    roles = rollups()
+    roles.update([node('a', 'DATA', 50), node('b', 'DATA', 90)], 1)
+    rolled = roles.update([node('a', 'DATA', 50), node('c', 'MST', 20)], 2)
+    assert len(roles.arrays.keys) == 2
+    assert rolled['MST'][1]['heap'].total == 20
+    assert rolled['DATA'][1]['heap'].total == 50
+
+
+class InfoClient(object):
+    def info(self):
+        return {'version': {'number': '7.10.2'}}
+
+
+def test_rollup_without_its_categories_is_reported_as_a_usage_error(monkeypatch, capsys):
+    monkeypatch.setattr(elasticstat.Elasticstat, '_build_client', lambda self, hostlist, args: InfoClient())
+    monkeypatch.setattr(sys, 'argv', ['elasticstat', '--discovery-ttl', '0', '-o', os.devnull, '--rollup',
+                                      '-c', 'fielddata'])
+    with pytest.raises(SystemExit) as exit_info:
+        elasticstat.main()
+    assert exit_info.value.code == 2
+    assert "error: --rollup needs one of the data_nodes, jvm, os, threads categories" in capsys.readouterr().err
@@ -0,0 +1,82 @@
+import os
+import sys
+
+import pytest
+
+from elasticstat import elasticstat
+from elasticstat.elasticstat import RollingWindows
+
+
+def windows(size=3):
+    return RollingWindows(size, [('heap', ['heap_used_percent']), ('queue', ['search_queue', 'write_queue'])],
+                          ['min', 'avg', 'max', 'p95'])
+
+
+def test_statistics_over_the_window():
+    rolling = windows()
+    rolling.update('n1', 1, {'heap_used_percent': 10, 'search_queue': 1, 'write_queue': 2})
+    statistics = rolling.update('n1', 2, {'heap_used_percent': 30, 'search_queue': 0, 'write_queue': 0})
+    assert statistics['heap_min'] == 10
+    assert statistics['heap_avg'] == 20
+    assert statistics['heap_max'] == 30
+    assert statistics['queue_max'] == 3
+
+
+def test_ring_overwrites_oldest_sample():
+    rolling = windows(size=2)
+    for timestamp, heap in enumerate([90, 10, 20]):
+        statistics = rolling.update('n1', timestamp, {'heap_used_percent': heap})
+    assert statistics['heap_max'] == 20
+    assert statistics['heap_min'] == 10
+    assert len(rolling.windows['n1'].samples) == 4  # size * metrics, however many updates
+
+
+def test_same_timestamp_is_sampled_once():
+    rolling = windows()
+    rolling.update('n1', 1, {'heap_used_percent': 10})
+    statistics = rolling.update('n1', 1, {'heap_used_percent': 10})
+    assert statistics['heap_avg'] == 10
+    assert rolling.windows['n1'].position == 1
+
+
+def test_missing_values_are_left_out():
+    rolling = windows()
+    statistics = rolling.update('n1', 1, {'heap_used_percent': None})
+    assert statistics['heap_avg'] is None
+    assert statistics['queue_max'] is None
+    statistics = rolling.update('n1', 2, {'heap_used_percent': 40})
+    assert statistics['heap_min'] == 40
+
+
+def test_forget():
+    rolling = windows()
+    rolling.update('n1', 1, {'heap_used_percent': 10})
+    rolling.forget('n1')
+    assert 'n1' not in rolling.windows
+
+
+def test_window_options():
+    args = elasticstat.build_parser().parse_args(['--window', '5', '--window-stats', 'max,p95'])
+    assert (args.window, args.window_stats) == (5, ['max', 'p95'])
+    assert elasticstat.build_parser().parse_args([]).window_stats == ['min', 'avg', 'max', 'p95']
+
+
+@pytest.mark.parametrize('options', [['--window', '0'], ['--window', 'x'], ['--window-stats', 'max,p99']])
+def test_bad_window_options_are_refused(options):
+    with pytest.raises(SystemExit):
+        elasticstat.build_parser().parse_args(options)
+
+
+class InfoClient(object):
+    def info(self):
+        return {'version': {'number': '7.10.2'}}
+
+
+def test_window_without_its_categories_is_reported_as_a_usage_error(monkeypatch, capsys):
+    monkeypatch.setattr(elasticstat.Elasticstat, '_build_client', lambda self, hostlist, args: InfoClient())
+    monkeypatch.setattr(sys, 'argv', ['elasticstat', '--discovery-ttl', '0', '-o', os.devnull, '--window', '5',
+                                      '-c', 'fielddata'])
+    with pytest.raises(SystemExit) as exit_info:
+        elasticstat.main()
+    assert exit_info.value.code == 2
+    assert "error: --window needs one of the data_nodes, jvm, os, threads categories" in capsys.readouterr().err
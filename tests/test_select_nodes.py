@@ -0,0 +1,73 @@
+import os
+import sys
+
+import pytest
+
+from elasticstat import elasticstat
+
+
+class InfoClient(object):
+    def info(self):
+        return {'version': {'number': '7.10.2'}}
+
+
+def build(options):
+    args = elasticstat.build_parser().parse_args(options + ['-o', os.devnull])
+    return elasticstat.Elasticstat(args, 'es1:9200', es_client=InfoClient())
+
+
+def node(name, heap, role='DATA', missing=False, **values):
+    row = {'name': name, 'role': role, 'missing': missing, 'heap_used_percent': heap, 'search_queue': 0,
+           'write_queue': 0}
+    row.update(values)
+    return row
+
+
+NODES = [node('es1', 40), node('es2', 90), node('es3', None), node('es4', 70, role='MST'), node('es5', 10)]
+
+
+def names(rows):
+    return [row['name'] for row in rows]
+
+
+def test_no_sort_or_filter_shows_every_node_in_order():
+    assert names(build([]).select_nodes(NODES)) == ['es1', 'es2', 'es3', 'es4', 'es5']
+
+
+def test_sort_puts_the_worst_first_and_a_missing_value_last():
+    assert names(build(['--sort', 'heap']).select_nodes(NODES)) == ['es2', 'es4', 'es1', 'es5', 'es3']
+
+
+def test_top_defaults_to_sorting_by_heap():
+    assert names(build(['--top', '2']).select_nodes(NODES)) == ['es2', 'es4']
+
+
+def test_a_node_which_has_left_ranks_worst():
+    rows = NODES + [node('gone', None, missing=True)]
+    assert names(build(['--top', '2']).select_nodes(rows)) == ['gone', 'es2']
+
+
+def test_queue_sums_the_threadpools_shown_or_only_the_one_given():
+    rows = [node('es1', 0, search_queue=5, write_queue=1), node('es2', 0, search_queue=1, write_queue=7)]
+    assert names(build(['-t', 'search,write', '--sort', 'queue']).select_nodes(rows)) == ['es2', 'es1']
+    assert names(build(['-t', 'search,write', '--sort', 'queue:search']).select_nodes(rows)) == ['es1', 'es2']
+
+
+def test_filter_matches_every_term_by_value_or_glob():
+    stat = build(['--filter', 'role=DATA,name=~es[1-3]', '--sort', 'heap'])
+    assert names(stat.select_nodes(NODES)) == ['es2', 'es1', 'es3']
+
+
+@pytest.mark.parametrize('options', [['--sort', 'bogus'], ['--sort', 'disk', '-c', 'jvm'], ['--filter', 'bogus=1']])
+def test_bad_sort_or_filter_is_refused(options):
+    with pytest.raises(elasticstat.argparse.ArgumentTypeError):
+        build(options)
+
+
+def test_bad_sort_is_reported_as_a_usage_error(monkeypatch, capsys):
+    monkeypatch.setattr(elasticstat.Elasticstat, '_build_client', lambda self, hostlist, args: InfoClient())
+    monkeypatch.setattr(sys, 'argv', ['elasticstat', '--discovery-ttl', '0', '--sort', 'disk', '-c', 'jvm'])
+    with pytest.raises(SystemExit) as exit_info:
+        elasticstat.main()
+    assert exit_info.value.code == 2
+    assert "error: sorting by disk needs disk_used_percent" in capsys.readouterr().err
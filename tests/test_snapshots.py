@@ -0,0 +1,241 @@
+import datetime
+import gzip
+import os
+import threading
+import time
+
+import pytest
+
+from elasticstat import elasticstat
+from elasticstat.elasticstat import SnapshotReader, SnapshotRecorder
+
+
+def record(path, times, chunk_ticks=2):
+    recorder = SnapshotRecorder(path, chunk_ticks=chunk_ticks)
+    for snapshot_time in times:
+        recorder.record({'time': snapshot_time, 'nodes_stats': {'nodes': {}}})
+    recorder.close()
+
+
+def times(snapshots):
+    return [snapshot['time'] for snapshot in snapshots]
+
+
+def test_round_trip(tmpdir):
+    path = str(tmpdir.join('rec.gz'))
+    record(path, [1, 2, 3, 4, 5])
+    reader = SnapshotReader(path)
+    assert [chunk_time for chunk_time, offset in reader.index] == [1, 3, 5]
+    assert times(reader.read()) == [1, 2, 3, 4, 5]
+    assert times(reader.read(start=3, end=5)) == [3, 4]
+
+
+def test_appending_to_a_recording(tmpdir):
+    path = str(tmpdir.join('rec.gz'))
+    record(path, [1, 2, 3])
+    record(path, [4, 5])
+    assert times(SnapshotReader(path).read()) == [1, 2, 3, 4, 5]
+    assert times(SnapshotReader(path).read(start=4)) == [4, 5]
+
+
+def test_truncated_tail_is_recovered(tmpdir):
+    path = str(tmpdir.join('rec.gz'))
+    record(path, range(1, 11), chunk_ticks=100)
+    size = os.path.getsize(path)
+    with open(path, 'r+b') as raw:
+        raw.truncate(size - 12)  # cut into the last gzip member's trailer and final block
+    recovered = times(SnapshotReader(path).read())
+    assert recovered == list(range(1, len(recovered) + 1))
+    assert len(recovered) >= 9
+
+
+def test_partly_written_last_tick_is_dropped(tmpdir):
+    path = str(tmpdir.join('rec.gz'))
+    record(path, [1, 2])
+    # a member holding half a tick, as left by being killed mid-write
+    with open(path, 'ab') as raw:
+        member = gzip.GzipFile(fileobj=raw, mode='wb')
+        member.write('{"time": 3, "nodes_st')
+        member.close()
+    assert times(SnapshotReader(path).read()) == [1, 2]
+
+
+def cut_short(path, cut=12):
+    """Cut into the last member's final block and trailer, as if elasticstat had been killed while recording"""
+    with open(path, 'r+b') as raw:
+        raw.truncate(os.path.getsize(path) - cut)
+
+
+def test_appending_after_a_recording_cut_short(tmpdir, capsys):
+    path = str(tmpdir.join('rec.gz'))
+    record(path, [1, 2, 3], chunk_ticks=100)
+    cut_short(path)
+    record(path, [4, 5])
+    assert times(SnapshotReader(path).read()) == [1, 2, 3, 4, 5]
+    assert capsys.readouterr().err == ""
+    with open(path, 'rb') as raw:
+        assert len(gzip.GzipFile(fileobj=raw, mode='rb').readlines()) == 5  # a valid gzip file again
+
+
+def test_unreadable_last_member_is_dropped_before_appending(tmpdir):
+    path = str(tmpdir.join('rec.gz'))
+    record(path, [1, 2])
+    record(path, [3])
+    cut_short(path, os.path.getsize(path) - SnapshotReader(path).index[-1][1] - 10)  # just its header is left
+    record(path, [4])
+    reader = SnapshotReader(path)
+    assert [chunk_time for chunk_time, offset in reader.index] == [1, 4]
+    assert times(reader.read()) == [1, 2, 4]
+
+
+def test_reading_skips_to_what_was_appended_after_a_recording_cut_short(tmpdir, monkeypatch, capsys):
+    path = str(tmpdir.join('rec.gz'))
+    record(path, [1, 2, 3], chunk_ticks=100)
+    cut_short(path)
+    monkeypatch.setattr(SnapshotRecorder, '_close_tail', lambda self: None)  # appended as before it was closed off
+    record(path, [4, 5])
+    assert times(SnapshotReader(path).read()) == [1, 2, 3, 4, 5]
+    assert "part of {0} can't be read".format(path) in capsys.readouterr().err
+    assert times(SnapshotReader(path).read(start=4)) == [4, 5]
+
+
+def test_missing_index_reads_from_the_start(tmpdir):
+    path = str(tmpdir.join('rec.gz'))
+    record(path, [1, 2, 3])
+    os.remove(path + '.idx')
+    reader = SnapshotReader(path)
+    assert reader.index == []
+    assert times(reader.read(start=2)) == [2, 3]
+
+
+def test_unwritable_path_fails_up_front(tmpdir):
+    with pytest.raises(IOError):
+        SnapshotRecorder(str(tmpdir.join('missing', 'rec.gz')))
+    os.mkdir(str(tmpdir.join('rec.gz.idx')))
+    with pytest.raises(IOError):
+        SnapshotRecorder(str(tmpdir.join('rec.gz')))
+
+
+class FailingFile(object):
+    def __init__(self, raw):
+        self.raw = raw
+
+    def write(self, data):
+        raise IOError(28, 'No space left on device')
+
+    def __getattr__(self, name):
+        return getattr(self.raw, name)
+
+
+def test_write_errors_are_counted_not_raised(tmpdir):
+    path = str(tmpdir.join('rec.gz'))
+    record(path, [1, 2])
+    recorder = SnapshotRecorder(path)
+    recorder.raw = FailingFile(recorder.raw)
+    for snapshot_time in [3, 4, 5]:
+        recorder.record({'time': snapshot_time})
+    recorder.close()
+    assert not recorder.writer.is_alive()
+    assert recorder.failed == 3
+    assert 'No space left on device' in recorder.summary()
+    assert times(SnapshotReader(path).read()) == [1, 2]
+
+
+def test_close_gives_up_on_a_stuck_writer(tmpdir):
+    recorder = SnapshotRecorder(str(tmpdir.join('rec.gz')), max_queued=2, close_timeout=0.1)
+    writing, stuck = threading.Event(), threading.Event()
+    recorder._append = lambda snapshot: writing.set() or stuck.wait()
+    recorder.record({'time': 0})
+    writing.wait()
+    for snapshot_time in range(1, 5):
+        recorder.record({'time': snapshot_time})
+    started = time.time()
+    recorder.close()
+    assert time.time() - started < 1
+    assert recorder.dropped == 2 + 2  # dropped by record(), then left queued
+    assert recorder.summary().startswith('elasticstat: 4 updates were not recorded')
+    stuck.set()
+
+
+def at(clock):
+    """The time of a clock time (HH:MM:SS.mmm) of the day recorded, in seconds since the epoch"""
+    clock_time = datetime.datetime.strptime(clock, '%H:%M:%S.%f')
+    return time.mktime(datetime.datetime.combine(datetime.date(2026, 3, 2), clock_time.time()).timetuple()) + \
+        clock_time.microsecond / 1e6
+
+
+def replayed(path, *options):
+    args = elasticstat.build_parser().parse_args(['--replay', path, '-o', os.devnull] + list(options))
+    stat = elasticstat.Elasticstat(args)
+    return [datetime.datetime.fromtimestamp(snapshot['time']).strftime('%H:%M:%S.%f')[:12] for snapshot in stat.replay_snapshots]
+
+
+@pytest.mark.parametrize('with_index', [True, False])
+def test_replay_between_times_of_day(tmpdir, with_index):
+    path = str(tmpdir.join('rec.gz'))
+    recorder = SnapshotRecorder(path, chunk_ticks=2)
+    for clock in ['02:09:30.000', '02:10:00.000', '02:10:59.500', '02:11:00.000', '02:11:00.500', '02:12:00.000']:
+        recorder.record({'time': at(clock), 'version': '7.10.2', 'nodes_stats': {'nodes': {}}})
+    recorder.close()
+    if not with_index:
+        os.remove(path + '.idx')
+    assert replayed(path, '--from', '02:10', '--to', '02:10') == ['02:10:00.000', '02:10:59.500']
+    assert replayed(path, '--from', '02:10:30', '--to', '02:11:00') == ['02:10:59.500', '02:11:00.000', '02:11:00.500']
+    assert replayed(path, '--from', '02:11') == ['02:11:00.000', '02:11:00.500', '02:12:00.000']
+    assert replayed(path, '--to', '02:09:59') == ['02:09:30.000']
+
+
+def record_jvm_only(path):
+    recorder = SnapshotRecorder(path)
+    node = {'name': 'es1', 'roles': ['data'], 'timestamp': 1000, 'jvm.mem.heap_used_percent': 40}
+    for snapshot_time, categories in [(1, ['general', 'jvm']), (2, None)]:
+        snapshot = {'time': snapshot_time, 'version': '7.10.2', 'timings': {}, 'errors': {}, 'node_records': True,
+                    'nodes_stats': {'nodes': {'n1': node}}}
+        if categories is not None:
+            # recorded before the categories were recorded along with the responses
+            snapshot.update(categories=categories, threadpools=['search'])
+        recorder.record(snapshot)
+    recorder.close()
+
+
+def replay_stat(path, *options):
+    args = elasticstat.build_parser().parse_args(['--replay', path, '-o', os.devnull] + list(options))
+    return elasticstat.Elasticstat(args)
+
+
+def test_replay_shows_only_the_categories_and_threadpools_recorded(tmpdir):
+    path = str(tmpdir.join('rec.gz'))
+    record_jvm_only(path)
+    stat = replay_stat(path)
+    assert (stat.categories, stat.threadpools) == (['general', 'jvm'], ['search'])
+    stat.now = 1
+    for snapshot in stat.replay_snapshots:
+        row = stat.process_tick(stat.replay_results(snapshot))[1][0]
+        assert row['heap_used_percent'] == 40
+        assert row['old_pool_used_bytes'] is None
+        assert stat.format_node(row).split()[:4] == ['es1', 'DATA', '40%', '-']
+
+
+@pytest.mark.parametrize('options, message', [
+    (['-c', 'os', 'jvm'], "only holds the general, jvm categories, not os"),
+    (['-t', 'write'], "only holds the search threadpools, not write"),
+])
+def test_replay_refuses_what_was_not_recorded(tmpdir, options, message):
+    path = str(tmpdir.join('rec.gz'))
+    record_jvm_only(path)
+    with pytest.raises(elasticstat.argparse.ArgumentTypeError) as error:
+        replay_stat(path, *options)
+    assert message in str(error.value)
+
+
+def test_replay_of_a_recording_without_its_categories_shows_what_it_holds(tmpdir):
+    path = str(tmpdir.join('rec.gz'))
+    record_jvm_only(path)
+    # from the second update, which does not say what it holds
+    stat = replay_stat(path, '--from', datetime.datetime.fromtimestamp(2).strftime('%H:%M:%S'))
+    assert 'connections' in stat.categories
+    stat.now = 2
+    for snapshot in stat.replay_snapshots:
+        row = stat.process_tick(stat.replay_results(snapshot))[1][0]
+        assert (row['heap_used_percent'], row['transport_server_open'], row['docs_count']) == (40, None, None)
+        stat.format_node(row)
@@ -0,0 +1,67 @@
+import pytest
+
+from elasticstat import elasticstat
+
+
+class FakeClock(object):
+    def __init__(self):
+        self.now = 100.0
+        self.slept = []
+
+    def monotonic(self):
+        return self.now
+
+    def sleep(self, seconds):
+        self.slept.append(seconds)
+        self.now += seconds
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = FakeClock()
+    monkeypatch.setattr(elasticstat, 'monotonic', clock.monotonic)
+    monkeypatch.setattr(elasticstat.time, 'sleep', clock.sleep)
+    return clock
+
+
+def test_ticks_start_on_the_grid(clock):
+    scheduler = elasticstat.TickScheduler(2)
+    scheduler.tick()
+    clock.now += 0.5  # the update's own work
+    scheduler.wait()
+    assert clock.slept == [1.5]
+    scheduler.tick()
+    assert scheduler.period == 2
+    assert scheduler.next_start == 104
+    assert scheduler.overruns == 0
+
+
+def test_overrun_skips_the_slots_it_spilled_into(clock):
+    scheduler = elasticstat.TickScheduler(2)
+    scheduler.tick()
+    clock.now += 5  # runs past its own slot and the next
+    scheduler.wait()
+    assert scheduler.overruns == 1
+    assert scheduler.next_start == 106
+    assert clock.slept == [1]
+    scheduler.tick()
+    assert scheduler.next_start == 108
+
+
+def test_overrun_ending_on_a_slot_boundary(clock):
+    scheduler = elasticstat.TickScheduler(2)
+    scheduler.tick()
+    clock.now += 4  # ends just as slot 2 starts
+    scheduler.wait()
+    assert scheduler.overruns == 1
+    assert scheduler.next_start == 106
+
+
+def test_set_interval_reanchors_the_grid(clock):
+    scheduler = elasticstat.TickScheduler(2)
+    scheduler.tick()
+    clock.now += 1
+    scheduler.set_interval(4)
+    assert scheduler.next_start == 104
+    scheduler.wait()
+    assert clock.slept == [3]
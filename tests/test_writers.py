@@ -0,0 +1,71 @@
+# -*- coding: utf-8 -*-
+import csv
+import json
+import StringIO
+
+from elasticstat import elasticstat
+from elasticstat.elasticstat import CSVWriter, JSONLinesWriter
+
+
+class Out(object):
+    """An output which keeps each write, and counts flushes"""
+
+    def __init__(self):
+        self.writes = []
+        self.flushes = 0
+
+    def write(self, data):
+        self.writes.append(data)
+
+    def flush(self):
+        self.flushes += 1
+
+
+CLUSTER_ROW = {'type': 'cluster', 'time': 1600000000.5, 'stale': False, 'status': 'green', 'error': None}
+NODE_ROWS = [{'type': 'node', 'node_id': 'n1', 'name': u'n\xf8de-1', 'stale': True, 'heap_used_percent': 42},
+             {'type': 'node', 'node_id': 'n2', 'name': 'node-2', 'stale': False, 'heap_used_percent': None}]
+
+
+def test_jsonl_writes_a_line_per_row_in_one_write_per_tick():
+    out = Out()
+    writer = JSONLinesWriter(out)
+    writer.write_tick(CLUSTER_ROW, NODE_ROWS)
+    writer.write_tick(CLUSTER_ROW, [])
+    assert (len(out.writes), out.flushes) == (2, 2)
+    lines = out.writes[0].splitlines()
+    assert [json.loads(line) for line in lines] == [CLUSTER_ROW] + NODE_ROWS
+    assert ' ' not in lines[0]  # compact separators
+    assert out.writes[1].count("\n") == 1
+
+
+def test_csv_writes_the_header_once_and_a_row_per_row():
+    out = Out()
+    writer = CSVWriter(out, ['type', 'node_id', 'name', 'stale', 'status', 'heap_used_percent'])
+    writer.write_tick(CLUSTER_ROW, NODE_ROWS)
+    writer.write_tick(CLUSTER_ROW, [])
+    assert (len(out.writes), out.flushes) == (2, 2)
+    rows = list(csv.reader(StringIO.StringIO(out.writes[0])))
+    assert rows == [['type', 'node_id', 'name', 'stale', 'status', 'heap_used_percent'],
+                    ['cluster', '', '', '0', 'green', ''],
+                    ['node', 'n1', u'n\xf8de-1'.encode('utf-8'), '1', '', '42'],
+                    ['node', 'n2', 'node-2', '0', '', '']]
+    assert list(csv.reader(StringIO.StringIO(out.writes[1]))) == [['cluster', '', '', '0', 'green', '']]
+
+
+def test_csv_columns_are_the_row_cluster_and_node_fields():
+    fields = elasticstat.csv_fields(['name', 'heap_used_percent'])
+    assert fields[:len(elasticstat.ROW_FIELDS)] == elasticstat.ROW_FIELDS
+    assert fields[-2:] == ['name', 'heap_used_percent']
+    assert 'status' in fields and 'interval' in fields
+
+
+def test_writer_for_each_output_format(tmpdir):
+    assert elasticstat.build_writer('table', None, ['name']) is None
+    assert isinstance(elasticstat.build_writer('jsonl', '-', ['name']), JSONLinesWriter)
+    path = str(tmpdir.join('out.csv'))
+    writer = elasticstat.build_writer('csv', path, ['name'])
+    writer.write_tick(CLUSTER_ROW, NODE_ROWS[1:])
+    writer.out.close()
+    with open(path) as out:
+        rows = list(csv.DictReader(out))
+    assert [row['name'] for row in rows] == ['', 'node-2']